@@ -0,0 +1,263 @@
+# benchmark_pipeline.py
+import json
+
+from benchmark_runner import run_benchmark
+from prediction_store import PredictionJournal
+from prompt_cache import SlotPinner, CacheStats
+from inference_client import InferenceClient
+from completion_cache import CompletionCache, QuestionMemo
+from self_consistency import ExecutionVoter, sample_candidates
+from evaluate_execution import RESULT_CACHE_PATH
+from result_cache import ResultCache
+from prompt_budget import TokenCounter, PromptBuilder
+from llama_cpp_backend import LlamaCppBackend, LlamaTokenCounter
+from instrumentation import Tracer
+from sql_grammar import load_schema, grammar_for_schema
+
+# --- Configuration ---
+# Settings shared by run_benchmark.py, run_benchmark_rag.py and run_benchmark_rag_with_schema_pruning.py;
+# the runners only set their own files and prompts.
+# One or more llama-server instances; requests go to the least-loaded healthy one
+SERVER_URLS = ["http://localhost:8081/completion"]
+MAX_TOKENS = 2048
+# Parallel slots per server (start llama-server with a matching --parallel/-np)
+SLOTS_PER_SERVER = 4
+# Number of questions in flight at once across all servers
+CONCURRENCY = SLOTS_PER_SERVER * len(SERVER_URLS)
+# Predictions are journaled to a .jsonl next to the prediction file and fsynced every N records
+JOURNAL_FSYNC_EVERY = 20
+# Keep the static prompt prefix in the server's KV cache (cache_prompt; each request goes to a free slot,
+# preferably the one its worker used last)
+PREFIX_CACHE_MODE = True
+# Stream tokens and cancel generation as soon as a complete SQL statement has been produced
+STREAM_EARLY_STOP = True
+# Send each distinct (template, val_dict, question) only once and answer repeated prompts,
+# also across runs, from a local size-bounded LRU cache. Entries are keyed by the served model
+# (the GGUF path from /props, or GGUF_MODEL_PATH's path, size and mtime) and the full request;
+# off by default so a benchmark run always measures the model
+DEDUP_MODE = False
+COMPLETION_CACHE_MAX_MB = 256
+# Self-consistency: sample N seeded completions per question, execute their SQL and keep the
+# answer whose result set most samples agree on (1 = a single completion per question)
+SELF_CONSISTENCY_SAMPLES = 1
+SAMPLE_TEMPERATURE = 0.7
+VOTE_WORKERS = 4
+# Fit every prompt into the server context: count tokens via /tokenize, drop the least relevant
+# tables/examples if needed and use the remaining context as n_predict (capped at MAX_TOKENS)
+TOKEN_BUDGET_MODE = True
+# Must match llama-server's -c
+CONTEXT_SIZE = 4096
+# "server": send requests to llama-server over HTTP
+# "llama_cpp": load GGUF_MODEL_PATH in-process with llama-cpp-python (CPU-only, no server needed);
+#              SLOTS_PER_SERVER sequences share one context and are decoded together in one batch
+INFERENCE_BACKEND = "server"
+GGUF_MODEL_PATH = "./models/finetuned-arctic-7b-Q4_K_S.gguf"
+# CPU threads (None = all cores) and the maximum number of tokens per decoded batch
+N_THREADS = None
+N_BATCH = 512
+# Database the sampled queries are executed against
+DB_PATH = "./evaluation_data/mimic_iv.sqlite"
+# Constrain decoding with a GBNF grammar generated from the schema: SQLite SELECT syntax over the
+# real MIMIC-IV tables and columns, ending in ';' (or "null"). Cached per schema hash in GRAMMAR_CACHE_DIR
+GRAMMAR_MODE = False
+GRAMMAR_CACHE_DIR = "./input/res/grammars"
+STOP_WORDS = ["###"]
+
+
+def load_benchmark(benchmark_path: str):
+    """Reads the benchmark questions. Returns None if the file does not exist."""
+    try:
+        with open(benchmark_path, "r", encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        print(f"Error: Benchmark file not found at '{benchmark_path}'")
+        return None
+
+
+class SkippedItem:
+    """Returned instead of a prediction for a question that is not sent to the model."""
+
+    def __init__(self, reason: str):
+        self.reason = reason
+
+
+class BenchmarkPipeline:
+    """
+    Everything the benchmark runners share: the inference backend, token counter
+    and prompt builder, prefix caching, grammar, self-consistency voting,
+    completion cache and tracing, and the resumable predict/journal/report loop.
+
+    A runner only supplies build_prompt(item, context) -> (prompt, n_predict),
+    which raises ValueError when the question does not fit into the context, and
+    the context it needs (schema text, examples, ...). Keyword arguments override
+    the shared settings above, e.g. to point the pipeline at other servers.
+    """
+
+    def __init__(self, prompt_template: str, prediction_path: str, trace_path: str = None,
+                 completion_cache_path: str = None, grammar_schema_path: str = None, db_path: str = DB_PATH,
+                 backend: str = INFERENCE_BACKEND, server_urls: list = None,
+                 slots_per_server: int = SLOTS_PER_SERVER, concurrency: int = None,
+                 stream_early_stop: bool = STREAM_EARLY_STOP, prefix_cache_mode: bool = PREFIX_CACHE_MODE):
+        self.prediction_path = prediction_path
+        self.backend = backend
+        self.server_urls = server_urls or SERVER_URLS
+        self.concurrency = concurrency or slots_per_server * len(self.server_urls)
+        self.prefix_cache_mode = prefix_cache_mode
+        self.token_budget_mode = TOKEN_BUDGET_MODE
+        self.max_tokens = MAX_TOKENS
+
+        self.completion_cache = (CompletionCache(completion_cache_path, COMPLETION_CACHE_MAX_MB * 1024 * 1024)
+                                 if DEDUP_MODE else None)
+        if backend == "llama_cpp":
+            self.client = LlamaCppBackend(GGUF_MODEL_PATH, n_sequences=slots_per_server, n_ctx=CONTEXT_SIZE,
+                                          n_threads=N_THREADS, n_batch=N_BATCH, stream_early_stop=stream_early_stop,
+                                          completion_cache=self.completion_cache)
+            self.token_counter = LlamaTokenCounter(self.client)
+        else:
+            self.client = InferenceClient(self.server_urls, pool_size=self.concurrency,
+                                          stream_early_stop=stream_early_stop,
+                                          completion_cache=self.completion_cache, slots_per_server=slots_per_server)
+            self.token_counter = TokenCounter(self.server_urls[0], session=self.client.session)
+        self.slot_pinner = SlotPinner(slots_per_server)
+        self.cache_stats = CacheStats()
+        self.voter = (ExecutionVoter(db_path, VOTE_WORKERS, cache=ResultCache(RESULT_CACHE_PATH, db_path))
+                      if SELF_CONSISTENCY_SAMPLES > 1 else None)
+        self.prompt_builder = PromptBuilder(self.token_counter, prompt_template,
+                                            CONTEXT_SIZE, max_new_tokens=MAX_TOKENS)
+        self.grammar = (grammar_for_schema(load_schema(grammar_schema_path), GRAMMAR_CACHE_DIR)
+                        if GRAMMAR_MODE else None)
+        self.tracer = Tracer(trace_path, label=f"{backend}: {prediction_path}")
+
+    def complete(self, prompt: str, n_predict: int):
+        """Sends one prompt (or SELF_CONSISTENCY_SAMPLES samples of it) to the backend. Returns None if the request failed."""
+        data = {
+            "prompt": prompt,
+            "n_predict": n_predict,
+            "stop": STOP_WORDS
+        }
+        if self.prefix_cache_mode:
+            # Reuse the KV cache of the shared prompt prefix on the slot the request is sent to
+            data.update(self.slot_pinner.request_fields())
+        if self.grammar:
+            data["grammar"] = self.grammar
+
+        with self.tracer.span("inference"):
+            if self.voter is not None:
+                results = sample_candidates(self.client, data, SELF_CONSISTENCY_SAMPLES, SAMPLE_TEMPERATURE)
+            else:
+                results = [self.client.complete(data)]
+        completions = [result for result in results if result["ok"]]
+        if not completions:
+            print(f"Error communicating with server: {results[0]['error']}")
+            return None
+        for result in completions:
+            self.cache_stats.record(result["response"])
+            self.tracer.record_request(result)
+        if self.voter is not None:
+            with self.tracer.span("vote"):
+                return self.voter.vote([result["content"] for result in completions])["content"]
+        return completions[0]["content"]
+
+    def answer(self, item: dict, build_prompt, context):
+        """
+        Builds the prompt for one benchmark item and completes it. Returns None if
+        the request failed and a SkippedItem if the prompt does not fit into the context.
+        """
+        with self.tracer.item(item["id"]):
+            with self.tracer.span("prompt"):
+                try:
+                    prompt, n_predict = build_prompt(item, context)
+                except ValueError as e:
+                    # The question does not fit into CONTEXT_SIZE even without the optional sections
+                    return SkippedItem(f"over budget: {e}")
+            return self.complete(prompt, n_predict)
+
+    def check_health(self) -> int:
+        """Prints and returns the number of healthy servers (or in-process batched sequences)."""
+        healthy_servers = self.client.check_health()
+        if self.backend == "llama_cpp":
+            print(f"In-process llama.cpp backend ready with {healthy_servers} batched sequence(s).")
+        else:
+            print(f"{healthy_servers}/{len(self.server_urls)} llama-server instance(s) healthy.")
+        if not healthy_servers:
+            print("Warning: No server answered /health. Requests will be retried and failures resumed later.")
+        return healthy_servers
+
+    def run(self, benchmark_data: list, build_prompt, context, title: str = "Starting benchmark..."):
+        """
+        Predicts every benchmark item that is not in the prediction journal yet,
+        journals each prediction as it completes, compacts the journal into the
+        {id: sql} JSON expected by EHRSQL's evaluate.py and prints the reports.
+        """
+        # Resume from the prediction journal (and any previously compacted prediction file)
+        journal = PredictionJournal(self.prediction_path, fsync_every=JOURNAL_FSYNC_EVERY)
+        predictions_dict = journal.load()
+        if predictions_dict:
+            print(f"Resuming with {len(predictions_dict)} existing predictions from: {journal.journal_path}")
+
+        self.check_health()
+        print(title)
+
+        processed_count = 0
+        skipped_count = 0
+
+        def predict(item):
+            return self.answer(item, build_prompt, context)
+
+        def save_result(i, item, generated_sql):
+            nonlocal processed_count, skipped_count
+            item_id = item["id"]
+            if generated_sql is None:
+                # Failed requests are not persisted, so the next run retries them
+                print(f"--- Failed (Total: {i+1}/{len(benchmark_data)}) (ID: {item_id}), will be retried on resume ---\n")
+                return
+            if isinstance(generated_sql, SkippedItem):
+                # Journaled as skipped, so resuming does not send it again and it is scored as wrong, not missing
+                skipped_count += 1
+                print(f"--- Skipped (Total: {i+1}/{len(benchmark_data)}) (ID: {item_id}), {generated_sql.reason} ---\n")
+                predictions_dict[item_id] = ""
+                with self.tracer.item(item_id), self.tracer.span("persist"):
+                    journal.append(item_id, "", skipped=generated_sql.reason)
+                return
+            predictions_dict[item_id] = generated_sql
+
+            processed_count += 1
+            print(f"--- Processed {processed_count} (Total: {i+1}/{len(benchmark_data)}) (ID: {item_id}) ---")
+            print(f"Question: {item['question']}")
+            # Encode to UTF-8 and decode back, replacing characters that can't be handled by the console
+            printable_sql = generated_sql.encode('utf-8', 'replace').decode('utf-8')
+            print(f"Generated SQL: {printable_sql}\n")
+
+            # Append progress to the journal after each prediction
+            with self.tracer.item(item_id), self.tracer.span("persist"):
+                journal.append(item_id, generated_sql)
+
+        if DEDUP_MODE:
+            predict = QuestionMemo(predict)
+
+        try:
+            run_benchmark(benchmark_data, predictions_dict, predict, save_result, concurrency=self.concurrency)
+        finally:
+            # Compact the journal into the {id: sql} JSON expected by EHRSQL's evaluate.py
+            journal.close()
+            with self.tracer.span("compact"):
+                journal.compact(predictions_dict)
+            self.tracer.close()
+            if self.voter is not None:
+                self.voter.close()
+                self.voter.cache.close()
+
+        print(self.client.report())
+        if self.voter is not None:
+            print(self.voter.report())
+        if self.token_budget_mode:
+            print(self.prompt_builder.report())
+        if DEDUP_MODE:
+            print(f"Duplicate questions served from earlier predictions: {predict.hits}")
+        if self.prefix_cache_mode:
+            print(self.cache_stats.report())
+        print(self.tracer.report())
+        if journal.skipped:
+            print(f"Skipped {skipped_count} question(s) in this run, {len(journal.skipped)} in total; "
+                  f"they are saved as empty predictions.")
+        print(f"Benchmark finished. Predictions saved to {self.prediction_path}")
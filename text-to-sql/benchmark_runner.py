@@ -0,0 +1,59 @@
+# benchmark_runner.py
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+def iter_pending_items(benchmark_data: list, predictions_dict: dict):
+    """
+    Yields (index, item) for every benchmark item that still needs a prediction.
+    Items without a question or id are skipped, as are items that already have
+    a prediction (resume behaviour).
+    """
+    for i, item in enumerate(benchmark_data):
+        question = item.get("question")
+        item_id = item.get("id")
+
+        if not question or not item_id:
+            print(f"Skipping item {i+1} due to missing data.")
+            continue
+        if item_id in predictions_dict:
+            continue
+        yield i, item
+
+
+def run_benchmark(benchmark_data: list, predictions_dict: dict, predict_fn, on_result, concurrency: int = 1):
+    """
+    Runs predict_fn(item) for every pending benchmark item using a pool of
+    'concurrency' worker threads, so several llama-server slots are busy at once.
+
+    At most 2 * concurrency items are in flight at any time. Results are handed
+    to on_result(index, item, generated_sql) on the calling thread in benchmark
+    order, so the printed log and the saved prediction file look exactly like a
+    sequential run. Returns the number of newly processed items.
+    """
+    concurrency = max(1, int(concurrency))
+    max_in_flight = 2 * concurrency
+    pending = iter_pending_items(benchmark_data, predictions_dict)
+    in_flight = deque()
+    processed_count = 0
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        def submit_next() -> bool:
+            for i, item in pending:
+                in_flight.append((i, item, pool.submit(predict_fn, item)))
+                return True
+            return False
+
+        while len(in_flight) < max_in_flight and submit_next():
+            pass
+
+        while in_flight:
+            # Wait for the oldest request first to keep output order stable
+            i, item, future = in_flight.popleft()
+            generated_sql = future.result()
+            submit_next()
+
+            on_result(i, item, generated_sql)
+            processed_count += 1
+
+    return processed_count
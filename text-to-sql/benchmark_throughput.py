@@ -0,0 +1,207 @@
+# benchmark_throughput.py
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import tempfile
+import argparse
+import importlib
+
+from benchmark_runner import run_benchmark
+from prediction_store import PredictionJournal
+from prompt_cache import CacheStats
+from benchmark_pipeline import SkippedItem, JOURNAL_FSYNC_EVERY, PREFIX_CACHE_MODE, SLOTS_PER_SERVER, STREAM_EARLY_STOP
+from instrumentation import Tracer, percentile
+from mock_llama_server import MockLlamaServer, load_replay_answers, REPLAY_FILE_PATH, BENCHMARK_FILE_PATH
+
+sys.stdout.reconfigure(encoding='utf-8')
+
+# --- Configuration ---
+# Runner modules whose prompt construction is benchmarked with the shared pipeline settings
+RUNNERS = {"base": "run_benchmark", "rag": "run_benchmark_rag", "pruning": "run_benchmark_rag_with_schema_pruning"}
+# DDL used to build a schema-only database when the runner's DB_PATH does not exist
+SCHEMA_PATH = "./evaluation_data/mimic_iv.sql"
+REPORT_FILE_PATH = "./input/res/throughput_report.json"
+
+
+def attach_mock_servers(runner, server_urls: list, slots_per_server: int, concurrency: int, stream: bool,
+                        prefix_cache: bool):
+    """
+    Replaces the runner's pipeline with one that talks to the mock servers.
+    Everything else (prompt template, token budget, stop words, n_predict)
+    stays as configured in the runner and benchmark_pipeline.py.
+    """
+    runner.pipeline.client.close()
+    runner.pipeline = runner.make_pipeline(backend="server", server_urls=server_urls,
+                                           slots_per_server=slots_per_server, concurrency=concurrency,
+                                           stream_early_stop=stream, prefix_cache_mode=prefix_cache,
+                                           trace_path=None)
+    runner.pipeline.client.backoff_seconds = 0.05
+
+
+def build_schema_database(schema_path: str, work_dir: str) -> str:
+    """Creates an empty SQLite database with the tables of a DDL script and returns its path."""
+    db_path = os.path.join(work_dir, "schema.sqlite")
+    with open(schema_path, 'r', encoding='utf-8') as f:
+        ddl = f.read()
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.executescript(ddl)
+    finally:
+        conn.close()
+    return db_path
+
+
+def make_predict(runner, benchmark_data: list, schema_path: str, work_dir: str):
+    """predict(item) that builds the prompt with the runner's own build_prompt, prepared like the runner's main()."""
+    if hasattr(runner, "DB_PATH") and not os.path.exists(runner.DB_PATH):
+        # Only the schema goes into the prompt, so the tables do not need any rows
+        print(f"{runner.DB_PATH} not found, using a schema-only database built from {schema_path}.")
+        runner.DB_PATH = build_schema_database(schema_path, work_dir)
+    context = runner.load_context(benchmark_data)
+
+    def predict(item):
+        return runner.pipeline.answer(item, runner.build_prompt, context)
+    return predict
+
+
+def run_pass(benchmark_data, runner, predict, prediction_path, concurrency, stop_after: int = None) -> dict:
+    """
+    One runner pass over benchmark_data with the same building blocks as the
+    runners (run_benchmark, PredictionJournal and the runner's pipeline). With stop_after the pass is aborted after that many results,
+    like a run killed mid-way.
+    """
+    journal = PredictionJournal(prediction_path, fsync_every=JOURNAL_FSYNC_EVERY)
+    predictions = journal.load()
+    resumed = len(predictions)
+    # Fresh statistics per pass; the runner's pipeline records into these
+    runner.pipeline.cache_stats = CacheStats()
+    runner.pipeline.tracer = Tracer(label="throughput pass")
+
+    class StopPass(Exception):
+        pass
+
+    def save_result(i, item, generated_sql):
+        if generated_sql is None:
+            return
+        if isinstance(generated_sql, SkippedItem):
+            predictions[item["id"]] = ""
+            journal.append(item["id"], "", skipped=generated_sql.reason)
+        else:
+            predictions[item["id"]] = generated_sql
+            journal.append(item["id"], generated_sql)
+        if stop_after is not None and len(predictions) - resumed >= stop_after:
+            raise StopPass()
+
+    start = time.perf_counter()
+    try:
+        run_benchmark(benchmark_data, predictions, predict, save_result, concurrency=concurrency)
+    except StopPass:
+        pass
+    finally:
+        journal.close()
+        if stop_after is None:
+            journal.compact(predictions)
+    elapsed = time.perf_counter() - start
+
+    latencies = [event["latency"] for event in runner.pipeline.tracer.events
+                 if event["type"] == "request" and event.get("latency") is not None]
+    new = len(predictions) - resumed
+    return {"resumed": resumed, "new_predictions": new, "elapsed_seconds": elapsed,
+            "questions_per_second": new / elapsed if elapsed else 0.0,
+            "latency_p50": percentile(latencies, 50), "latency_p95": percentile(latencies, 95),
+            "latency_p99": percentile(latencies, 99), "latency_max": max(latencies, default=0.0),
+            "cache": runner.pipeline.cache_stats.report()}
+
+
+def main():
+    """
+    Starts mock llama-server instances in-process and measures a runner's
+    throughput, tail latency and resume behaviour against them, without a GPU
+    or a model. The prompts are built by the runner's own build_prompt.
+    """
+    parser = argparse.ArgumentParser(description="Offline throughput benchmark against mock llama-servers.")
+    parser.add_argument("--runner", choices=sorted(RUNNERS), default="base",
+                        help="base: run_benchmark.py, rag: run_benchmark_rag.py, "
+                             "pruning: run_benchmark_rag_with_schema_pruning.py")
+    parser.add_argument("--replay_file", default=REPLAY_FILE_PATH)
+    parser.add_argument("--benchmark_file", default=BENCHMARK_FILE_PATH)
+    parser.add_argument("--schema_file", default=SCHEMA_PATH,
+                        help="DDL for a schema-only database if the runner's DB_PATH does not exist.")
+    parser.add_argument("--report_file", default=REPORT_FILE_PATH)
+    parser.add_argument("--limit", type=int, default=200, help="Number of benchmark questions to run.")
+    parser.add_argument("--servers", type=int, default=1)
+    parser.add_argument("--slots", type=int, default=None, help="Slots per mock server. Default: SLOTS_PER_SERVER.")
+    parser.add_argument("--concurrency", type=int, default=None, help="Default: servers * slots.")
+    parser.add_argument("--decode_tps", type=float, default=200.0)
+    parser.add_argument("--prefill_tps", type=float, default=5000.0)
+    parser.add_argument("--latency_mean", type=float, default=0.02)
+    parser.add_argument("--latency_std", type=float, default=0.01)
+    parser.add_argument("--failure_rate", type=float, default=0.0)
+    parser.add_argument("--stream", choices=["on", "off"], default=None,
+                        help="Streaming with early stop. Default: STREAM_EARLY_STOP.")
+    parser.add_argument("--no_prefix_cache", action="store_true")
+    parser.add_argument("--interrupt_after", type=int, default=None,
+                        help="Abort the first pass after N predictions and resume in a second pass.")
+    args = parser.parse_args()
+
+    with open(args.benchmark_file, 'r', encoding='utf-8') as f:
+        benchmark_data = json.load(f)[:args.limit]
+    answers = load_replay_answers(args.replay_file, args.benchmark_file)
+
+    runner = importlib.import_module(RUNNERS[args.runner])
+    slots = args.slots or SLOTS_PER_SERVER
+    stream = STREAM_EARLY_STOP if args.stream is None else args.stream == "on"
+    servers = [MockLlamaServer(answers, port=0, n_slots=slots, prefill_tps=args.prefill_tps,
+                               decode_tps=args.decode_tps, latency_mean=args.latency_mean,
+                               latency_std=args.latency_std, failure_rate=args.failure_rate).start()
+               for _ in range(args.servers)]
+    concurrency = args.concurrency or args.servers * slots
+    attach_mock_servers(runner, [server.url for server in servers], slots, concurrency, stream,
+                        prefix_cache=PREFIX_CACHE_MODE and not args.no_prefix_cache)
+    work_dir = tempfile.mkdtemp(prefix="throughput_")
+    prediction_path = os.path.join(work_dir, "prediction.json")
+
+    print(f"Running {len(benchmark_data)} questions through {RUNNERS[args.runner]}.py against {args.servers} "
+          f"mock server(s) x {slots} slots, concurrency {concurrency}{', streaming' if stream else ''}...")
+    passes = []
+    try:
+        predict = make_predict(runner, benchmark_data, args.schema_file, work_dir)
+        if args.interrupt_after:
+            passes.append(run_pass(benchmark_data, runner, predict, prediction_path, concurrency,
+                                   stop_after=args.interrupt_after))
+        passes.append(run_pass(benchmark_data, runner, predict, prediction_path, concurrency))
+        with open(prediction_path, 'r', encoding='utf-8') as f:
+            final_predictions = json.load(f)
+    finally:
+        runner.pipeline.client.close()
+        for server in servers:
+            server.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    expected = {item["id"] for item in benchmark_data if item.get("id") and item.get("question")}
+    resume_ok = set(final_predictions) == expected
+    for number, result in enumerate(passes, 1):
+        print(f"\n--- Pass {number} ---")
+        print(f"Resumed {result['resumed']}, predicted {result['new_predictions']} in "
+              f"{result['elapsed_seconds']:.2f}s ({result['questions_per_second']:.1f} questions/s)")
+        print(f"Latency p50 {result['latency_p50']:.3f}s, p95 {result['latency_p95']:.3f}s, "
+              f"p99 {result['latency_p99']:.3f}s, max {result['latency_max']:.3f}s")
+        print(result["cache"])
+    print()
+    print(runner.pipeline.client.report())
+    for server in servers:
+        print(server.report())
+    print(f"{'✅' if resume_ok else '❌'} Final prediction file covers {len(final_predictions)}/{len(expected)} questions.")
+
+    os.makedirs(os.path.dirname(args.report_file) or ".", exist_ok=True)
+    with open(args.report_file, 'w', encoding='utf-8') as f:
+        json.dump({"config": vars(args), "passes": passes, "resume_ok": resume_ok,
+                   "servers": [server.stats for server in servers]}, f, indent=2)
+    print(f"Report saved to: {args.report_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+# build_eval_indexes.py
+import os
+import re
+import sys
+import json
+import time
+import sqlite3
+import argparse
+from collections import Counter
+
+from evaluate_execution import connect_read_only, execute_query, is_null_query, QUERY_TIMEOUT_SECONDS
+from result_cache import normalize_sql
+
+sys.stdout.reconfigure(encoding='utf-8')
+
+# --- Configuration ---
+DB_PATH = "./evaluation_data/mimic_iv.sqlite"
+BENCHMARK_FILE_PATH = "./evaluation_data/annotated.json"
+# The indexed copy; point evaluate_execution.py --db_path at it (the original stays untouched)
+OUTPUT_DB_PATH = "./evaluation_data/mimic_iv_indexed.sqlite"
+REPORT_FILE_PATH = "./evaluation_data/index_report.json"
+# A column becomes an index candidate if at least this many workload queries filter or join on it
+MIN_PREDICATE_COUNT = 3
+
+TABLE_REF_PATTERN = re.compile(r"\b(?:FROM|JOIN)\s+([A-Za-z_]\w*)(?:\s+(?:AS\s+)?([A-Za-z_]\w*))?", re.IGNORECASE)
+# alias.column followed by a comparison: the column is filtered or joined on directly (not inside a function)
+PREDICATE_PATTERN = re.compile(
+    r"\b([A-Za-z_]\w*)\.([A-Za-z_]\w*)\s*(?:=|==|!=|<>|<=|>=|<|>|\bIN\b|\bBETWEEN\b|\bIS\b|\bLIKE\b)",
+    re.IGNORECASE)
+# The right-hand side of a join condition: "... = alias.column"
+JOIN_RHS_PATTERN = re.compile(r"=\s*([A-Za-z_]\w*)\.([A-Za-z_]\w*)")
+NOT_AN_ALIAS = {"where", "join", "on", "inner", "left", "right", "outer", "cross", "group", "order", "limit",
+                "union", "intersect", "except", "natural", "using", "having", "window"}
+INDEX_USE_PATTERN = re.compile(r"USING (?:COVERING )?INDEX (\w+)")
+
+
+def predicate_columns(sql: str, table_columns: dict) -> set:
+    """(table, column) pairs the query compares directly in WHERE/ON clauses."""
+    aliases = {}
+    for table, alias in TABLE_REF_PATTERN.findall(sql):
+        if table.lower() in table_columns:
+            aliases[table.lower()] = table.lower()
+            if alias and alias.lower() not in NOT_AN_ALIAS:
+                aliases[alias.lower()] = table.lower()
+
+    found = set()
+    for qualifier, column in PREDICATE_PATTERN.findall(sql) + JOIN_RHS_PATTERN.findall(sql):
+        table = aliases.get(qualifier.lower())
+        if table and column.lower() in table_columns[table]:
+            found.add((table, column.lower()))
+    return found
+
+
+def existing_leading_columns(conn: sqlite3.Connection) -> set:
+    """(table, column) pairs that already lead an index (primary keys, UNIQUE constraints, ...)."""
+    leading = set()
+    tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+    for table in tables:
+        for index in conn.execute("SELECT name FROM pragma_index_list(?)", (table,)).fetchall():
+            first = conn.execute("SELECT name FROM pragma_index_info(?) WHERE seqno = 0", (index[0],)).fetchone()
+            if first and first[0]:
+                leading.add((table.lower(), first[0].lower()))
+        # INTEGER PRIMARY KEY columns are the rowid itself
+        for name, type_, pk in conn.execute("SELECT name, type, pk FROM pragma_table_info(?)", (table,)):
+            if pk == 1 and type_.upper() == "INTEGER":
+                leading.add((table.lower(), name.lower()))
+    return leading
+
+
+def time_workload(db_path: str, queries: list, timeout: float) -> list:
+    """Executes every query once, sequentially; returns [{"seconds", "status", "digest"}]."""
+    conn = connect_read_only(db_path)
+    timings = []
+    try:
+        for sql in queries:
+            start = time.perf_counter()
+            summary = execute_query(conn, sql, timeout)
+            timings.append({"seconds": time.perf_counter() - start, "status": summary["status"],
+                            "digest": summary["digest"]})
+    finally:
+        conn.close()
+    return timings
+
+
+def summarize(timings: list) -> dict:
+    seconds = sorted(t["seconds"] for t in timings)
+    if not seconds:
+        return {"total": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+    return {"total": sum(seconds), "p50": seconds[len(seconds) // 2],
+            "p95": seconds[min(len(seconds) - 1, int(len(seconds) * 0.95))], "max": seconds[-1]}
+
+
+def main():
+    """
+    Derives single-column indexes from the benchmark's gold queries, keeps those
+    SQLite's planner actually uses, and writes them with ANALYZE statistics into a
+    copy of the evaluation database. Reports workload timings before and after.
+    """
+    parser = argparse.ArgumentParser(description="Build workload-derived indexes into a copy of the evaluation DB.")
+    parser.add_argument("--db_path", default=DB_PATH)
+    parser.add_argument("--data_file", default=BENCHMARK_FILE_PATH)
+    parser.add_argument("--output_db", default=OUTPUT_DB_PATH)
+    parser.add_argument("--report_file", default=REPORT_FILE_PATH)
+    parser.add_argument("--min_count", type=int, default=MIN_PREDICATE_COUNT)
+    parser.add_argument("--timeout", type=float, default=QUERY_TIMEOUT_SECONDS)
+    parser.add_argument("--skip_timing", action="store_true", help="Only build the indexes.")
+    args = parser.parse_args()
+
+    for path in (args.db_path, args.data_file):
+        if not os.path.exists(path):
+            print(f"ERROR: File not found at '{path}'")
+            return
+
+    with open(args.data_file, 'r', encoding='utf-8') as f:
+        benchmark_data = json.load(f)
+    distinct = {}
+    for item in benchmark_data:
+        if not is_null_query(item.get("query")):
+            distinct.setdefault(normalize_sql(item["query"]), item["query"])
+    queries = list(distinct.values())
+
+    # --- 1. Derive candidate columns from the workload ---
+    source = connect_read_only(args.db_path)
+    table_columns = {}
+    for (table,) in source.execute("SELECT name FROM sqlite_master WHERE type = 'table'"):
+        table_columns[table.lower()] = {row[0].lower() for row in source.execute(
+            "SELECT name FROM pragma_table_info(?)", (table,))}
+    usage = Counter()
+    for sql in queries:
+        usage.update(predicate_columns(sql, table_columns))
+    already_indexed = existing_leading_columns(source)
+    candidates = [(table, column) for (table, column), count in usage.most_common()
+                  if count >= args.min_count and (table, column) not in already_indexed]
+    print(f"{len(queries)} distinct gold queries, {len(usage)} filtered/joined columns, "
+          f"{len(candidates)} index candidates.")
+
+    # --- 2. Copy the database with the backup API ---
+    print(f"Copying {args.db_path} -> {args.output_db} ...")
+    if os.path.exists(args.output_db):
+        os.remove(args.output_db)
+    target = sqlite3.connect(args.output_db)
+    source.backup(target)
+    source.close()
+
+    # --- 3. Build the candidates, keep only those the planner picks ---
+    start = time.perf_counter()
+    names = {}
+    for table, column in candidates:
+        name = f"eval_idx_{table}_{column}"
+        target.execute(f'CREATE INDEX IF NOT EXISTS "{name}" ON "{table}"("{column}")')
+        names[name] = (table, column)
+    target.execute("ANALYZE")
+    target.commit()
+
+    used = Counter()
+    for sql in queries:
+        try:
+            plan = target.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+        except sqlite3.Error:
+            continue
+        used.update({name for row in plan for name in INDEX_USE_PATTERN.findall(row[-1]) if name in names})
+    unused = [name for name in names if not used[name]]
+    for name in unused:
+        target.execute(f'DROP INDEX "{name}"')
+    target.execute("ANALYZE")
+    target.commit()
+    target.execute("VACUUM")
+    target.close()
+    build_seconds = time.perf_counter() - start
+
+    kept = [{"index": name, "table": names[name][0], "column": names[name][1],
+             "predicate_queries": usage[names[name]], "plans_using_index": used[name]}
+            for name in names if name not in unused]
+    print(f"\n--- Indexes ({build_seconds:.1f}s) ---")
+    for entry in kept:
+        print(f"✅ {entry['table']}({entry['column']}): used by {entry['plans_using_index']} query plans")
+    for name in unused:
+        print(f"   dropped {name}: not used by any query plan")
+
+    report = {"candidates": len(candidates), "indexes": kept, "dropped": unused, "build_seconds": build_seconds}
+
+    # --- 4. Before/after timing ---
+    if not args.skip_timing:
+        print(f"\nTiming {len(queries)} queries on the original and the indexed database...")
+        before = time_workload(args.db_path, queries, args.timeout)
+        after = time_workload(args.output_db, queries, args.timeout)
+        mismatches = [i for i, (b, a) in enumerate(zip(before, after))
+                      if b["status"] == "ok" and (a["status"] != "ok" or a["digest"] != b["digest"])]
+        report["before"], report["after"] = summarize(before), summarize(after)
+        report["result_mismatches"] = len(mismatches)
+        report["slowest_before"] = sorted(
+            ({"sql": queries[i], "before": before[i]["seconds"], "after": after[i]["seconds"]}
+             for i in range(len(queries))), key=lambda entry: -entry["before"])[:20]
+
+        b, a = report["before"], report["after"]
+        print(f"Before: total {b['total']:.2f}s, p50 {b['p50'] * 1000:.1f}ms, p95 {b['p95'] * 1000:.1f}ms, "
+              f"max {b['max']:.2f}s")
+        print(f"After:  total {a['total']:.2f}s, p50 {a['p50'] * 1000:.1f}ms, p95 {a['p95'] * 1000:.1f}ms, "
+              f"max {a['max']:.2f}s")
+        print(f"Speedup: {b['total'] / a['total'] if a['total'] else 0.0:.1f}x")
+        print(f"{'✅' if not mismatches else '❌'} Results differing after indexing: {len(mismatches)}")
+
+    os.makedirs(os.path.dirname(args.report_file) or ".", exist_ok=True)
+    with open(args.report_file, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report saved to: {args.report_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+# build_finetune_dataset.py
+import os
+import json
+import time
+from datasets import Dataset, load_from_disk
+from transformers import AutoTokenizer
+
+from prepare_finetune_data import FINETUNE_PROMPT_TEMPLATE, format_schema_for_prompt
+
+# --- Configuration ---
+BASE_MODEL_NAME = "seeklhy/codes-7b"
+RAW_TRAIN_DATA_PATH = "./train_data/annotated.json"
+SCHEMA_PATH = "./train_data/mimic_iv.sql"
+OUTPUT_DATASET_DIR = "./train_data/finetune_tokenized"
+# Context length the packed training sequences are filled up to
+MAX_SEQ_LENGTH = 4096
+
+IGNORE_INDEX = -100
+
+# The template is split into the static prefix (instruction + schema), the question
+# section and the SQL. Every example is tokenized as one full text, so the ids are the
+# same as for prepare_finetune_data.py's "text" rows; the leading tokens it shares with
+# the prefix are then stored only once.
+PREFIX_TEMPLATE, _rest = FINETUNE_PROMPT_TEMPLATE.split("{question}")
+QUESTION_TEMPLATE = "{question}" + _rest.split("{sql}")[0]
+# Examples are tokenized in chunks to bound the memory of the offset mappings
+TOKENIZE_BATCH_SIZE = 256
+
+
+def _shared_length(ids: list, prefix_ids: list) -> int:
+    """Number of leading tokens of 'ids' that equal 'prefix_ids'."""
+    length = 0
+    for token, prefix_token in zip(ids, prefix_ids):
+        if token != prefix_token:
+            break
+        length += 1
+    return length
+
+
+def build_dataset(tokenizer_name: str = BASE_MODEL_NAME, raw_data_path: str = RAW_TRAIN_DATA_PATH,
+                  schema_path: str = SCHEMA_PATH, output_dir: str = OUTPUT_DATASET_DIR):
+    """
+    Writes a compact, pre-tokenized fine-tuning dataset:
+      - prefix.json: the shared instruction + schema token ids, stored once
+      - examples/:   an Arrow dataset with the per-example ids and labels after the
+                     shared prefix and the number of prefix tokens to put in front
+                     (prompt tokens masked with -100, loss on SQL + EOS)
+    """
+    schema_context = format_schema_for_prompt(schema_path)
+    if not schema_context:
+        print("Aborting: Schema could not be loaded.")
+        return
+
+    try:
+        with open(raw_data_path, 'r', encoding='utf-8') as f:
+            raw_data = json.load(f)
+    except FileNotFoundError:
+        print(f"ERROR: Training data not found at '{raw_data_path}'")
+        return
+
+    items = [item for item in raw_data
+             if item.get("question") and item.get("query") and item["query"].lower() != 'null']
+
+    tokenizer = AutoTokenizer.from_pretrained(tokenizer_name, trust_remote_code=True)
+    start = time.perf_counter()
+
+    prefix_text = PREFIX_TEMPLATE.format(schema=schema_context)
+    prefix_ids = None
+    input_ids, labels, prefix_lengths = [], [], []
+    for offset in range(0, len(items), TOKENIZE_BATCH_SIZE):
+        batch = items[offset:offset + TOKENIZE_BATCH_SIZE]
+        prompts = [prefix_text + QUESTION_TEMPLATE.format(question=item["question"]) for item in batch]
+        encoded = tokenizer([prompt + item["query"] for prompt, item in zip(prompts, batch)],
+                            return_offsets_mapping=True)
+        for prompt, ids, offsets in zip(prompts, encoded["input_ids"], encoded["offset_mapping"]):
+            # Loss only on tokens that start inside the SQL; a token spanning the boundary is prompt
+            lbls = [token if token_start >= len(prompt) else IGNORE_INDEX
+                    for token, (token_start, _) in zip(ids, offsets)]
+            if prefix_ids is None:
+                # The leading tokens that lie entirely within instruction + schema
+                n_prefix = 0
+                while n_prefix < len(ids) and offsets[n_prefix][1] <= len(prefix_text):
+                    n_prefix += 1
+                prefix_ids = ids[:n_prefix]
+            shared = _shared_length(ids, prefix_ids)
+            prefix_lengths.append(shared)
+            input_ids.append(ids[shared:] + [tokenizer.eos_token_id])
+            labels.append(lbls[shared:] + [tokenizer.eos_token_id])
+    elapsed = time.perf_counter() - start
+    prefix_ids = prefix_ids or []
+
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, "prefix.json"), 'w', encoding='utf-8') as f:
+        json.dump({"tokenizer": tokenizer_name, "prefix_ids": prefix_ids,
+                   "pad_token_id": tokenizer.pad_token_id if tokenizer.pad_token_id is not None
+                   else tokenizer.eos_token_id}, f)
+    Dataset.from_dict({"input_ids": input_ids, "labels": labels, "prefix_length": prefix_lengths}).save_to_disk(
+        os.path.join(output_dir, "examples"))
+
+    suffix_tokens = sum(len(ids) for ids in input_ids)
+    full_tokens = suffix_tokens + sum(prefix_lengths)
+    print(f"Tokenized {len(input_ids)} examples in {elapsed:.1f}s.")
+    print(f"   Shared prefix: {len(prefix_ids)} tokens (stored once, "
+          f"{sum(length == len(prefix_ids) for length in prefix_lengths)} examples use all of it)")
+    print(f"   Stored tokens: {suffix_tokens + len(prefix_ids)} instead of {full_tokens} "
+          f"({1 - (suffix_tokens + len(prefix_ids)) / max(1, full_tokens):.1%} smaller)")
+    print(f"   Output directory: {output_dir}")
+
+
+def load_packed_dataset(dataset_dir: str = OUTPUT_DATASET_DIR, max_seq_length: int = MAX_SEQ_LENGTH,
+                        pack: bool = True) -> Dataset:
+    """
+    Expands the compact dataset (shared prefix + per-example ids) into training rows.
+
+    With pack=True, examples are combined first-fit-decreasing into rows of at
+    most max_seq_length tokens. Every row carries position_ids that restart at 0
+    for each example, so a padding-free collator / flash attention keeps the
+    attention inside example boundaries. Without packing, one example per row.
+    """
+    with open(os.path.join(dataset_dir, "prefix.json"), 'r', encoding='utf-8') as f:
+        prefix_ids = json.load(f)["prefix_ids"]
+    examples = load_from_disk(os.path.join(dataset_dir, "examples"))
+    prefix_labels = [IGNORE_INDEX] * len(prefix_ids)
+
+    sequences = []
+    for row in examples:
+        # Datasets written before 'prefix_length' existed always used the whole prefix
+        shared = row.get("prefix_length", len(prefix_ids))
+        ids = (prefix_ids[:shared] + row["input_ids"])[:max_seq_length]
+        lbls = (prefix_labels[:shared] + row["labels"])[:max_seq_length]
+        sequences.append((ids, lbls))
+
+    if not pack:
+        return Dataset.from_dict({
+            "input_ids": [ids for ids, _ in sequences],
+            "labels": [lbls for _, lbls in sequences],
+            "position_ids": [list(range(len(ids))) for ids, _ in sequences],
+        })
+
+    bins = []  # each bin: [used_tokens, [sequence indices]]
+    for index in sorted(range(len(sequences)), key=lambda i: -len(sequences[i][0])):
+        length = len(sequences[index][0])
+        for packed in bins:
+            if packed[0] + length <= max_seq_length:
+                packed[0] += length
+                packed[1].append(index)
+                break
+        else:
+            bins.append([length, [index]])
+
+    rows = {"input_ids": [], "labels": [], "position_ids": []}
+    for _, indices in bins:
+        ids, lbls, positions = [], [], []
+        for index in indices:
+            ids += sequences[index][0]
+            lbls += sequences[index][1]
+            positions += range(len(sequences[index][0]))
+        rows["input_ids"].append(ids)
+        rows["labels"].append(lbls)
+        rows["position_ids"].append(positions)
+
+    used = sum(packed[0] for packed in bins)
+    print(f"Packed {len(sequences)} examples into {len(bins)} sequences of <= {max_seq_length} tokens "
+          f"({used / (len(bins) * max_seq_length):.1%} filled).")
+    return Dataset.from_dict(rows)
+
+
+if __name__ == "__main__":
+    build_dataset()
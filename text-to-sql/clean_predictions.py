@@ -1,6 +1,40 @@
+# clean_predictions.py
 import json
 import re
 import os
+import argparse
+from multiprocessing import Pool
+
+# --- Configuration ---
+# Path to your original, "dirty" prediction file from the model (.json dict or .jsonl journal)
+INPUT_FILE_PATH = "input/res/prediction_rag.json"
+# Path where the cleaned file will be saved (.json dict or .jsonl)
+OUTPUT_FILE_PATH = "evaluation_data/prediction_cleaned.json"
+# Entries handed to a worker process at once in multiprocessing mode
+CHUNK_SIZE = 256
+
+# Compiled once at import time instead of on every call
+SQL_FENCE_PATTERN = re.compile(r"```sql\s*(.*?)\s*```", re.DOTALL | re.IGNORECASE)
+ANY_FENCE_PATTERN = re.compile(r"```\s*(.*?)\s*```", re.DOTALL)
+THINK_BLOCK_PATTERN = re.compile(r"<think>.*?</think>", re.DOTALL | re.IGNORECASE)
+# Quoted literals are kept verbatim when whitespace is collapsed
+STRING_LITERAL_PATTERN = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+# A line that starts like an English sentence ends the query ("This query ...", "Explanation: ..."),
+# unless the word is used as a table alias: "i.label", "t = ...", "it IN (...)"
+TRAILING_PROSE_PATTERN = re.compile(
+    r"^\s*(?:this|the|explanation|note|here|it|i|we|in this|that)\b"
+    r"(?!\s*(?:\.|,|\)|=|<|>|!=|\|\||[-+*/%]|(?:and|or|in|is|not|like|between|on|as)\b))",
+    re.IGNORECASE | re.MULTILINE)
+# SELECT starting a word, but not the English "selects", "selected", "selecting" or "selection"
+SELECT_PATTERN = re.compile(r"\bselect(?!(?:s|ed|ing|ions?)\b)", re.IGNORECASE)
+# Text before a SELECT that makes it part of a larger query (subquery or compound query)
+NESTED_SELECT_PATTERN = re.compile(r"(?:\(|\b(?:union(?:\s+all)?|intersect|except))\s*$", re.IGNORECASE)
+# Words and characters a complete statement cannot end with
+DANGLING_WORD_PATTERN = re.compile(
+    r"(?:[,(=<>!|+\-*/%.]|\b(?:select|distinct|from|where|and|or|not|on|join|by|in|is|as|having|like|"
+    r"between|union|all|intersect|except|case|when|then|else|limit|offset))\s*$", re.IGNORECASE)
+
 
 def extract_sql_cleverly(raw_text: str) -> str:
     """
@@ -18,13 +52,13 @@ def extract_sql_cleverly(raw_text: str) -> str:
     """
     # 1. Primary Strategy: Look for a ```sql ... ``` markdown block.
     # This is the most reliable and common format.
-    match = re.search(r"```sql\s*(.*?)\s*```", raw_text, re.DOTALL | re.IGNORECASE)
+    match = SQL_FENCE_PATTERN.search(raw_text)
     if match:
         return match.group(1).strip()
 
     # 2. Fallback 1: Look for a generic ``` ... ``` markdown block.
     # Sometimes the model forgets to add the 'sql' language identifier.
-    match = re.search(r"```\s*(.*?)\s*```", raw_text, re.DOTALL)
+    match = ANY_FENCE_PATTERN.search(raw_text)
     if match:
         # Check if the content looks like SQL to avoid extracting other code/text
         potential_sql = match.group(1).strip()
@@ -34,7 +68,16 @@ def extract_sql_cleverly(raw_text: str) -> str:
     # 3. Fallback 2: Find the last instance of 'SELECT' and extract from there.
     # This catches cases where the query is not in a markdown block at all.
     # We search from the end of the string to avoid capturing SQL from the prompt.
-    last_select_pos = raw_text.lower().rfind('select')
+    # Words like "selects" do not count, and a SELECT that opens a subquery or the
+    # second part of a UNION belongs to the query before it (unless the output
+    # was cut off before any top-level SELECT).
+    # An odd number of fences means the output was cut off inside a code block: search there first.
+    selects = []
+    if raw_text.count('```') % 2:
+        selects = [match.start() for match in SELECT_PATTERN.finditer(raw_text, raw_text.rfind('```') + 3)]
+    selects = selects or [match.start() for match in SELECT_PATTERN.finditer(raw_text)]
+    top_level = [pos for pos in selects if not NESTED_SELECT_PATTERN.search(raw_text, 0, pos)]
+    last_select_pos = (top_level or selects or [-1])[-1]
     if last_select_pos != -1:
         # Take the substring from the last 'SELECT' to the end
         potential_sql = raw_text[last_select_pos:]
@@ -47,65 +90,159 @@ def extract_sql_cleverly(raw_text: str) -> str:
     # 4. Final Fallback: If no other pattern matches, return an empty string.
     return ""
 
+
+def _cut_after_statement(sql: str) -> str:
+    """Drops everything after the first ';' that is not inside a string literal."""
+    in_string = False
+    for pos, char in enumerate(sql):
+        if char == "'":
+            in_string = not in_string
+        elif char == ";" and not in_string:
+            return sql[:pos + 1]
+    return sql
+
+
+def _is_complete_statement(sql: str) -> bool:
+    """True if the SQL could end here: balanced quotes and parentheses and no dangling keyword or operator."""
+    parts = STRING_LITERAL_PATTERN.split(sql)
+    if sql.count("'") % 2:
+        return False
+    # Literals are replaced by an empty one, so parentheses and keywords inside them are ignored
+    code = "".join("''" if i % 2 else part for i, part in enumerate(parts))
+    return code.count("(") == code.count(")") and bool(code.strip()) and not DANGLING_WORD_PATTERN.search(code)
+
+
+def _cut_trailing_prose(sql: str) -> str:
+    """Drops the first prose line and everything after it, if the SQL before it is a complete statement."""
+    for prose in TRAILING_PROSE_PATTERN.finditer(sql):
+        if prose.start() > 0 and _is_complete_statement(sql[:prose.start()]):
+            return sql[:prose.start()]
+    return sql
+
+
+def _collapse_whitespace(sql: str) -> str:
+    parts = STRING_LITERAL_PATTERN.split(sql)
+    # Odd indices are the captured string literals
+    return "".join(part if i % 2 else WHITESPACE_PATTERN.sub(" ", part) for i, part in enumerate(parts)).strip()
+
+
+def clean_prediction(raw_text) -> str:
+    """
+    Full cleaning of one model output: removes <think> reasoning blocks, extracts
+    the query with extract_sql_cleverly, drops explanations after the statement
+    and collapses whitespace outside string literals. Lists (several sampled
+    candidates for one question) are cleaned element by element.
+    """
+    if isinstance(raw_text, list):
+        return [clean_prediction(candidate) for candidate in raw_text]
+    if not raw_text:
+        return ""
+    text = THINK_BLOCK_PATTERN.sub("", raw_text)
+    sql = _cut_trailing_prose(_cut_after_statement(extract_sql_cleverly(text)))
+    return _collapse_whitespace(sql)
+
+
+def iter_predictions(path: str):
+    """
+    Yields (question_id, raw_output) pairs. A .jsonl journal ({"id", "sql"} per
+    line, see prediction_store.py) is read line by line; a .json dict is loaded
+    and then iterated.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # torn last line of an interrupted run
+                yield entry["id"], entry["sql"]
+        else:
+            yield from json.load(f).items()
+
+
+def _clean_entry(entry: tuple) -> tuple:
+    question_id, raw_text = entry
+    return question_id, clean_prediction(raw_text)
+
+
+def clean_stream(entries, workers: int = 1):
+    """
+    Generator that cleans (question_id, raw_output) pairs in input order.
+    With workers > 1 the entries are cleaned by a process pool in chunks.
+    """
+    if workers <= 1:
+        for entry in entries:
+            yield _clean_entry(entry)
+        return
+    with Pool(workers) as pool:
+        yield from pool.imap(_clean_entry, entries, chunksize=CHUNK_SIZE)
+
+
+def write_predictions(entries, path: str) -> int:
+    """Writes the cleaned pairs as they arrive (.jsonl lines or one JSON dict). Returns the count."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        if path.endswith(".jsonl"):
+            for question_id, sql in entries:
+                f.write(json.dumps({"id": question_id, "sql": sql}, ensure_ascii=False) + "\n")
+                count += 1
+            return count
+        f.write("{")
+        for question_id, sql in entries:
+            f.write(("," if count else "") + f"\n    {json.dumps(question_id)}: {json.dumps(sql)}")
+            count += 1
+        f.write("\n}\n" if count else "}\n")
+    return count
+
+
 def main():
     """
-    Main function to load, clean, and save the prediction data using the
-    advanced extraction logic.
+    Streams the predictions file through the cleaner into the output file and
+    optionally reports how many queries were recovered compared to an earlier
+    cleaned file.
     """
-    # --- File Paths (Adjust if necessary) ---
-    # Path to your original, "dirty" prediction file from the model
-    original_file_path = "input/res/prediction_rag.json"
+    parser = argparse.ArgumentParser(description="Extract clean SQL from raw model predictions.")
+    parser.add_argument("--input_file", default=INPUT_FILE_PATH)
+    parser.add_argument("--output_file", default=OUTPUT_FILE_PATH)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Clean in a process pool (useful for large multi-candidate dumps).")
+    parser.add_argument("--compare_file", default=None,
+                        help="Previously cleaned predictions; queries missing there are reported as recovered.")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.input_file):
+        print(f"ERROR: The file was not found at {args.input_file}")
+        return
 
-    # Path where the new, cleverly cleaned file will be saved
-    output_directory = "evaluation_data"
-    cleaned_file_path = os.path.join(output_directory, "prediction_cleaned.json")
+    previous = {}
+    if args.compare_file and os.path.exists(args.compare_file):
+        previous = dict(iter_predictions(args.compare_file))
 
-    print(f"Loading original predictions from: {original_file_path}")
+    stats = {"empty": 0, "recovered": 0}
 
-    # Load the original JSON data
+    def track(entries):
+        for question_id, sql in entries:
+            if not sql:
+                stats["empty"] += 1
+            elif previous and not previous.get(question_id):
+                stats["recovered"] += 1
+                print(f"[+] Recovered query for ID: {question_id}")
+            yield question_id, sql
+
+    print(f"Cleaning predictions from: {args.input_file}")
     try:
-        with open(original_file_path, 'r', encoding='utf-8') as f:
-            predictions = json.load(f)
-    except FileNotFoundError:
-        print(f"ERROR: The file was not found at {original_file_path}")
-        return
+        count = write_predictions(track(clean_stream(iter_predictions(args.input_file), args.workers)),
+                                  args.output_file)
     except json.JSONDecodeError:
-        print(f"ERROR: The file at {original_file_path} is not a valid JSON file.")
+        print(f"ERROR: The file at {args.input_file} is not a valid JSON file.")
         return
 
-    cleaned_predictions = {}
-    queries_recovered = 0
-    
-    # Load the previous simple-cleaned file to compare results
-    simple_cleaned_path = r"C:\Uni\Bachelorarbeit\bachelor_thesis_project\evaluation_data\prediction_cleaned.json"
-    simple_cleaned_data = {}
-    if os.path.exists(simple_cleaned_path):
-        with open(simple_cleaned_path, 'r', encoding='utf-8') as f:
-            simple_cleaned_data = json.load(f)
-
-    print("\n--- Starting Advanced Cleaning Process ---")
-    for question_id, generated_text in predictions.items():
-        cleaned_sql = extract_sql_cleverly(generated_text)
-        cleaned_predictions[question_id] = cleaned_sql
-
-        # Check if this script recovered a query that was previously missed
-        previous_result = simple_cleaned_data.get(question_id, "")
-        if not previous_result and cleaned_sql:
-            queries_recovered += 1
-            # Removed emoji from the following line to prevent encoding errors
-            print(f"[+] Recovered query for ID: {question_id}")
-
-
-    # Save the cleaned predictions to the new file
-    os.makedirs(output_directory, exist_ok=True)
-    
-    with open(cleaned_file_path, 'w', encoding='utf-8') as f:
-        json.dump(cleaned_predictions, f, indent=4)
-
     print("\n--- Cleaning Complete ---")
-    # Removed emojis from the following lines to prevent encoding errors
-    print(f"Successfully recovered {queries_recovered} additional queries!")
-    print(f"Advanced cleaned file saved to: {cleaned_file_path}")
+    print(f"Cleaned {count} predictions ({stats['empty']} without an extractable query).")
+    if previous:
+        print(f"Successfully recovered {stats['recovered']} additional queries!")
+    print(f"Cleaned file saved to: {args.output_file}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,142 @@
+# completion_cache.py
+import os
+import re
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from concurrent.futures import Future
+
+WHITESPACE_PATTERN = re.compile(r"\s+")
+# Request fields that only affect scheduling on the server, not the generated text
+NON_SEMANTIC_FIELDS = {"cache_prompt", "id_slot", "stream"}
+
+
+def question_key(item: dict) -> str:
+    """
+    Canonical key of a benchmark question: its template and placeholder values
+    (val_dict) plus the lowercased, whitespace-normalized question text.
+    """
+    normalized = WHITESPACE_PATTERN.sub(" ", item.get("question", "").strip().lower())
+    canonical = json.dumps([item.get("template"), item.get("val_dict"), normalized], sort_keys=True)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def request_key(data: dict, model_id: str) -> str:
+    """
+    Key of a /completion request to one model: the model identity plus every
+    request field that can change the output (prompt, n_predict, stop, ...).
+    """
+    semantic = {k: v for k, v in data.items() if k not in NON_SEMANTIC_FIELDS}
+    payload = json.dumps({"model": model_id, "request": semantic}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def model_file_identity(model_path: str) -> str:
+    """Identity of a model file: absolute path, size and modification time, so a re-exported GGUF gets a new key."""
+    stat = os.stat(model_path)
+    return f"{os.path.abspath(model_path)}:{stat.st_size}:{int(stat.st_mtime)}"
+
+
+class CompletionCache:
+    """
+    Persistent prompt -> completion cache in a single SQLite file.
+
+    Lookups refresh an entry's last-used time; when the stored completions
+    exceed max_bytes the least recently used entries are evicted. Safe to share
+    between the runner's worker threads.
+    """
+
+    def __init__(self, cache_path: str, max_bytes: int = 256 * 1024 * 1024):
+        directory = os.path.dirname(cache_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self.conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS completions (
+                key TEXT PRIMARY KEY,
+                completion TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS completions_last_used ON completions(last_used);
+        """)
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+
+    def get(self, key: str):
+        with self._lock:
+            row = self.conn.execute("SELECT completion FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            with self.conn:
+                self.conn.execute("UPDATE completions SET last_used = ? WHERE key = ?", (time.time(), key))
+            return row[0]
+
+    def put(self, key: str, completion: str):
+        size = len(completion.encode('utf-8'))
+        with self._lock, self.conn:
+            old = self.conn.execute("SELECT size FROM completions WHERE key = ?", (key,)).fetchone()
+            self.conn.execute("INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?)",
+                              (key, completion, size, time.time()))
+            self.total_bytes += size - (old[0] if old else 0)
+            self._evict()
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes:
+            rows = self.conn.execute(
+                "SELECT key, size FROM completions ORDER BY last_used LIMIT 64").fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                self.conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+                self.total_bytes -= size
+                if self.total_bytes <= self.max_bytes:
+                    break
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+class QuestionMemo:
+    """
+    Wraps a runner's predict(item) function so every canonical question
+    (see question_key) is sent to the model only once per run. Duplicates that
+    arrive while the first one is still running wait for its result. Failed
+    predictions (None) are not memoized.
+    """
+
+    def __init__(self, predict_fn):
+        self.predict_fn = predict_fn
+        self._lock = threading.Lock()
+        self._futures = {}
+        self.hits = 0
+
+    def __call__(self, item: dict):
+        key = question_key(item)
+        with self._lock:
+            future = self._futures.get(key)
+            owner = future is None
+            if owner:
+                future = self._futures[key] = Future()
+            else:
+                self.hits += 1
+        if not owner:
+            return future.result()
+
+        try:
+            result = self.predict_fn(item)
+        except BaseException as e:
+            with self._lock:
+                del self._futures[key]
+            future.set_exception(e)
+            raise
+        if result is None:
+            with self._lock:
+                del self._futures[key]
+        future.set_result(result)
+        return result
@@ -0,0 +1,235 @@
+# evaluate_execution.py
+import os
+import sys
+import json
+import time
+import hashlib
+import sqlite3
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from result_cache import ResultCache, normalize_sql
+
+sys.stdout.reconfigure(encoding='utf-8')
+
+# --- Configuration ---
+DB_PATH = "./evaluation_data/mimic_iv.sqlite"
+BENCHMARK_FILE_PATH = "./evaluation_data/annotated.json"
+PREDICTION_FILE_PATH = "./input/res/prediction.json"
+REPORT_FILE_PATH = "./input/res/execution_report.json"
+# Gold and predicted result summaries are cached here across runs (per database content hash)
+RESULT_CACHE_PATH = "./evaluation_data/result_cache.sqlite"
+QUERY_TIMEOUT_SECONDS = 30
+# Rows are streamed in batches of FETCH_SIZE; results larger than MAX_RESULT_ROWS count as failed
+FETCH_SIZE = 1000
+MAX_RESULT_ROWS = 100000
+# Floats are rounded before comparison so 1.0000001 and 1.0 match
+FLOAT_PRECISION = 3
+# The progress handler checks the deadline every N SQLite VM instructions
+PROGRESS_STEPS = 10000
+
+_worker_conn = None
+
+
+def connect_read_only(db_path: str) -> sqlite3.Connection:
+    """Opens the database read-only and immutable, so workers never take locks or write journals."""
+    return sqlite3.connect(f"file:{db_path}?mode=ro&immutable=1", uri=True, check_same_thread=False)
+
+
+def _normalize_value(value):
+    if isinstance(value, float):
+        value = round(value, FLOAT_PRECISION)
+        if value.is_integer():
+            return int(value)
+    return value
+
+
+def _row_digest(row: tuple) -> int:
+    encoded = repr(tuple(_normalize_value(v) for v in row)).encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(encoded, digest_size=8).digest(), "big")
+
+
+def execute_query(conn: sqlite3.Connection, sql: str, timeout: float = QUERY_TIMEOUT_SECONDS,
+                  max_rows: int = MAX_RESULT_ROWS, digest_rows: bool = True) -> dict:
+    """
+    Executes one query with a time limit and returns an order-insensitive summary
+    of its result set: {"status", "row_count", "digest", "error"}.
+
+    Rows are fetched with fetchmany and only an 8-byte hash per row is kept, so a
+    runaway join is cut off by the deadline or by max_rows instead of filling
+    memory. 'digest' is a hash over the sorted list of all row hashes, duplicates
+    included, so SELECT x and SELECT DISTINCT x only match if x has no duplicates.
+    With max_rows=None there is no row limit, and with digest_rows=False the rows
+    are only counted (digest is None), e.g. to check that a query runs at all.
+    """
+    deadline = time.monotonic() + timeout
+    conn.set_progress_handler(lambda: 1 if time.monotonic() > deadline else 0, PROGRESS_STEPS)
+    row_hashes = []
+    row_count = 0
+    try:
+        cursor = conn.execute(sql)
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            row_count += len(rows)
+            if max_rows is not None and row_count > max_rows:
+                cursor.close()
+                return {"status": "too_many_rows", "row_count": row_count, "digest": None,
+                        "error": f"more than {max_rows} rows"}
+            if digest_rows:
+                row_hashes.extend(_row_digest(row) for row in rows)
+    except sqlite3.OperationalError as e:
+        if time.monotonic() > deadline:
+            return {"status": "timeout", "row_count": row_count, "digest": None,
+                    "error": f"exceeded {timeout}s"}
+        return {"status": "error", "row_count": row_count, "digest": None, "error": str(e)}
+    except (sqlite3.Error, sqlite3.Warning) as e:
+        return {"status": "error", "row_count": row_count, "digest": None, "error": str(e)}
+    finally:
+        conn.set_progress_handler(None, 0)
+
+    if not digest_rows:
+        return {"status": "ok", "row_count": row_count, "digest": None, "error": None}
+    digest = hashlib.sha256()
+    for row_hash in sorted(row_hashes):
+        digest.update(row_hash.to_bytes(8, "big"))
+    return {"status": "ok", "row_count": row_count, "digest": digest.hexdigest(), "error": None}
+
+
+def is_null_query(sql) -> bool:
+    """Unanswerable questions are marked with the string 'null' (or an empty prediction)."""
+    return sql is None or sql.strip().lower() in ("", "null")
+
+
+def _init_worker(db_path: str, timeout: float):
+    global _worker_conn, QUERY_TIMEOUT_SECONDS
+    _worker_conn = connect_read_only(db_path)
+    QUERY_TIMEOUT_SECONDS = timeout
+
+
+def _execute_in_worker(sql: str) -> dict:
+    return execute_query(_worker_conn, sql, QUERY_TIMEOUT_SECONDS)
+
+
+def score_item(item_id: str, gold_sql, pred_sql, summaries: dict) -> dict:
+    """Compares gold and predicted result summaries for one benchmark item."""
+    result = {"id": item_id, "gold": None, "pred": None}
+
+    if is_null_query(gold_sql):
+        result["correct"] = is_null_query(pred_sql)
+        return result
+    if is_null_query(pred_sql):
+        result["correct"] = False
+        return result
+
+    result["gold"] = summaries[normalize_sql(gold_sql)]
+    result["pred"] = summaries[normalize_sql(pred_sql)]
+    result["correct"] = (result["gold"]["status"] == "ok"
+                         and result["pred"]["status"] == "ok"
+                         and result["gold"]["digest"] == result["pred"]["digest"])
+    return result
+
+
+def evaluate(db_path: str, benchmark_data: list, predictions: dict, workers: int = None,
+             timeout: float = QUERY_TIMEOUT_SECONDS, cache: ResultCache = None) -> list:
+    """
+    Evaluates every benchmark item and returns the per-item results in benchmark
+    order. Items without a prediction are scored as incorrect with "missing": True.
+
+    Every distinct (normalized) gold or predicted query is executed at most once,
+    in a process pool, and only if its result summary is not in the cache yet.
+    """
+    tasks = [(item["id"], item.get("query"), predictions[item["id"]])
+             for item in benchmark_data if item.get("id") in predictions]
+    missing_ids = [item.get("id") for item in benchmark_data if item.get("id") not in predictions]
+
+    unique_sqls = {}
+    for _, gold_sql, pred_sql in tasks:
+        if is_null_query(gold_sql) or is_null_query(pred_sql):
+            continue
+        for sql in (gold_sql, pred_sql):
+            unique_sqls.setdefault(normalize_sql(sql), sql)
+
+    summaries = cache.get_many(list(unique_sqls)) if cache else {}
+    missing = [sql for sql in unique_sqls if sql not in summaries]
+    print(f"{len(unique_sqls)} distinct queries, {len(unique_sqls) - len(missing)} served from cache, "
+          f"{len(missing)} to execute.")
+
+    if missing:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(db_path, timeout)) as pool:
+            executed = pool.map(_execute_in_worker, [unique_sqls[sql] for sql in missing], chunksize=4)
+            new_summaries = dict(zip(missing, executed))
+        summaries.update(new_summaries)
+        if cache:
+            cache.put_many(new_summaries)
+
+    results = {item_id: score_item(item_id, gold_sql, pred_sql, summaries) for item_id, gold_sql, pred_sql in tasks}
+    results.update({item_id: {"id": item_id, "gold": None, "pred": None, "correct": False, "missing": True}
+                    for item_id in missing_ids})
+    return [results[item.get("id")] for item in benchmark_data]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Execution accuracy of predicted SQL on MIMIC-IV.")
+    parser.add_argument("--db_path", default=DB_PATH)
+    parser.add_argument("--data_file", default=BENCHMARK_FILE_PATH)
+    parser.add_argument("--pred_file", default=PREDICTION_FILE_PATH)
+    parser.add_argument("--report_file", default=REPORT_FILE_PATH)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--timeout", type=float, default=QUERY_TIMEOUT_SECONDS)
+    parser.add_argument("--cache_file", default=RESULT_CACHE_PATH)
+    parser.add_argument("--no_cache", action="store_true", help="Execute every query, ignoring the result cache.")
+    args = parser.parse_args()
+
+    for path in (args.db_path, args.data_file, args.pred_file):
+        if not os.path.exists(path):
+            print(f"ERROR: File not found at '{path}'")
+            return
+
+    with open(args.data_file, 'r', encoding='utf-8') as f:
+        benchmark_data = json.load(f)
+    with open(args.pred_file, 'r', encoding='utf-8') as f:
+        predictions = json.load(f)
+
+    print(f"Evaluating {len(predictions)} predictions against {len(benchmark_data)} questions "
+          f"with {args.workers} workers...")
+    start = time.perf_counter()
+    cache = None if args.no_cache else ResultCache(args.cache_file, args.db_path)
+    try:
+        results = evaluate(args.db_path, benchmark_data, predictions, args.workers, args.timeout, cache)
+    finally:
+        if cache:
+            cache.close()
+    elapsed = time.perf_counter() - start
+
+    correct = sum(r["correct"] for r in results)
+    predicted = [r for r in results if not r.get("missing")]
+    correct_predicted = sum(r["correct"] for r in predicted)
+    statuses = {}
+    for r in results:
+        if r["pred"]:
+            statuses[r["pred"]["status"]] = statuses.get(r["pred"]["status"], 0) + 1
+    gold_failures = [r["id"] for r in results if r["gold"] and r["gold"]["status"] != "ok"]
+
+    print("\n--- Execution Evaluation Complete ---")
+    print(f"Execution Accuracy (all questions, missing predictions count as wrong): "
+          f"{correct}/{len(results)} ({correct / max(len(results), 1):.2%})")
+    print(f"Execution Accuracy (only the {len(predicted)} questions with a prediction): "
+          f"{correct_predicted}/{len(predicted)} ({correct_predicted / max(len(predicted), 1):.2%})")
+    print(f"Predicted query status: {statuses}")
+    print(f"Questions without a prediction: {len(results) - len(predicted)}")
+    print(f"Gold queries that failed: {len(gold_failures)}")
+    print(f"Time: {elapsed:.1f}s")
+
+    os.makedirs(os.path.dirname(args.report_file) or ".", exist_ok=True)
+    with open(args.report_file, 'w', encoding='utf-8') as f:
+        json.dump({"accuracy": correct / max(len(results), 1), "correct": correct, "total": len(results),
+                   "accuracy_predicted_only": correct_predicted / max(len(predicted), 1),
+                   "predicted": len(predicted), "elapsed_seconds": elapsed, "results": results}, f, indent=2)
+    print(f"Report saved to: {args.report_file}")
+
+
+if __name__ == "__main__":
+    main()
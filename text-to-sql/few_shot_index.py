@@ -0,0 +1,196 @@
+# few_shot_index.py
+import os
+import re
+import json
+import numpy as np
+
+from rag_components import database_fingerprint
+
+# Bump when the stored example fields change, so persisted indexes are rebuilt
+INDEX_VERSION = 2
+TOKEN_PATTERN = re.compile(r"[a-z]+|\d+")
+PLACEHOLDER_PATTERN = re.compile(r"\{[^}]*\}")
+STOPWORDS = {
+    "a", "an", "the", "of", "in", "on", "to", "for", "is", "was", "were", "are", "be", "did", "do",
+    "does", "what", "which", "who", "how", "me", "tell", "can", "you", "could", "please", "patient",
+    "and", "or", "by", "with", "that", "this", "their", "his", "her", "it", "at", "since", "has", "have",
+}
+
+
+def tokenize(text: str) -> list:
+    """Lowercase word tokens without stopwords. Bare numbers (patient ids, dates) are dropped."""
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS and not t.isdigit()]
+
+
+def paraphrase_key(item: dict):
+    """Items with the same template and val_dict are paraphrases of one question with the same gold SQL."""
+    if not item.get("template"):
+        return None
+    return item["template"] + "\x00" + json.dumps(item.get("val_dict"), sort_keys=True)
+
+
+def _normalize_query(sql) -> str:
+    return " ".join(sql.lower().split()) if sql else None
+
+
+class FewShotIndex:
+    """
+    BM25 retrieval index over a pool of {"question", "query"} examples.
+
+    Each document is the example's question plus its template text (placeholders
+    removed). The BM25 weights are kept in a column-compressed (term -> postings)
+    layout, so scoring a whole batch of questions is a handful of NumPy gathers
+    and one bincount instead of a Python loop over the pool.
+    """
+
+    def __init__(self, examples: list, k1: float = 1.5, b: float = 0.75):
+        self.examples = examples
+        docs = [tokenize(ex["question"] + " " + PLACEHOLDER_PATTERN.sub(" ", ex.get("template") or ""))
+                for ex in examples]
+
+        self.vocab = {}
+        for doc in docs:
+            for token in doc:
+                self.vocab.setdefault(token, len(self.vocab))
+
+        doc_ids, term_ids = [], []
+        for doc_id, doc in enumerate(docs):
+            for token in doc:
+                doc_ids.append(doc_id)
+                term_ids.append(self.vocab[token])
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+
+        # Term frequencies per (term, doc) pair, sorted by term for the postings layout
+        n_docs, n_terms = len(docs), len(self.vocab)
+        pairs, tf = np.unique(term_ids * n_docs + doc_ids, return_counts=True)
+        post_terms, post_docs = np.divmod(pairs, n_docs)
+
+        doc_len = np.bincount(doc_ids, minlength=n_docs).astype(np.float32)
+        avg_len = doc_len.mean() if n_docs else 1.0
+        df = np.bincount(post_terms, minlength=n_terms).astype(np.float32)
+        idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+        norm = k1 * (1.0 - b + b * doc_len[post_docs] / avg_len)
+
+        self.weights = (idf[post_terms] * tf * (k1 + 1.0) / (tf + norm)).astype(np.float32)
+        self.post_docs = post_docs.astype(np.int32)
+        self.term_ptr = np.concatenate(([0], np.cumsum(df.astype(np.int64))))
+
+    @classmethod
+    def from_pool(cls, pool_path: str) -> "FewShotIndex":
+        with open(pool_path, 'r', encoding='utf-8') as f:
+            pool = json.load(f)
+        examples = [
+            {"id": ex.get("id"), "question": ex["question"], "query": ex["query"], "template": ex.get("template"),
+             "val_dict": ex.get("val_dict")}
+            for ex in pool
+            if ex.get("question") and ex.get("query") and ex["query"].lower() != 'null'
+        ]
+        return cls(examples)
+
+    def save(self, index_path: str, fingerprint: str = ""):
+        np.savez(
+            index_path,
+            weights=self.weights,
+            post_docs=self.post_docs,
+            term_ptr=self.term_ptr,
+            vocab=np.array(json.dumps(self.vocab)),
+            examples=np.array(json.dumps(self.examples, ensure_ascii=False)),
+            fingerprint=np.array(fingerprint),
+        )
+
+    @classmethod
+    def load(cls, index_path: str) -> "FewShotIndex":
+        index = cls.__new__(cls)
+        with np.load(index_path) as data:
+            index.weights = data["weights"]
+            index.post_docs = data["post_docs"]
+            index.term_ptr = data["term_ptr"]
+            index.vocab = json.loads(str(data["vocab"]))
+            index.examples = json.loads(str(data["examples"]))
+            index.fingerprint = str(data["fingerprint"])
+        return index
+
+    @classmethod
+    def load_or_build(cls, pool_path: str, index_path: str) -> "FewShotIndex":
+        """Loads the persisted index if it was built from the current pool file, else rebuilds and saves it."""
+        fingerprint = f"v{INDEX_VERSION}:{database_fingerprint(pool_path)}"
+        if os.path.exists(index_path):
+            try:
+                index = cls.load(index_path)
+                if index.fingerprint == fingerprint:
+                    return index
+            except (OSError, KeyError, ValueError) as e:
+                print(f"Warning: Could not load few-shot index '{index_path}': {e}")
+        index = cls.from_pool(pool_path)
+        index.save(index_path, fingerprint)
+        return index
+
+    def score(self, questions: list) -> np.ndarray:
+        """BM25 scores of every pool example for a batch of questions, shape (len(questions), pool size)."""
+        n_docs = len(self.examples)
+        query_rows, query_terms = [], []
+        for row, question in enumerate(questions):
+            for term in {self.vocab[t] for t in tokenize(question) if t in self.vocab}:
+                query_rows.append(row)
+                query_terms.append(term)
+        query_rows = np.asarray(query_rows, dtype=np.int64)
+        query_terms = np.asarray(query_terms, dtype=np.int64)
+
+        # Expand every (question, term) pair into the term's postings without a Python loop
+        starts = self.term_ptr[query_terms]
+        lengths = self.term_ptr[query_terms + 1] - starts
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        rows = np.repeat(query_rows, lengths)
+
+        flat = rows * n_docs + self.post_docs[offsets]
+        scores = np.bincount(flat, weights=self.weights[offsets], minlength=len(questions) * n_docs)
+        return scores.reshape(len(questions), n_docs)
+
+    def batch_top_k(self, questions: list, k: int = 3, exclude_items: list = None, batch_size: int = 256) -> list:
+        """
+        Returns the k most similar examples for every question. At most one example
+        per template is picked so the examples are not near-identical paraphrases.
+
+        exclude_items[i] is the benchmark item of question i: pool examples with its
+        id, paraphrases of it (same template and val_dict) and examples with its gold
+        query are never returned for it, so gold SQL cannot leak into the prompt when
+        the pool overlaps the benchmark.
+        """
+        results = []
+        # Extra candidates make up for excluded paraphrases
+        n_candidates = min(len(self.examples), 8 * k + 1)
+        for start in range(0, len(questions), batch_size):
+            scores = self.score(questions[start:start + batch_size])
+            top = np.argpartition(-scores, n_candidates - 1, axis=1)[:, :n_candidates]
+            for row, candidates in enumerate(top):
+                item = exclude_items[start + row] if exclude_items else {}
+                excluded_key, excluded_query = paraphrase_key(item), _normalize_query(item.get("query"))
+                chosen, templates = [], set()
+                for doc_id in candidates[np.argsort(-scores[row, candidates], kind="stable")]:
+                    example = self.examples[doc_id]
+                    if item.get("id") is not None and example.get("id") == item["id"]:
+                        continue
+                    if excluded_key is not None and paraphrase_key(example) == excluded_key:
+                        continue
+                    if excluded_query is not None and _normalize_query(example["query"]) == excluded_query:
+                        continue
+                    if example.get("template") and example["template"] in templates:
+                        continue
+                    templates.add(example.get("template"))
+                    chosen.append(example)
+                    if len(chosen) == k:
+                        break
+                results.append(chosen)
+        return results
+
+    def top_k(self, question: str, k: int = 3, exclude_item: dict = None) -> list:
+        return self.batch_top_k([question], k, [exclude_item] if exclude_item else None)[0]
+
+
+def format_examples(examples: list) -> str:
+    """
+    Formats examples the same way as rag_components.get_few_shot_examples, including
+    its literal "\\n" separators, so prompts stay comparable with the stored predictions.
+    """
+    return "".join(f"Question: {ex['question']}\\nSQL: {ex['query']}\\n\\n" for ex in examples)
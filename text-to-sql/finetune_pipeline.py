@@ -0,0 +1,65 @@
+# finetune_pipeline.py
+import time
+import torch
+from transformers import TrainerCallback
+
+IGNORE_INDEX = -100
+
+
+class FlatteningCollator:
+    """
+    Collates packed rows (input_ids, labels, position_ids from
+    build_finetune_dataset.load_packed_dataset) into one flattened row of shape
+    [1, total_tokens] without any padding. position_ids restart at 0 for every
+    example, which flash attention uses to keep each example's attention
+    separate. Counts real tokens for throughput reporting (padded_tokens stays 0).
+    """
+
+    def __init__(self):
+        self.tokens = 0
+        self.padded_tokens = 0
+
+    def __call__(self, features: list) -> dict:
+        input_ids, labels, position_ids = [], [], []
+        for feature in features:
+            input_ids += feature["input_ids"]
+            # A row holds several packed examples. After flattening, the first token of each
+            # example (position 0) would be predicted from the last token of the previous one,
+            # so it is masked; the prompt tokens are already masked by build_finetune_dataset.
+            labels += [IGNORE_INDEX if position == 0 else label
+                       for label, position in zip(feature["labels"], feature["position_ids"])]
+            position_ids += feature["position_ids"]
+        self.tokens += len(input_ids)
+        return {
+            "input_ids": torch.tensor([input_ids], dtype=torch.long),
+            "labels": torch.tensor([labels], dtype=torch.long),
+            "position_ids": torch.tensor([position_ids], dtype=torch.long),
+        }
+
+
+class ThroughputCallback(TrainerCallback):
+    """Adds tokens/sec and padding ratio (taken from the collator's counters) to the training logs."""
+
+    def __init__(self, collator):
+        self.collator = collator
+        self.start_time = None
+
+    def on_train_begin(self, args, state, control, **kwargs):
+        self.start_time = time.perf_counter()
+
+    def _stats(self) -> dict:
+        elapsed = time.perf_counter() - self.start_time
+        total = self.collator.tokens + self.collator.padded_tokens
+        return {
+            "tokens_per_second": self.collator.tokens / elapsed if elapsed else 0.0,
+            "padding_ratio": self.collator.padded_tokens / total if total else 0.0,
+        }
+
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        if logs is not None and self.start_time is not None:
+            logs.update(self._stats())
+
+    def on_train_end(self, args, state, control, **kwargs):
+        stats = self._stats()
+        print(f" Throughput: {stats['tokens_per_second']:.1f} tokens/s, "
+              f"padding ratio {stats['padding_ratio']:.1%} ({self.collator.tokens} real tokens)")
@@ -0,0 +1,258 @@
+# hf_generation.py
+import os
+import sys
+import json
+import time
+import argparse
+import torch
+from transformers import AutoTokenizer, AutoModelForCausalLM, StoppingCriteria, StoppingCriteriaList
+
+from prediction_store import PredictionJournal
+
+sys.stdout.reconfigure(encoding='utf-8')
+
+# --- Configuration ---
+MODEL_NAME = "seeklhy/codes-7b"
+TABLES_JSON_PATH = "./evaluation_data/tables.json"
+BENCHMARK_FILE_PATH = "./evaluation_data/annotated.json"
+PREDICTION_FILE_PATH = "./input/res/prediction_codes.json"
+# Prompts longer than this are shortened by cutting the end of the schema section
+MAX_PROMPT_TOKENS = 2048
+MAX_NEW_TOKENS = 512
+BATCH_SIZE = 8
+# A batch is also limited to BATCH_SIZE * length <= MAX_BATCH_TOKENS, so long prompts get smaller batches
+MAX_BATCH_TOKENS = 8192
+# Generation of a sequence ends as soon as its new text contains one of these
+STOP_STRINGS = (";", "###")
+
+# Prompt of generate_sql() in codes_7b_model_test_MIMIC_IV.ipynb, character for character: every
+# line there ends in a literal "\n" plus the line break, which leaves a blank line after each line.
+# The question comes before the schema
+CODES_PROMPT_TEMPLATE = """### Instructions:\n
+Your task is to convert a question into a SQL query, given a database schema.\n
+Adhere to these rules:\n
+- **Deliberately go through the question and database schema word by word** to appropriately answer the question.\n
+- **Use Table Aliases** to prevent ambiguity. For example, `SELECT t1.col1, t2.col2 FROM table1 AS t1 JOIN table2 AS t2 ON t1.id = t2.id`.\n
+\n
+### Input:\n
+Question: {question}\n
+\n
+### Database Schema:\n
+{schema}\n
+\n
+### SQL Query:"""
+
+
+def get_schema_context(schema_path: str) -> str:
+    """Formats tables.json as 'Table name, columns = [...]' lines, like the CodeS notebooks."""
+    with open(schema_path, 'r', encoding='utf-8') as f:
+        schema_data = json.load(f)[0]
+    context_parts = []
+    for i, table_name in enumerate(schema_data['table_names_original']):
+        table_columns = [col[1] for col in schema_data['column_names_original'] if col[0] == i]
+        context_parts.append(f"Table {table_name}, columns = [{', '.join(table_columns)}]")
+    return '\n'.join(context_parts)
+
+
+def load_codes_model(model_name: str = MODEL_NAME):
+    """Loads a CodeS model and its tokenizer (fp16 on GPU, fp32 on CPU)."""
+    tokenizer = AutoTokenizer.from_pretrained(model_name, trust_remote_code=True)
+    model = AutoModelForCausalLM.from_pretrained(
+        model_name,
+        torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
+        device_map="auto" if torch.cuda.is_available() else None,
+        trust_remote_code=True
+    )
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    model.eval()
+    return model, tokenizer
+
+
+class StopOnStrings(StoppingCriteria):
+    """
+    Marks a sequence as finished once its generated text contains a stop string.
+    Returns one flag per row, so finished rows stop while the rest of the batch
+    keeps generating. Only the last few tokens are decoded per step.
+    """
+
+    def __init__(self, tokenizer, stop_strings, prompt_length: int, lookback_tokens: int = 8):
+        self.tokenizer = tokenizer
+        self.stop_strings = stop_strings
+        self.prompt_length = prompt_length
+        self.lookback_tokens = lookback_tokens
+
+    def __call__(self, input_ids: torch.LongTensor, scores, **kwargs) -> torch.BoolTensor:
+        start = max(self.prompt_length, input_ids.shape[1] - self.lookback_tokens)
+        tails = self.tokenizer.batch_decode(input_ids[:, start:], skip_special_tokens=True)
+        return torch.tensor([any(stop in tail for stop in self.stop_strings) for tail in tails],
+                            dtype=torch.bool, device=input_ids.device)
+
+
+class BatchedSQLGenerator:
+    """
+    Greedy SQL generation for many questions at once with a Hugging Face model.
+
+    The prompt is split around its placeholders: the schema part is tokenized
+    once and its ids reused for every question, only the question part is
+    tokenized per question. Prompts are sorted by length and cut into batches of
+    similar length, left-padded (so all rows end where generation starts) and
+    generated together; rows stop individually at a stop string.
+    """
+
+    def __init__(self, model, tokenizer, schema: str, template: str = CODES_PROMPT_TEMPLATE,
+                 max_prompt_tokens: int = MAX_PROMPT_TOKENS, max_new_tokens: int = MAX_NEW_TOKENS,
+                 batch_size: int = BATCH_SIZE, max_batch_tokens: int = MAX_BATCH_TOKENS,
+                 stop_strings=STOP_STRINGS):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.max_prompt_tokens = max_prompt_tokens
+        self.max_new_tokens = max_new_tokens
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.stop_strings = stop_strings
+
+        # template = head + {question} + middle + {schema} + tail (or schema first)
+        question_first = template.index("{question}") < template.index("{schema}")
+        first, second = ("{question}", "{schema}") if question_first else ("{schema}", "{question}")
+        head, rest = template.split(first)
+        middle, tail = rest.split(second)
+        self.question_first = question_first
+        if question_first:
+            self.question_head = head
+            self.schema_ids = tokenizer(middle + schema, add_special_tokens=False)["input_ids"]
+            self.tail_ids = tokenizer(tail, add_special_tokens=False)["input_ids"]
+        else:
+            self.prefix_ids = tokenizer(head + schema + middle)["input_ids"]
+            self.tail = tail
+        self.tokens_generated = 0
+        self.padding_tokens = 0
+
+    def encode(self, question: str) -> list:
+        """Token ids of the full prompt for one question, using the cached schema ids."""
+        if self.question_first:
+            question_ids = self.tokenizer(self.question_head + question)["input_ids"]
+            budget = self.max_prompt_tokens - len(question_ids) - len(self.tail_ids)
+            return question_ids + self.schema_ids[:max(0, budget)] + self.tail_ids
+        suffix_ids = self.tokenizer(question + self.tail, add_special_tokens=False)["input_ids"]
+        budget = self.max_prompt_tokens - len(suffix_ids)
+        return self.prefix_ids[:max(0, budget)] + suffix_ids
+
+    def _batches(self, encoded: list):
+        """Yields lists of indices into 'encoded', grouped by similar length."""
+        order = sorted(range(len(encoded)), key=lambda i: len(encoded[i]))
+        batch = []
+        for index in order:
+            # Sorted ascending, so the current prompt is the longest in the batch
+            if batch and (len(batch) == self.batch_size
+                          or (len(batch) + 1) * len(encoded[index]) > self.max_batch_tokens):
+                yield batch
+                batch = []
+            batch.append(index)
+        if batch:
+            yield batch
+
+    def _cut(self, text: str) -> str:
+        for stop in self.stop_strings:
+            if stop in text:
+                text = text[:text.index(stop)]
+        return text.strip()
+
+    def generate(self, questions: list, on_batch=None) -> list:
+        """
+        Returns the SQL for every question, in input order. on_batch(indices, sqls)
+        is called after each batch (e.g. to journal results and print progress).
+        """
+        encoded = [self.encode(question) for question in questions]
+        results = [None] * len(questions)
+        device = self.model.device
+        pad_id = self.tokenizer.pad_token_id
+
+        for indices in self._batches(encoded):
+            length = max(len(encoded[i]) for i in indices)
+            input_ids = torch.full((len(indices), length), pad_id, dtype=torch.long)
+            attention_mask = torch.zeros((len(indices), length), dtype=torch.long)
+            for row, index in enumerate(indices):
+                ids = encoded[index]
+                input_ids[row, length - len(ids):] = torch.tensor(ids, dtype=torch.long)
+                attention_mask[row, length - len(ids):] = 1
+            self.padding_tokens += int((attention_mask == 0).sum())
+
+            stopping = StoppingCriteriaList([StopOnStrings(self.tokenizer, self.stop_strings, length)])
+            with torch.inference_mode():
+                outputs = self.model.generate(
+                    input_ids=input_ids.to(device),
+                    attention_mask=attention_mask.to(device),
+                    max_new_tokens=self.max_new_tokens,
+                    do_sample=False,
+                    pad_token_id=pad_id,
+                    stopping_criteria=stopping,
+                )
+            new_tokens = outputs[:, length:]
+            self.tokens_generated += int((new_tokens != pad_id).sum())
+            texts = self.tokenizer.batch_decode(new_tokens, skip_special_tokens=True)
+            sqls = [self._cut(text) for text in texts]
+            for index, sql in zip(indices, sqls):
+                results[index] = sql
+            if on_batch:
+                on_batch(indices, sqls)
+        return results
+
+
+def main():
+    """Generates SQL for the whole benchmark with a CodeS model, resuming from the prediction journal."""
+    parser = argparse.ArgumentParser(description="Batched CodeS SQL generation over annotated.json.")
+    parser.add_argument("--model_name", default=MODEL_NAME)
+    parser.add_argument("--tables_file", default=TABLES_JSON_PATH)
+    parser.add_argument("--data_file", default=BENCHMARK_FILE_PATH)
+    parser.add_argument("--pred_file", default=PREDICTION_FILE_PATH)
+    parser.add_argument("--batch_size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--max_batch_tokens", type=int, default=MAX_BATCH_TOKENS)
+    parser.add_argument("--limit", type=int, default=None, help="Only the first N questions.")
+    args = parser.parse_args()
+
+    with open(args.data_file, 'r', encoding='utf-8') as f:
+        benchmark_data = json.load(f)[:args.limit]
+    schema_context = get_schema_context(args.tables_file)
+
+    journal = PredictionJournal(args.pred_file)
+    predictions = journal.load()
+    pending = [item for item in benchmark_data
+               if item.get("id") and item.get("question") and item["id"] not in predictions]
+    print(f"{len(pending)} questions to generate ({len(predictions)} already predicted).")
+    if not pending:
+        return
+
+    print(f"🤖 Loading {args.model_name}...")
+    model, tokenizer = load_codes_model(args.model_name)
+    generator = BatchedSQLGenerator(model, tokenizer, schema_context, batch_size=args.batch_size,
+                                    max_batch_tokens=args.max_batch_tokens)
+    start = time.perf_counter()
+    done = 0
+
+    def save_batch(indices, sqls):
+        nonlocal done
+        for index, sql in zip(indices, sqls):
+            predictions[pending[index]["id"]] = sql
+            journal.append(pending[index]["id"], sql)
+        done += len(indices)
+        elapsed = time.perf_counter() - start
+        print(f"--- {done}/{len(pending)} generated ({done / elapsed:.2f} questions/s) ---")
+
+    try:
+        generator.generate([item["question"] for item in pending], on_batch=save_batch)
+    finally:
+        journal.close()
+        journal.compact(predictions)
+
+    elapsed = time.perf_counter() - start
+    print(f"\n✅ Generated {done} queries in {elapsed:.0f}s, {generator.tokens_generated} new tokens "
+          f"({generator.tokens_generated / elapsed:.1f} tokens/s), {generator.padding_tokens} padding tokens.")
+    print(f"Predictions saved to: {args.pred_file}")
+
+
+if __name__ == "__main__":
+    main()
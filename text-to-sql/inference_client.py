@@ -0,0 +1,187 @@
+# inference_client.py
+import time
+import random
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+from streaming_client import stream_completion
+from server_pool import ServerPool
+from completion_cache import request_key
+
+# Status codes worth retrying: rate limiting, server busy / still loading the model
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# After a failed /props lookup the completion cache is bypassed for this long before asking again
+PROPS_RETRY_SECONDS = 30.0
+
+
+class InferenceClient:
+    """
+    Shared HTTP client for one or more llama-server /completion endpoints.
+
+    Uses one pooled keep-alive Session for all worker threads, connect/read
+    timeouts and exponential-backoff retries on connection errors, timeouts and
+    retryable status codes. With several server URLs every request goes to the
+    least-loaded healthy server and a failed server is skipped on the retry
+    (see server_pool.ServerPool). With slots_per_server, every request is sent
+    to a free slot ('id_slot') of the chosen server instead of a fixed slot per
+    worker thread, so requests never queue behind each other on one slot.
+
+    complete() never raises for transport problems. It returns {"ok": False,
+    "error": ...} so callers can skip persisting the item and retry it on the
+    next run. With a completion_cache, identical requests to the same model
+    (the GGUF path the servers report in /props) are answered locally without
+    touching the server.
+    """
+
+    def __init__(self, server_urls, pool_size: int = 4, connect_timeout: float = 5.0,
+                 read_timeout: float = 600.0, max_retries: int = 3, backoff_seconds: float = 1.0,
+                 stream_early_stop: bool = False, completion_cache=None, slots_per_server: int = None):
+        if isinstance(server_urls, str):
+            server_urls = [server_urls]
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.stream_early_stop = stream_early_stop
+        self.completion_cache = completion_cache
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(server_urls), pool_maxsize=max(1, pool_size))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.servers = ServerPool(server_urls, session=self.session, slots_per_server=slots_per_server)
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.retries = 0
+        self.total_latency = 0.0
+        self.prompt_tokens = 0
+        self.predicted_tokens = 0
+        self.cache_hits = 0
+        self._model_id = None
+        self._props_failed_at = None
+
+    def model_identity(self):
+        """
+        The model path all servers report in /props, fetched once. None while a
+        server does not answer /props: the completion cache is then bypassed and
+        /props is not asked again for PROPS_RETRY_SECONDS. When the servers serve
+        different models or do not report one, the completion cache is turned off.
+        """
+        if self._model_id is not None:
+            return self._model_id
+        if self._props_failed_at is not None and time.monotonic() - self._props_failed_at < PROPS_RETRY_SECONDS:
+            return None
+        models = set()
+        for backend in self.servers.backends:
+            try:
+                response = self.session.get(backend.props_url, timeout=self.timeout[0])
+                response.raise_for_status()
+                props = response.json()
+            except (requests.exceptions.RequestException, ValueError):
+                self._props_failed_at = time.monotonic()
+                return None
+            # Older llama-server builds only report the model in the default generation settings
+            models.add(props.get("model_path") or (props.get("default_generation_settings") or {}).get("model"))
+        if None in models or len(models) != 1:
+            print(f"❌ Completion cache disabled: servers report models {sorted(map(str, models))}")
+            self.completion_cache = None
+            return None
+        self._model_id = models.pop()
+        return self._model_id
+
+    def check_health(self) -> int:
+        """Probes every server's /health and returns the number of healthy ones."""
+        return self.servers.check_all()
+
+    def _post(self, data: dict) -> dict:
+        with self.servers.acquire() as (backend, slot):
+            if slot is not None:
+                data = dict(data, id_slot=slot)
+            try:
+                if self.stream_early_stop:
+                    return stream_completion(backend.url, data, session=self.session, timeout=self.timeout)
+                response = self.session.post(backend.url, json=data, timeout=self.timeout)
+                response.raise_for_status()
+                return response.json()
+            except requests.exceptions.ReadTimeout:
+                # A slow answer from a server that still passes /health means it is busy, not down
+                if not self.servers.check_health(backend):
+                    self.servers.mark_down(backend)
+                raise
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                # Take the server out of rotation until its /health check passes again
+                self.servers.mark_down(backend)
+                raise
+
+    def complete(self, data: dict) -> dict:
+        """
+        Sends one completion request. Returns {"ok", "content", "response", "latency", "error"}
+        where 'response' is the server's JSON (or the streamed equivalent).
+        """
+        cache_key = None
+        model_id = self.model_identity() if self.completion_cache is not None else None
+        if model_id is not None:
+            cache_key = request_key(data, model_id)
+            cached = self.completion_cache.get(cache_key)
+            if cached is not None:
+                with self._lock:
+                    self.cache_hits += 1
+                return {"ok": True, "content": cached.strip(), "response": {"content": cached, "cached": True},
+                        "latency": 0.0, "error": None}
+
+        error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                with self._lock:
+                    self.retries += 1
+                time.sleep(self.backoff_seconds * (2 ** (attempt - 1)) * (1 + random.random()))
+
+            start = time.perf_counter()
+            try:
+                result = self._post(data)
+            except requests.exceptions.HTTPError as e:
+                error = e
+                if e.response is not None and e.response.status_code not in RETRY_STATUS_CODES:
+                    break
+                continue
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError) as e:
+                error = e
+                continue
+            except (requests.exceptions.RequestException, ValueError) as e:
+                error = e
+                break
+
+            latency = time.perf_counter() - start
+            self._record(latency, result)
+            if cache_key is not None:
+                self.completion_cache.put(cache_key, result.get("content", ""))
+            return {"ok": True, "content": result.get("content", "").strip(), "response": result,
+                    "latency": latency, "error": None}
+
+        with self._lock:
+            self.requests += 1
+            self.failures += 1
+        return {"ok": False, "content": None, "response": None, "latency": None, "error": str(error)}
+
+    def _record(self, latency: float, result: dict):
+        with self._lock:
+            self.requests += 1
+            self.total_latency += latency
+            self.prompt_tokens += result.get("tokens_evaluated") or 0
+            self.predicted_tokens += result.get("tokens_predicted") or result.get("tokens_streamed") or 0
+
+    def report(self) -> str:
+        succeeded = self.requests - self.failures
+        avg_latency = self.total_latency / succeeded if succeeded else 0.0
+        tokens_per_second = self.predicted_tokens / self.total_latency if self.total_latency else 0.0
+        return (f"Inference client: {succeeded}/{self.requests} requests succeeded ({self.retries} retries, "
+                f"{self.cache_hits} answered from the completion cache), "
+                f"avg latency {avg_latency:.2f}s, {self.prompt_tokens} prompt / {self.predicted_tokens} "
+                f"generated tokens ({tokens_per_second:.1f} generated tokens/s per request stream).\n"
+                + self.servers.report())
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,202 @@
+# instrumentation.py
+import sys
+import json
+import math
+import time
+import threading
+from contextlib import contextmanager
+
+sys.stdout.reconfigure(encoding='utf-8')
+
+# llama-server 'timings' fields copied into every request event
+TIMING_FIELDS = ("prompt_n", "prompt_ms", "predicted_n", "predicted_ms")
+
+
+def percentile(values: list, q: float) -> float:
+    """Nearest-rank percentile (q in 0..100) of a list of numbers."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def _distribution(values: list) -> dict:
+    return {"count": len(values), "total": sum(values), "p50": percentile(values, 50),
+            "p95": percentile(values, 95), "p99": percentile(values, 99)}
+
+
+def summarize(events: list) -> dict:
+    """
+    Aggregates span and request events: latency percentiles per stage, token
+    throughput from the server timings and prefix/completion cache hit rates.
+    """
+    stages = {}
+    for event in events:
+        if event["type"] == "span":
+            stages.setdefault(event["stage"], []).append(event["seconds"])
+
+    requests = [event for event in events if event["type"] == "request"]
+    served = [r for r in requests if not r.get("cached")]
+    # The in-process backend reports prompt_n but no server-side milliseconds
+    counted = [r for r in served if r.get("prompt_n") is not None and r.get("tokens_evaluated")]
+    prompt_tokens = sum(r["tokens_evaluated"] for r in counted)
+    prefilled = sum(r["prompt_n"] for r in counted)
+    timed = [r for r in served if r.get("prompt_ms") is not None]
+    prompt_ms = sum(r["prompt_ms"] for r in timed)
+    predicted_ms = sum(r.get("predicted_ms") or 0 for r in timed)
+    # Streamed requests, including those cancelled before the server sent its timings
+    streamed = [r for r in served if r.get("first_token_ms") is not None and (r.get("tokens_streamed") or 0) > 1]
+    stream_ms = sum(r["stream_ms"] - r["first_token_ms"] for r in streamed)
+    labels = [event["label"] for event in events if event["type"] == "run" and event.get("label")]
+
+    return {
+        "label": labels[-1] if labels else None,
+        "stages": {stage: _distribution(seconds) for stage, seconds in stages.items()},
+        "requests": {
+            "count": len(requests),
+            "latency": _distribution([r["latency"] for r in served if r.get("latency") is not None]),
+            "prefill_ms": _distribution([r["prompt_ms"] for r in timed]),
+            "decode_ms": _distribution([r.get("predicted_ms") or 0 for r in timed]),
+            "first_token_ms": _distribution([r["first_token_ms"] for r in streamed]),
+            "streamed_tokens_per_second":
+                sum(r["tokens_streamed"] - 1 for r in streamed) / (stream_ms / 1000) if stream_ms else 0.0,
+            "completion_cache_hit_rate": (len(requests) - len(served)) / len(requests) if requests else 0.0,
+            "stopped_early": sum(1 for r in served if r.get("stopped_early")),
+            "with_server_timings": len(timed),
+            "without_token_counts": len(served) - len(counted),
+            "prefix_cache_hit_rate": 1 - prefilled / prompt_tokens if prompt_tokens else 0.0,
+            "prefill_tokens_per_second":
+                sum(r.get("prompt_n") or 0 for r in timed) / (prompt_ms / 1000) if prompt_ms else 0.0,
+            "decode_tokens_per_second":
+                sum(r.get("predicted_n") or 0 for r in timed) / (predicted_ms / 1000) if predicted_ms else 0.0,
+        },
+    }
+
+
+def load_events(trace_path: str, last_run_only: bool = True) -> list:
+    """Reads a trace file; by default only the events of its most recent run."""
+    events = []
+    with open(trace_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                event = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # torn last line of an interrupted run
+            if event["type"] == "run" and last_run_only:
+                events = []
+            events.append(event)
+    return events
+
+
+class Tracer:
+    """
+    Collects timing spans around pipeline stages and the server-side timings of
+    every completion request, and appends them as JSON lines to 'trace_path'
+    (one 'run' header event per run, so resumed runs share one file).
+
+    Spans and requests are tagged with the benchmark item the current worker
+    thread is processing (see item()). Thread-safe; without a trace_path the
+    events are only kept in memory for the summary.
+    """
+
+    def __init__(self, trace_path: str = None, label: str = None):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.events = []
+        self.trace_path = trace_path
+        self._file = None
+        self._emit({"type": "run", "label": label, "started": time.time()})
+
+    def _emit(self, event: dict):
+        with self._lock:
+            self.events.append(event)
+            if not self.trace_path or event["type"] == "run":
+                return
+            if self._file is None:
+                # Opened with the first span or request, so importing a runner (e.g. from
+                # benchmark_throughput.py) does not append an empty run to its trace file
+                # Line-buffered, so every event is on disk even if the run is killed
+                self._file = open(self.trace_path, 'a', encoding='utf-8', buffering=1)
+                self._file.write(json.dumps(self.events[0]) + "\n")
+            self._file.write(json.dumps(event) + "\n")
+
+    @contextmanager
+    def item(self, item_id: str):
+        """Tags every span and request on this thread with item_id while active."""
+        previous = getattr(self._local, "item_id", None)
+        self._local.item_id = item_id
+        try:
+            yield
+        finally:
+            self._local.item_id = previous
+
+    @contextmanager
+    def span(self, stage: str, **fields):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._emit({"type": "span", "stage": stage, "seconds": time.perf_counter() - start,
+                        "id": getattr(self._local, "item_id", None), **fields})
+
+    def record_request(self, result: dict):
+        """Records one InferenceClient/LlamaCppBackend result with the server's 'timings'."""
+        response = result.get("response") or {}
+        timings = response.get("timings") or {}
+        event = {"type": "request", "id": getattr(self._local, "item_id", None), "ok": result.get("ok"),
+                 "latency": result.get("latency"), "cached": bool(response.get("cached")),
+                 "stopped_early": bool(response.get("stopped_early")),
+                 "tokens_evaluated": response.get("tokens_evaluated"),
+                 "tokens_streamed": response.get("tokens_streamed"),
+                 "first_token_ms": response.get("first_token_ms"), "stream_ms": response.get("stream_ms")}
+        event.update({field: timings.get(field) for field in TIMING_FIELDS})
+        self._emit(event)
+
+    def summary(self) -> dict:
+        with self._lock:
+            return summarize(list(self.events))
+
+    def report(self) -> str:
+        return format_summary(self.summary())
+
+    def close(self):
+        with self._lock:
+            self.trace_path = None
+            if self._file:
+                self._file.close()
+                self._file = None
+
+
+def format_summary(summary: dict) -> str:
+    lines = [f"--- Timing summary{' (' + summary['label'] + ')' if summary.get('label') else ''} ---"]
+    for stage, d in summary["stages"].items():
+        lines.append(f"  {stage:<12} {d['count']:>6}x  total {d['total']:8.2f}s  p50 {d['p50'] * 1000:8.1f}ms  "
+                     f"p95 {d['p95'] * 1000:8.1f}ms  p99 {d['p99'] * 1000:8.1f}ms")
+    r = summary["requests"]
+    lines.append(f"  requests: {r['count']} (completion cache hit rate {r['completion_cache_hit_rate']:.1%}, "
+                 f"{r['stopped_early']} stopped early), latency p50 {r['latency']['p50']:.2f}s "
+                 f"p95 {r['latency']['p95']:.2f}s p99 {r['latency']['p99']:.2f}s")
+    lines.append(f"  server timings for {r['with_server_timings']} requests: prefill p50 {r['prefill_ms']['p50']:.0f}ms "
+                 f"p95 {r['prefill_ms']['p95']:.0f}ms ({r['prefill_tokens_per_second']:.1f} tokens/s), decode p50 "
+                 f"{r['decode_ms']['p50']:.0f}ms p95 {r['decode_ms']['p95']:.0f}ms "
+                 f"({r['decode_tokens_per_second']:.1f} tokens/s)")
+    lines.append(f"  client side: time to first token p50 {r['first_token_ms']['p50']:.0f}ms "
+                 f"p95 {r['first_token_ms']['p95']:.0f}ms, {r['streamed_tokens_per_second']:.1f} streamed tokens/s; "
+                 f"prefix cache hit rate {r['prefix_cache_hit_rate']:.1%} "
+                 f"({r['without_token_counts']} requests without token counts not included)")
+    return "\n".join(lines)
+
+
+def main():
+    """Prints the summaries of one or more trace files side by side (e.g. one per model/evaluation folder)."""
+    if len(sys.argv) < 2:
+        print("Usage: python instrumentation.py TRACE.jsonl [TRACE.jsonl ...]")
+        return
+    for trace_path in sys.argv[1:]:
+        summary = summarize(load_events(trace_path))
+        summary["label"] = summary["label"] or trace_path
+        print(format_summary(summary) + "\n")
+
+
+if __name__ == "__main__":
+    main()
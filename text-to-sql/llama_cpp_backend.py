@@ -0,0 +1,382 @@
+# llama_cpp_backend.py
+import os
+import time
+import threading
+
+from streaming_client import sql_is_complete
+from completion_cache import request_key, model_file_identity
+from prompt_budget import TokenCounter
+
+try:
+    import llama_cpp
+    from llama_cpp import Llama
+except ImportError:
+    llama_cpp = Llama = None
+
+# llama-server's default sampling settings, used when a request does not set them
+DEFAULT_TEMPERATURE = 0.8
+DEFAULT_TOP_K = 40
+DEFAULT_TOP_P = 0.95
+DEFAULT_MIN_P = 0.05
+
+
+class _Request:
+    """One completion while it is queued for or decoded on a sequence."""
+
+    def __init__(self, data: dict, prompt_tokens: list, n_predict: int, sampler):
+        self.data = data
+        self.prompt_tokens = prompt_tokens
+        self.n_predict = n_predict
+        self.sampler = sampler
+        self.stop = data.get("stop") or []
+        self.cached = 0
+        self.generated = 0
+        self.text = b""
+        self.stopped_early = False
+        self.start = time.perf_counter()
+        self.first_token_at = None
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class _Sequence:
+    """A sequence id of the shared context and the tokens its KV cells currently hold."""
+
+    def __init__(self, seq_id: int):
+        self.seq_id = seq_id
+        self.tokens = []
+        self.request = None
+        # Prompt tokens still to be prefilled, and the sampled token still to be decoded
+        self.pending = []
+        self.next_token = None
+
+
+class LlamaCppBackend:
+    """
+    Runs completions in-process with llama-cpp-python instead of over HTTP.
+
+    Exposes the same complete(data) -> {"ok", "content", "response", "latency",
+    "error"} interface as InferenceClient, and accepts the same llama-server
+    request fields (prompt, n_predict, stop, temperature, seed, grammar,
+    id_slot), so the runners can switch backends without other changes.
+
+    All requests share one llama.cpp context with n_sequences sequence ids
+    (n_seq_max), each with n_ctx tokens of KV cache. A single scheduler thread
+    puts the next token of every running sequence, plus up to n_batch pending
+    prompt tokens, into one llama_batch, so one llama_decode call advances all
+    sequences at once, like llama-server's continuous batching. A new request
+    goes to the idle sequence whose cached tokens share the longest prefix with
+    its prompt ('id_slot' breaks ties), so only the per-question suffix is
+    prefilled again.
+    """
+
+    def __init__(self, model_path: str, n_sequences: int = 1, n_ctx: int = 4096, n_threads: int = None,
+                 n_batch: int = 512, n_gpu_layers: int = 0, stream_early_stop: bool = False,
+                 completion_cache=None):
+        if Llama is None:
+            raise ImportError("llama-cpp-python is not installed (pip install llama-cpp-python)")
+        n_sequences = max(1, int(n_sequences))
+        n_threads = n_threads or os.cpu_count() or 1
+        print(f"Loading {model_path} with {n_sequences} batched sequence(s) of {n_ctx} tokens, "
+              f"{n_threads} threads...")
+        # The Llama object loads the model and provides the tokenizer; its own context stays minimal
+        self.llm = Llama(model_path=model_path, n_ctx=256, n_batch=256, n_threads=1,
+                         n_gpu_layers=n_gpu_layers, use_mmap=True, verbose=False)
+        self.vocab = llama_cpp.llama_model_get_vocab(self.llm.model)
+
+        params = llama_cpp.llama_context_default_params()
+        params.n_ctx = n_ctx * n_sequences
+        params.n_batch = params.n_ubatch = n_batch
+        params.n_seq_max = n_sequences
+        params.n_threads = params.n_threads_batch = n_threads
+        # Separate KV buffers, so every sequence gets its full n_ctx
+        params.kv_unified = False
+        self.ctx = llama_cpp.llama_init_from_model(self.llm.model, params)
+        if not self.ctx:
+            raise RuntimeError(f"Could not create a llama.cpp context with {n_sequences} sequences")
+        self.memory = llama_cpp.llama_get_memory(self.ctx)
+        self.batch = llama_cpp.llama_batch_init(n_batch, 0, 1)
+
+        self.n_ctx = n_ctx
+        self.n_batch = n_batch
+        self.stream_early_stop = stream_early_stop
+        self.completion_cache = completion_cache
+        self.model_id = model_file_identity(model_path)
+        self.sequences = [_Sequence(seq_id) for seq_id in range(n_sequences)]
+
+        self._queue = []
+        self._closed = False
+        self._work = threading.Condition()
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.total_latency = 0.0
+        self.prompt_tokens = 0
+        self.cached_prompt_tokens = 0
+        self.predicted_tokens = 0
+        self.cache_hits = 0
+        self.decode_calls = 0
+        self.batched_sequences = 0
+
+        self._scheduler = threading.Thread(target=self._run, name="llama-cpp-scheduler", daemon=True)
+        self._scheduler.start()
+
+    def check_health(self) -> int:
+        """Number of sequences decoded together (the counterpart of the healthy server count)."""
+        return len(self.sequences)
+
+    def _sampler(self, data: dict):
+        """A sampler chain for one request: grammar, then llama-server's default top-k/top-p/min-p and temperature."""
+        chain = llama_cpp.llama_sampler_chain_init(llama_cpp.llama_sampler_chain_default_params())
+        if data.get("grammar"):
+            grammar = llama_cpp.llama_sampler_init_grammar(self.vocab, data["grammar"].encode('utf-8'), b"root")
+            if not grammar:
+                llama_cpp.llama_sampler_free(chain)
+                raise ValueError("Could not parse the request's GBNF grammar")
+            llama_cpp.llama_sampler_chain_add(chain, grammar)
+        temperature = data.get("temperature", DEFAULT_TEMPERATURE)
+        if temperature <= 0:
+            llama_cpp.llama_sampler_chain_add(chain, llama_cpp.llama_sampler_init_greedy())
+            return chain
+        seed = data.get("seed")
+        for sampler in (llama_cpp.llama_sampler_init_top_k(DEFAULT_TOP_K),
+                        llama_cpp.llama_sampler_init_top_p(DEFAULT_TOP_P, 1),
+                        llama_cpp.llama_sampler_init_min_p(DEFAULT_MIN_P, 1),
+                        llama_cpp.llama_sampler_init_temp(temperature),
+                        llama_cpp.llama_sampler_init_dist(llama_cpp.LLAMA_DEFAULT_SEED if seed is None else seed)):
+            llama_cpp.llama_sampler_chain_add(chain, sampler)
+        return chain
+
+    def _admit(self):
+        """Moves queued requests onto idle sequences. Called with self._work held."""
+        while self._queue:
+            idle = [sequence for sequence in self.sequences if sequence.request is None]
+            if not idle:
+                return
+            request = self._queue.pop(0)
+            prompt = request.prompt_tokens
+
+            def shared(sequence):
+                length = 0
+                for old, new in zip(sequence.tokens, prompt):
+                    if old != new:
+                        break
+                    length += 1
+                return length, sequence.seq_id == request.data.get("id_slot")
+
+            sequence = max(idle, key=shared)
+            # The last prompt token is always evaluated again, its logits start the generation
+            cached = min(shared(sequence)[0], len(prompt) - 1)
+            llama_cpp.llama_memory_seq_rm(self.memory, sequence.seq_id, cached, -1)
+            sequence.tokens = prompt[:cached]
+            sequence.pending = prompt[cached:]
+            sequence.next_token = None
+            sequence.request = request
+            request.cached = cached
+
+    def _add(self, n: int, token: int, sequence: _Sequence, logits: bool):
+        self.batch.token[n] = token
+        self.batch.pos[n] = len(sequence.tokens)
+        self.batch.n_seq_id[n] = 1
+        self.batch.seq_id[n][0] = sequence.seq_id
+        self.batch.logits[n] = logits
+        sequence.tokens.append(token)
+
+    def _step(self):
+        """Decodes one batch with a token (or a prompt chunk) from every running sequence."""
+        n = 0
+        sampled = []
+        running = [sequence for sequence in self.sequences if sequence.request is not None]
+        for sequence in running:
+            if sequence.next_token is not None:
+                self._add(n, sequence.next_token, sequence, True)
+                sequence.next_token = None
+                sampled.append((sequence, n))
+                n += 1
+        for sequence in running:
+            if not sequence.pending or n >= self.n_batch:
+                continue
+            chunk = sequence.pending[:self.n_batch - n]
+            sequence.pending = sequence.pending[len(chunk):]
+            for index, token in enumerate(chunk):
+                self._add(n, token, sequence, not sequence.pending and index == len(chunk) - 1)
+                n += 1
+            if not sequence.pending:
+                sampled.append((sequence, n - 1))
+        self.batch.n_tokens = n
+
+        status = llama_cpp.llama_decode(self.ctx, self.batch)
+        with self._lock:
+            self.decode_calls += 1
+            self.batched_sequences += len({sequence.seq_id for sequence in running})
+        if status != 0:
+            for sequence in running:
+                self._finish(sequence, error=f"llama_decode failed with status {status}")
+            return
+
+        for sequence, index in sampled:
+            request = sequence.request
+            token = llama_cpp.llama_sampler_sample(request.sampler, self.ctx, index)
+            if request.first_token_at is None:
+                request.first_token_at = time.perf_counter()
+            if llama_cpp.llama_vocab_is_eog(self.vocab, token):
+                self._finish(sequence)
+                continue
+            piece = self.llm.detokenize([token])
+            request.text += piece
+            request.generated += 1
+            text = request.text.decode('utf-8', errors='ignore')
+            stops = [text.find(stop) for stop in request.stop if stop in text]
+            if stops:
+                request.text = text[:min(stops)].encode('utf-8')
+                self._finish(sequence)
+            elif (self.stream_early_stop and (b"`" in piece or b";" in piece) and sql_is_complete(text)):
+                request.stopped_early = True
+                self._finish(sequence)
+            elif request.generated >= request.n_predict or len(sequence.tokens) + 1 >= self.n_ctx:
+                self._finish(sequence)
+            else:
+                sequence.next_token = token
+
+    def _finish(self, sequence: _Sequence, error: str = None):
+        request = sequence.request
+        sequence.request = None
+        sequence.pending = []
+        sequence.next_token = None
+        if error is not None:
+            # The KV cells of a failed batch are unknown, so the sequence starts over
+            llama_cpp.llama_memory_seq_rm(self.memory, sequence.seq_id, 0, -1)
+            sequence.tokens = []
+            request.error = error
+        else:
+            end = time.perf_counter()
+            first = request.first_token_at or end
+            prompt_n = len(request.prompt_tokens) - request.cached
+            request.result = {
+                "content": request.text.decode('utf-8', errors='ignore'),
+                "stopped_early": request.stopped_early,
+                "tokens_evaluated": len(request.prompt_tokens),
+                "tokens_predicted": request.generated,
+                "id_slot": sequence.seq_id,
+                "timings": {"cache_n": request.cached, "prompt_n": prompt_n,
+                            "prompt_ms": (first - request.start) * 1000,
+                            "predicted_n": request.generated, "predicted_ms": (end - first) * 1000},
+            }
+        llama_cpp.llama_sampler_free(request.sampler)
+        request.done.set()
+
+    def _run(self):
+        while True:
+            with self._work:
+                self._admit()
+                while not self._closed and all(sequence.request is None for sequence in self.sequences):
+                    self._work.wait()
+                    self._admit()
+                if self._closed:
+                    break
+            try:
+                self._step()
+            except Exception as e:
+                # Never leave callers waiting on a dead scheduler
+                for sequence in self.sequences:
+                    if sequence.request is not None:
+                        self._finish(sequence, error=str(e))
+
+    def complete(self, data: dict) -> dict:
+        """
+        Runs one completion. Returns {"ok", "content", "response", "latency", "error"};
+        errors inside llama.cpp are reported, not raised, like InferenceClient does.
+        """
+        cache_key = None
+        if self.completion_cache is not None:
+            cache_key = request_key(data, self.model_id)
+            cached = self.completion_cache.get(cache_key)
+            if cached is not None:
+                with self._lock:
+                    self.cache_hits += 1
+                return {"ok": True, "content": cached.strip(), "response": {"content": cached, "cached": True},
+                        "latency": 0.0, "error": None}
+
+        start = time.perf_counter()
+        try:
+            prompt_tokens = self.llm.tokenize(data.get("prompt", "").encode('utf-8'), special=True)
+            if len(prompt_tokens) >= self.n_ctx:
+                raise ValueError(f"Prompt of {len(prompt_tokens)} tokens does not fit into n_ctx={self.n_ctx}")
+            n_predict = data.get("n_predict", -1)
+            if n_predict is None or n_predict < 0:
+                n_predict = self.n_ctx - len(prompt_tokens)
+            request = _Request(data, prompt_tokens, n_predict, self._sampler(data))
+        except (RuntimeError, ValueError) as e:
+            with self._lock:
+                self.requests += 1
+                self.failures += 1
+            return {"ok": False, "content": None, "response": None, "latency": None, "error": str(e)}
+
+        with self._work:
+            if self._closed:
+                raise RuntimeError("LlamaCppBackend is closed")
+            self._queue.append(request)
+            self._work.notify()
+        request.done.wait()
+        latency = time.perf_counter() - start
+
+        with self._lock:
+            self.requests += 1
+            if request.error is not None:
+                self.failures += 1
+            else:
+                self.total_latency += latency
+                self.prompt_tokens += len(prompt_tokens)
+                self.cached_prompt_tokens += request.cached
+                self.predicted_tokens += request.generated
+        if request.error is not None:
+            return {"ok": False, "content": None, "response": None, "latency": None, "error": request.error}
+        result = request.result
+        if cache_key is not None:
+            self.completion_cache.put(cache_key, result["content"])
+        return {"ok": True, "content": result["content"].strip(), "response": result,
+                "latency": latency, "error": None}
+
+    def report(self) -> str:
+        succeeded = self.requests - self.failures
+        avg_latency = self.total_latency / succeeded if succeeded else 0.0
+        avg_batch = self.batched_sequences / self.decode_calls if self.decode_calls else 0.0
+        return (f"llama.cpp backend: {succeeded}/{self.requests} completions succeeded on {len(self.sequences)} "
+                f"batched sequence(s) ({self.cache_hits} answered from the completion cache), avg latency "
+                f"{avg_latency:.2f}s, {self.decode_calls} decode calls with {avg_batch:.2f} sequences each on "
+                f"average, {self.prompt_tokens} prompt tokens ({self.cached_prompt_tokens} reused from the KV "
+                f"cache), {self.predicted_tokens} generated tokens.")
+
+    def close(self):
+        with self._work:
+            self._closed = True
+            self._work.notify_all()
+        self._scheduler.join()
+        for sequence in self.sequences:
+            if sequence.request is not None:
+                self._finish(sequence, error="LlamaCppBackend was closed")
+        for request in self._queue:
+            request.error = "LlamaCppBackend was closed"
+            llama_cpp.llama_sampler_free(request.sampler)
+            request.done.set()
+        self._queue = []
+        llama_cpp.llama_batch_free(self.batch)
+        llama_cpp.llama_free(self.ctx)
+        self.llm.close()
+
+
+class LlamaTokenCounter(TokenCounter):
+    """TokenCounter that uses the loaded model's tokenizer instead of /tokenize."""
+
+    def __init__(self, backend: LlamaCppBackend):
+        self.llm = backend.llm
+        self._lock = threading.Lock()
+        self._counts = {}
+        self.requests = 0
+        self.estimated = 0
+
+    def _tokenize(self, text: str) -> int:
+        with self._lock:
+            self.requests += 1
+        return len(self.llm.tokenize(text.encode('utf-8'), add_bos=False, special=True))
@@ -0,0 +1,157 @@
+# merge_lora_streaming.py
+import os
+import gc
+import json
+import time
+import shutil
+import resource
+import torch
+from safetensors import safe_open
+from safetensors.torch import save_file
+from huggingface_hub import snapshot_download
+
+# --- Configuration ---
+# Hugging Face model id or a local directory with the base model's safetensors shards
+BASE_MODEL_NAME = "seeklhy/codes-7b"
+LORA_ADAPTER_PATH = "./models/lora-adapter-seeklhy-codes-7b/checkpoint-1755"
+MERGED_MODEL_PATH = "./models/finetuned-seeklhy-codes-7b-merged"
+# Precision of the W + scale * (B @ A) computation; the result is stored in the base tensor's dtype
+MERGE_DTYPE = torch.float32
+
+SINGLE_SHARD_NAME = "model.safetensors"
+INDEX_NAME = "model.safetensors.index.json"
+ADAPTER_NAME = "adapter_model.safetensors"
+ADAPTER_PREFIX = "base_model.model."
+
+
+def resolve_base_model(name: str) -> str:
+    """Returns a local directory for the base model, downloading only safetensors + config files if needed."""
+    if os.path.isdir(name):
+        return name
+    return snapshot_download(name, allow_patterns=["*.safetensors", "*.json", "*.txt", "*.model", "*.py"])
+
+
+def list_shards(base_dir: str) -> list:
+    index_path = os.path.join(base_dir, INDEX_NAME)
+    if os.path.exists(index_path):
+        with open(index_path, 'r', encoding='utf-8') as f:
+            return sorted(set(json.load(f)["weight_map"].values()))
+    if os.path.exists(os.path.join(base_dir, SINGLE_SHARD_NAME)):
+        return [SINGLE_SHARD_NAME]
+    if any(file_name.endswith(".bin") for file_name in os.listdir(base_dir)):
+        raise ValueError(f"'{base_dir}' only has PyTorch .bin weights; the streaming merge needs safetensors "
+                         f"shards (convert the model first or use merge_lora.py)")
+    raise FileNotFoundError(f"No safetensors weights found in '{base_dir}' "
+                            f"(the streaming merge only reads safetensors)")
+
+
+def load_lora_deltas(adapter_dir: str) -> dict:
+    """
+    Reads the (small) adapter and returns {base tensor name: (A, B, scale, is_embedding)}.
+    PEFT stores 'base_model.model.<module>.lora_A.weight'; the base tensor is '<module>.weight'.
+    """
+    adapter_path = os.path.join(adapter_dir, ADAPTER_NAME)
+    if not os.path.exists(adapter_path):
+        if os.path.exists(os.path.join(adapter_dir, "adapter_model.bin")):
+            raise ValueError(f"'{adapter_dir}' has a PyTorch .bin adapter; the streaming merge needs "
+                             f"{ADAPTER_NAME} (save the adapter with safe_serialization=True or use merge_lora.py)")
+        raise FileNotFoundError(f"No {ADAPTER_NAME} found in '{adapter_dir}'")
+    with open(os.path.join(adapter_dir, "adapter_config.json"), 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    if config.get("use_dora"):
+        raise ValueError("DoRA adapters cannot be merged as a plain low-rank delta.")
+    r, alpha = config["r"], config["lora_alpha"]
+    scale = alpha / (r ** 0.5) if config.get("use_rslora") else alpha / r
+    fan_in_fan_out = config.get("fan_in_fan_out", False)
+
+    pairs = {}
+    with safe_open(adapter_path, framework="pt") as f:
+        for key in f.keys():
+            name = key[len(ADAPTER_PREFIX):] if key.startswith(ADAPTER_PREFIX) else key
+            for part, slot in ((".lora_A.weight", "A"), (".lora_B.weight", "B"),
+                               (".lora_embedding_A", "A"), (".lora_embedding_B", "B")):
+                if name.endswith(part):
+                    module = name[:-len(part)]
+                    entry = pairs.setdefault(module + ".weight", {"embedding": "embedding" in part})
+                    entry[slot] = f.get_tensor(key).to(MERGE_DTYPE)
+                    break
+            else:
+                print(f"   Warning: adapter tensor '{key}' is not a LoRA A/B matrix and is ignored.")
+
+    deltas = {}
+    for base_name, entry in pairs.items():
+        if "A" not in entry or "B" not in entry:
+            raise ValueError(f"Incomplete LoRA pair for '{base_name}'")
+        deltas[base_name] = (entry["A"], entry["B"], scale, entry["embedding"] or fan_in_fan_out)
+    return deltas
+
+
+def merge_tensor(weight: torch.Tensor, lora_a: torch.Tensor, lora_b: torch.Tensor,
+                 scale: float, transpose: bool) -> torch.Tensor:
+    """W + scale * (B @ A), computed in MERGE_DTYPE and cast back to W's dtype."""
+    delta = lora_b @ lora_a
+    if transpose:
+        delta = delta.T
+    if delta.shape != weight.shape:
+        raise ValueError(f"LoRA delta shape {tuple(delta.shape)} does not match weight {tuple(weight.shape)}")
+    return (weight.to(MERGE_DTYPE) + scale * delta).to(weight.dtype)
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    """
+    Merges a LoRA adapter into the full-precision base model one safetensors
+    shard at a time: each shard is memory-mapped, its tensors are merged and the
+    merged shard is written before the next one is opened, so peak memory stays
+    around one shard instead of the whole 7B model.
+    """
+    print(" Starting streaming LoRA merge...")
+    print(f"   - Base Model: {BASE_MODEL_NAME}")
+    print(f"   - Adapter: {LORA_ADAPTER_PATH}")
+    print(f"   - Output: {MERGED_MODEL_PATH}")
+    start = time.perf_counter()
+
+    base_dir = resolve_base_model(BASE_MODEL_NAME)
+    shards = list_shards(base_dir)
+    deltas = load_lora_deltas(LORA_ADAPTER_PATH)
+    print(f" {len(deltas)} LoRA deltas loaded, {len(shards)} base shard(s) to process.")
+
+    os.makedirs(MERGED_MODEL_PATH, exist_ok=True)
+    merged_names = set()
+    for number, shard in enumerate(shards, 1):
+        merged = {}
+        with safe_open(os.path.join(base_dir, shard), framework="pt") as f:
+            metadata = f.metadata() or {}
+            for name in f.keys():
+                tensor = f.get_tensor(name)
+                if name in deltas:
+                    tensor = merge_tensor(tensor, *deltas[name])
+                    merged_names.add(name)
+                merged[name] = tensor.contiguous()
+        save_file(merged, os.path.join(MERGED_MODEL_PATH, shard), metadata={**metadata, "format": "pt"})
+        print(f"   [{number}/{len(shards)}] {shard}: {len(merged)} tensors written "
+              f"(peak RSS {peak_rss_mb():.0f} MB)")
+        del merged
+        gc.collect()
+
+    missing = set(deltas) - merged_names
+    if missing:
+        raise ValueError(f"{len(missing)} LoRA deltas matched no base tensor, e.g. '{sorted(missing)[0]}'")
+
+    # Config, tokenizer and the shard index are unchanged, so copy them as they are
+    for file_name in os.listdir(base_dir):
+        path = os.path.join(base_dir, file_name)
+        if os.path.isfile(path) and not file_name.endswith(".safetensors"):
+            shutil.copy(path, os.path.join(MERGED_MODEL_PATH, file_name))
+
+    print(f"\n Merge complete in {time.perf_counter() - start:.0f}s "
+          f"({len(merged_names)} tensors merged, peak RSS {peak_rss_mb():.0f} MB).")
+    print("   Your new, fine-tuned model is ready for GGUF conversion.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+# mock_llama_server.py
+import re
+import json
+import math
+import time
+import zlib
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --- Configuration ---
+HOST = "127.0.0.1"
+PORT = 8081
+# Canned answers: {id: raw model output}, as written by the runners
+REPLAY_FILE_PATH = "./text-to-sql/OmniSQL-7B.Q4_K_S.gguf_evaluation/raw_prediction.json"
+# Maps the question found in a prompt back to its id in the replay file
+BENCHMARK_FILE_PATH = "./evaluation_data/annotated.json"
+# Returned for prompts whose question is not in the replay file
+DEFAULT_ANSWER = "```sql\nSELECT 1;\n```"
+N_SLOTS = 4
+# Simulated throughput of one slot
+PREFILL_TOKENS_PER_SECOND = 2000.0
+DECODE_TOKENS_PER_SECOND = 40.0
+# Fixed per-request overhead drawn from LATENCY_DISTRIBUTION ("fixed", "normal" or "lognormal"), in seconds
+LATENCY_DISTRIBUTION = "lognormal"
+LATENCY_MEAN = 0.05
+LATENCY_STD = 0.02
+# Fraction of requests answered with 503, to exercise retries
+FAILURE_RATE = 0.0
+# /health answers 503 ("loading model") for this many seconds after start
+LOADING_SECONDS = 0.0
+
+QUESTION_PATTERN = re.compile(r"### Question:\s*(.*?)\s*### SQL:", re.DOTALL)
+# Rough stand-in for a BPE tokenizer: words, single punctuation characters and whitespace runs
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]|\s+")
+VOCAB_SIZE = 32000
+
+
+def tokenize(text: str) -> list:
+    return TOKEN_PATTERN.findall(text)
+
+
+def token_ids(pieces: list) -> list:
+    return [zlib.crc32(piece.encode('utf-8')) % VOCAB_SIZE for piece in pieces]
+
+
+def load_replay_answers(replay_path: str, benchmark_path: str) -> dict:
+    """Returns {normalized question: canned answer} from a raw prediction file and the benchmark."""
+    try:
+        with open(replay_path, 'r', encoding='utf-8') as f:
+            answers_by_id = json.load(f)
+        with open(benchmark_path, 'r', encoding='utf-8') as f:
+            benchmark_data = json.load(f)
+    except FileNotFoundError as e:
+        print(f"Warning: {e}. Every prompt gets the default answer.")
+        return {}
+    return {item["question"].strip(): answers_by_id[item["id"]]
+            for item in benchmark_data if item.get("question") and item.get("id") in answers_by_id}
+
+
+class Slot:
+    """One simulated sequence slot; remembers its last prompt for cache_prompt."""
+
+    def __init__(self, slot_id: int):
+        self.id = slot_id
+        self.busy = False
+        self.cached_tokens = []
+
+
+class MockLlamaServer:
+    """
+    Stand-in for llama-server that needs no model: answers /completion (plain and
+    SSE streaming), /tokenize and /health with the same JSON fields as the real
+    server. Generation time is simulated from prefill/decode token rates plus a
+    random per-request overhead, slots are limited like --parallel, and prompts
+    that share a prefix with a slot's previous prompt only "prefill" the new part
+    when cache_prompt is set. Answers are replayed from an earlier run's raw
+    predictions, looked up by the question inside the prompt.
+
+    The random draws are seeded from the prompt and request seed, so the same
+    requests produce the same latencies in every run.
+    """
+
+    def __init__(self, answers: dict = None, host: str = HOST, port: int = PORT, n_slots: int = N_SLOTS,
+                 prefill_tps: float = PREFILL_TOKENS_PER_SECOND, decode_tps: float = DECODE_TOKENS_PER_SECOND,
+                 latency_distribution: str = LATENCY_DISTRIBUTION, latency_mean: float = LATENCY_MEAN,
+                 latency_std: float = LATENCY_STD, failure_rate: float = FAILURE_RATE,
+                 loading_seconds: float = LOADING_SECONDS, default_answer: str = DEFAULT_ANSWER):
+        self.answers = answers or {}
+        self.n_slots = n_slots
+        self.prefill_tps = prefill_tps
+        self.decode_tps = decode_tps
+        self.latency_distribution = latency_distribution
+        self.latency_mean = latency_mean
+        self.latency_std = latency_std
+        self.failure_rate = failure_rate
+        self.default_answer = default_answer
+        self.ready_at = time.monotonic() + loading_seconds
+
+        self.slots = [Slot(i) for i in range(n_slots)]
+        self._slots_changed = threading.Condition()
+        self._stats_lock = threading.Lock()
+        self._attempts = {}
+        self.stats = {"requests": 0, "failed": 0, "cancelled": 0, "replayed": 0,
+                      "prompt_tokens": 0, "cached_tokens": 0, "predicted_tokens": 0}
+
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self.url = f"http://{host}:{self.httpd.server_address[1]}/completion"
+        self._thread = None
+
+    # --- Lifecycle ---
+    def start(self) -> "MockLlamaServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    # --- Simulation ---
+    def _count(self, key: str, amount: int = 1):
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    def _overhead(self, rng: random.Random) -> float:
+        if self.latency_distribution == "normal":
+            return max(0.0, rng.gauss(self.latency_mean, self.latency_std))
+        if self.latency_distribution == "lognormal" and self.latency_mean > 0:
+            variance = (self.latency_std / self.latency_mean) ** 2
+            sigma = math.sqrt(math.log1p(variance))
+            mu = math.log(self.latency_mean) - sigma ** 2 / 2
+            return rng.lognormvariate(mu, sigma)
+        return self.latency_mean
+
+    def should_fail(self, data: dict) -> bool:
+        """Seeded by the request and how often it was seen before, so retries can succeed deterministically."""
+        key = zlib.crc32(f"{data.get('seed')}\0{data.get('prompt')}".encode('utf-8'))
+        with self._stats_lock:
+            attempt = self._attempts.get(key, 0)
+            self._attempts[key] = attempt + 1
+        return random.Random(f"{key}-{attempt}").random() < self.failure_rate
+
+    def _acquire_slot(self, requested) -> Slot:
+        with self._slots_changed:
+            while True:
+                if requested is not None and 0 <= requested < self.n_slots:
+                    candidates = [self.slots[requested]]
+                else:
+                    candidates = self.slots
+                free = [slot for slot in candidates if not slot.busy]
+                if free:
+                    free[0].busy = True
+                    return free[0]
+                self._slots_changed.wait()
+
+    def _release_slot(self, slot: Slot):
+        with self._slots_changed:
+            slot.busy = False
+            self._slots_changed.notify_all()
+
+    def answer_for(self, prompt: str) -> str:
+        match = QUESTION_PATTERN.search(prompt)
+        answer = self.answers.get(match.group(1).strip()) if match else None
+        if answer is None:
+            return self.default_answer
+        self._count("replayed")
+        return answer
+
+    def generate(self, data: dict):
+        """
+        Yields (piece, fields) pairs: the answer token by token, paced at
+        decode_tps, and finally ("", stats) with the llama-server timing fields
+        and "stop": True. With 'timings_per_token', every token carries the
+        timings so far; otherwise its fields are None.
+        """
+        prompt = data.get("prompt", "")
+        rng = random.Random(zlib.crc32(f"{data.get('seed')}\0{prompt}".encode('utf-8')))
+        prompt_pieces = tokenize(prompt)
+        answer = self.answer_for(prompt)
+        for stop in data.get("stop") or []:
+            if stop and stop in answer:
+                answer = answer[:answer.index(stop)]
+        n_predict = data.get("n_predict", -1)
+        pieces = tokenize(answer)
+        if n_predict is not None and n_predict >= 0:
+            pieces = pieces[:n_predict]
+
+        slot = self._acquire_slot(data.get("id_slot"))
+        try:
+            cached = 0
+            if data.get("cache_prompt"):
+                for old, new in zip(slot.cached_tokens, prompt_pieces):
+                    if old != new:
+                        break
+                    cached += 1
+            slot.cached_tokens = prompt_pieces
+            prompt_n = len(prompt_pieces) - cached
+            prompt_seconds = self._overhead(rng) + prompt_n / self.prefill_tps
+            time.sleep(prompt_seconds)
+            self._count("prompt_tokens", len(prompt_pieces))
+            self._count("cached_tokens", cached)
+
+            decode_start = time.perf_counter()
+            for n, piece in enumerate(pieces, 1):
+                time.sleep(1.0 / self.decode_tps)
+                self._count("predicted_tokens")
+                partial = None
+                if data.get("timings_per_token"):
+                    partial = {"timings": {"cache_n": cached, "prompt_n": prompt_n, "prompt_ms": prompt_seconds * 1000,
+                                           "predicted_n": n,
+                                           "predicted_ms": (time.perf_counter() - decode_start) * 1000}}
+                yield piece, partial
+            decode_seconds = time.perf_counter() - decode_start
+        finally:
+            self._release_slot(slot)
+
+        yield "", {
+            "stop": True, "id_slot": slot.id, "tokens_predicted": len(pieces),
+            "tokens_evaluated": len(prompt_pieces), "tokens_cached": cached,
+            "timings": {"cache_n": cached, "prompt_n": prompt_n, "prompt_ms": prompt_seconds * 1000,
+                        "predicted_n": len(pieces), "predicted_ms": decode_seconds * 1000,
+                        "predicted_per_second": len(pieces) / decode_seconds if decode_seconds else 0.0},
+        }
+
+    # --- HTTP ---
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def handle_one_request(self):
+                try:
+                    super().handle_one_request()
+                except (BrokenPipeError, ConnectionResetError):
+                    # A client that cancelled a stream drops the keep-alive connection
+                    self.close_connection = True
+
+            def _send_json(self, status: int, payload: dict):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == "/props":
+                    self._send_json(200, {"model_path": "mock-llama-server", "total_slots": server.n_slots})
+                elif self.path != "/health":
+                    self._send_json(404, {"error": "not found"})
+                elif time.monotonic() < server.ready_at:
+                    self._send_json(503, {"error": {"code": 503, "message": "Loading model"}})
+                else:
+                    self._send_json(200, {"status": "ok"})
+
+            def do_POST(self):
+                try:
+                    data = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                except ValueError:
+                    self._send_json(400, {"error": "invalid JSON"})
+                    return
+                if self.path == "/tokenize":
+                    pieces = tokenize(data.get("content", ""))
+                    self._send_json(200, {"tokens": token_ids(pieces)})
+                elif self.path == "/completion":
+                    self._complete(data)
+                else:
+                    self._send_json(404, {"error": "not found"})
+
+            def _complete(self, data: dict):
+                server._count("requests")
+                if time.monotonic() < server.ready_at or server.should_fail(data):
+                    server._count("failed")
+                    self._send_json(503, {"error": {"code": 503, "message": "Service unavailable"}})
+                    return
+
+                if not data.get("stream"):
+                    content = []
+                    for piece, final in server.generate(data):
+                        content.append(piece)
+                    self._send_json(200, dict(final, content="".join(content)))
+                    return
+
+                # Chunked transfer encoding like llama-server, so clients see every event as it is sent
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                stream = server.generate(data)
+                try:
+                    for piece, final in stream:
+                        if final is not None and final.get("stop"):
+                            chunk = dict(final, content="")
+                        else:
+                            chunk = dict(final or {}, content=piece, stop=False)
+                        event = b"data: " + json.dumps(chunk).encode('utf-8') + b"\n\n"
+                        self.wfile.write(f"{len(event):x}\r\n".encode('ascii') + event + b"\r\n")
+                        self.wfile.flush()
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client closed the stream (early stop); free the slot like llama-server does
+                    stream.close()
+                    self.close_connection = True
+                    server._count("cancelled")
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def report(self) -> str:
+        s = self.stats
+        return (f"Mock server {self.url}: {s['requests']} requests ({s['failed']} failed, {s['cancelled']} "
+                f"streams cancelled, {s['replayed']} replayed answers), {s['prompt_tokens']} prompt tokens "
+                f"({s['cached_tokens']} from slot cache), {s['predicted_tokens']} generated tokens.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock llama-server replaying canned answers with simulated latency.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--replay_file", default=REPLAY_FILE_PATH)
+    parser.add_argument("--benchmark_file", default=BENCHMARK_FILE_PATH)
+    parser.add_argument("--slots", type=int, default=N_SLOTS)
+    parser.add_argument("--prefill_tps", type=float, default=PREFILL_TOKENS_PER_SECOND)
+    parser.add_argument("--decode_tps", type=float, default=DECODE_TOKENS_PER_SECOND)
+    parser.add_argument("--latency_distribution", choices=["fixed", "normal", "lognormal"],
+                        default=LATENCY_DISTRIBUTION)
+    parser.add_argument("--latency_mean", type=float, default=LATENCY_MEAN)
+    parser.add_argument("--latency_std", type=float, default=LATENCY_STD)
+    parser.add_argument("--failure_rate", type=float, default=FAILURE_RATE)
+    parser.add_argument("--loading_seconds", type=float, default=LOADING_SECONDS)
+    args = parser.parse_args()
+
+    answers = load_replay_answers(args.replay_file, args.benchmark_file)
+    server = MockLlamaServer(answers, args.host, args.port, args.slots, args.prefill_tps, args.decode_tps,
+                             args.latency_distribution, args.latency_mean, args.latency_std,
+                             args.failure_rate, args.loading_seconds)
+    print(f"Mock llama-server listening on {server.url} with {args.slots} slots "
+          f"({len(answers)} replayable answers). Press Ctrl+C to stop.")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+        print(server.report())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# prediction_store.py
+import os
+import json
+
+# Legacy runs stored failed requests as predictions; those are dropped on load so they get retried
+LEGACY_ERROR_PREFIX = "ERROR: Failed to get response from server"
+
+
+class PredictionJournal:
+    """
+    Append-only JSONL store for benchmark predictions.
+
+    Every completed prediction is appended as one {"id": ..., "sql": ...} line
+    instead of rewriting the whole prediction JSON, and the file is fsynced every
+    'fsync_every' records. At the end of a run the journal is compacted into the
+    legacy {id: sql} JSON file that EHRSQL's evaluate.py expects.
+
+    Items that get no prediction on purpose (e.g. their prompt does not fit into
+    the context) are journaled with a "skipped" reason and an empty prediction,
+    so resuming does not retry them and the evaluation scores them as wrong
+    rather than missing.
+    """
+
+    def __init__(self, prediction_path: str, journal_path: str = None, fsync_every: int = 20):
+        self.prediction_path = prediction_path
+        self.journal_path = journal_path or os.path.splitext(prediction_path)[0] + ".jsonl"
+        self.fsync_every = fsync_every
+        self._file = None
+        self._unsynced = 0
+        # Skip reasons by item id, filled by load() and append()
+        self.skipped = {}
+
+    def load(self) -> dict:
+        """
+        Rebuilds the predictions dict for resuming: starts from the compacted JSON
+        (if any) and replays the journal on top of it in one streaming pass.
+        A torn last line from a crash is ignored, and error strings stored by
+        older runs are dropped so those items are predicted again.
+        """
+        predictions_dict = {}
+        if os.path.exists(self.prediction_path):
+            try:
+                with open(self.prediction_path, "r", encoding='utf-8') as f:
+                    predictions_dict = json.load(f)
+            except (json.JSONDecodeError, FileNotFoundError):
+                print(f"Warning: Could not read existing prediction file: {self.prediction_path}")
+                predictions_dict = {}
+
+        if os.path.exists(self.journal_path):
+            skipped = 0
+            with open(self.journal_path, "r", encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                        predictions_dict[record["id"]] = record["sql"]
+                        if record.get("skipped"):
+                            self.skipped[record["id"]] = record["skipped"]
+                        else:
+                            self.skipped.pop(record["id"], None)
+                    except (json.JSONDecodeError, KeyError, TypeError):
+                        skipped += 1
+            if skipped:
+                print(f"Warning: Ignored {skipped} unreadable line(s) in journal: {self.journal_path}")
+
+        failed = [k for k, v in predictions_dict.items() if isinstance(v, str) and v.startswith(LEGACY_ERROR_PREFIX)]
+        for item_id in failed:
+            del predictions_dict[item_id]
+        if failed:
+            print(f"Dropped {len(failed)} failed request(s) from the resume state; they will be retried.")
+        if self.skipped:
+            print(f"{len(self.skipped)} item(s) were skipped by earlier runs and stay empty predictions "
+                  f"(delete their \"skipped\" lines from {self.journal_path} to retry them).")
+        return predictions_dict
+
+    def _open(self):
+        directory = os.path.dirname(self.journal_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.journal_path, "a+", encoding='utf-8')
+        # Make sure a torn last line from a previous crash doesn't swallow the next record
+        if self._file.tell() > 0:
+            self._file.seek(self._file.tell() - 1)
+            if self._file.read(1) != "\n":
+                self._file.write("\n")
+
+    def append(self, item_id: str, generated_sql: str, skipped: str = None):
+        """Appends one prediction to the journal, or with 'skipped' the reason the item has none."""
+        if self._file is None:
+            self._open()
+        record = {"id": item_id, "sql": generated_sql}
+        if skipped:
+            record["skipped"] = skipped
+            self.skipped[item_id] = skipped
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self._unsynced += 1
+        if self.fsync_every and self._unsynced >= self.fsync_every:
+            self.sync()
+
+    def sync(self):
+        """Forces all appended records to disk."""
+        if self._file is not None and self._unsynced:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+
+    def close(self):
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+    def compact(self, predictions_dict: dict):
+        """
+        Writes the legacy {id: sql} JSON file. The file is written to a temporary
+        path first and then swapped in, so a crash never leaves it half-written.
+        """
+        directory = os.path.dirname(self.prediction_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.prediction_path + ".tmp"
+        with open(tmp_path, "w", encoding='utf-8') as f:
+            json.dump(predictions_dict, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.prediction_path)
@@ -0,0 +1,132 @@
+# prompt_budget.py
+import threading
+from string import Formatter
+from urllib.parse import urlsplit
+
+import requests
+
+# Context size llama-server was started with (-c, see commands.txt)
+CONTEXT_SIZE = 4096
+# A prompt must leave room for at least this many generated tokens, otherwise it is shrunk
+MIN_NEW_TOKENS = 256
+# Sections are counted separately, so token merges at section boundaries can shift the total slightly
+SAFETY_MARGIN = 32
+# Estimate used when /tokenize cannot be reached (schema and SQL text tokenize densely)
+CHARS_PER_TOKEN = 3.0
+
+
+class TokenCounter:
+    """
+    Counts tokens with the server's own tokenizer via llama-server's /tokenize.
+    Counts of static texts (schema, tables, examples, template) are cached, so
+    each of them is tokenized once per run. If /tokenize fails, the count falls
+    back to a conservative characters-per-token estimate.
+    """
+
+    def __init__(self, server_url: str, session=None, timeout: float = 10.0):
+        parts = urlsplit(server_url)
+        self.tokenize_url = f"{parts.scheme}://{parts.netloc}/tokenize"
+        self.session = session or requests.Session()
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._counts = {}
+        self.requests = 0
+        self.estimated = 0
+
+    def _tokenize(self, text: str) -> int:
+        try:
+            response = self.session.post(self.tokenize_url, json={"content": text, "add_special": False},
+                                         timeout=self.timeout)
+            response.raise_for_status()
+            count = len(response.json()["tokens"])
+        except (requests.exceptions.RequestException, ValueError, KeyError):
+            with self._lock:
+                self.estimated += 1
+            return int(len(text) / CHARS_PER_TOKEN) + 1
+        with self._lock:
+            self.requests += 1
+        return count
+
+    def count(self, text: str, cache: bool = True) -> int:
+        if not text:
+            return 0
+        if cache:
+            with self._lock:
+                if text in self._counts:
+                    return self._counts[text]
+        count = self._tokenize(text)
+        if cache:
+            with self._lock:
+                self._counts[text] = count
+        return count
+
+
+class PromptBuilder:
+    """
+    Renders a prompt template so that prompt + generation fit into the context.
+
+    build() takes three kinds of template fields:
+      - static:   always included, token count cached (instruction parts, schema)
+      - dynamic:  always included, counted per call (the question)
+      - optional: lists of (text, relevance) items in display order. Items are
+                  admitted by descending relevance while they fit; the rest is
+                  dropped. Sections are filled in the order given, so earlier
+                  sections win when space runs out.
+    n_predict is set to whatever context is left, capped at max_new_tokens.
+    """
+
+    def __init__(self, counter: TokenCounter, template: str, context_size: int = CONTEXT_SIZE,
+                 max_new_tokens: int = 2048, min_new_tokens: int = MIN_NEW_TOKENS, margin: int = SAFETY_MARGIN):
+        self.counter = counter
+        self.template = template
+        self.context_size = context_size
+        self.max_new_tokens = max_new_tokens
+        self.min_new_tokens = min_new_tokens
+        self.margin = margin
+        fields = {name for _, name, _, _ in Formatter().parse(template) if name}
+        self.skeleton = template.format(**{name: "" for name in fields})
+        self._lock = threading.Lock()
+        self.prompts = 0
+        self.shrunk = 0
+        self.dropped_items = 0
+
+    def build(self, static: dict = None, dynamic: dict = None, optional: dict = None, joiners: dict = None) -> dict:
+        """
+        Returns {"prompt", "n_predict", "prompt_tokens", "dropped"} where 'dropped'
+        counts the optional items left out per section. Raises ValueError if the
+        static and dynamic sections alone leave less than min_new_tokens.
+        """
+        static, dynamic, optional, joiners = static or {}, dynamic or {}, optional or {}, joiners or {}
+        available = self.context_size - self.margin - self.min_new_tokens - self.counter.count(self.skeleton)
+        available -= sum(self.counter.count(text) for text in static.values())
+        available -= sum(self.counter.count(text, cache=False) for text in dynamic.values())
+        if available < 0:
+            raise ValueError(f"Prompt exceeds the {self.context_size}-token context by {-available} tokens "
+                             f"before any optional section is added")
+
+        sections, dropped = {}, {}
+        for name, items in optional.items():
+            kept = set()
+            for index in sorted(range(len(items)), key=lambda i: -items[i][1]):
+                tokens = self.counter.count(items[index][0])
+                if tokens <= available:
+                    kept.add(index)
+                    available -= tokens
+            sections[name] = joiners.get(name, "\n\n").join(
+                text for index, (text, _) in enumerate(items) if index in kept)
+            dropped[name] = len(items) - len(kept)
+
+        prompt_tokens = self.context_size - self.margin - self.min_new_tokens - available
+        n_predict = min(self.max_new_tokens, self.context_size - self.margin - prompt_tokens)
+        with self._lock:
+            self.prompts += 1
+            if any(dropped.values()):
+                self.shrunk += 1
+                self.dropped_items += sum(dropped.values())
+        return {"prompt": self.template.format(**static, **dynamic, **sections), "n_predict": n_predict,
+                "prompt_tokens": prompt_tokens, "dropped": dropped}
+
+    def report(self) -> str:
+        return (f"Token budget: {self.prompts} prompts built, {self.shrunk} shrunk to fit the "
+                f"{self.context_size}-token context ({self.dropped_items} tables/examples dropped); "
+                f"{self.counter.requests} /tokenize calls, {self.counter.estimated} estimated counts.")
@@ -0,0 +1,80 @@
+# prompt_cache.py
+import threading
+
+
+class SlotPinner:
+    """
+    Pins every worker thread to one fixed llama-server slot.
+
+    With 'cache_prompt' enabled, a slot keeps the KV cache of its last prompt.
+    As long as the same thread always talks to the same slot, the static prompt
+    prefix (instruction + schema + examples) is prefilled once per slot and only
+    the per-question suffix has to be evaluated afterwards.
+
+    LlamaCppBackend prefers the pinned slot's sequence when several idle
+    sequences share the same cached prefix with a prompt. With several servers,
+    InferenceClient(slots_per_server=...) replaces 'id_slot' with a free slot of
+    the server it dispatches to (see server_pool.ServerPool), since a slot id
+    fixed per thread would collide across servers.
+    """
+
+    def __init__(self, n_slots: int):
+        self.n_slots = max(1, int(n_slots))
+        self._lock = threading.Lock()
+        self._slots = {}
+
+    def slot_for_current_thread(self) -> int:
+        thread_id = threading.get_ident()
+        with self._lock:
+            if thread_id not in self._slots:
+                self._slots[thread_id] = len(self._slots) % self.n_slots
+            return self._slots[thread_id]
+
+    def request_fields(self) -> dict:
+        """Extra /completion fields that enable prompt caching on the pinned slot."""
+        return {"cache_prompt": True, "id_slot": self.slot_for_current_thread()}
+
+
+class CacheStats:
+    """
+    Collects cached vs. evaluated prompt token counts from llama-server responses.
+    'tokens_evaluated' is the full prompt length, 'timings.prompt_n' the number of
+    tokens that actually had to be prefilled; the difference was served from cache.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.prefilled_tokens = 0
+        # Responses without token counts, e.g. streams stopped before a server without
+        # per-token timings reported them; they are left out of the hit rate
+        self.without_timings = 0
+
+    def record(self, response_json: dict):
+        timings = response_json.get("timings") or {}
+        evaluated = response_json.get("tokens_evaluated")
+        prefilled = timings.get("prompt_n")
+        if evaluated is None or prefilled is None:
+            if not response_json.get("cached"):
+                with self._lock:
+                    self.without_timings += 1
+            return
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += evaluated
+            self.prefilled_tokens += prefilled
+
+    @property
+    def cached_tokens(self) -> int:
+        return max(0, self.prompt_tokens - self.prefilled_tokens)
+
+    def report(self) -> str:
+        left_out = (f" {self.without_timings} responses without timing information (streams stopped "
+                    f"before the server reported them) are not included." if self.without_timings else "")
+        if not self.requests:
+            return "Prompt cache: no timing information received from the server." + left_out
+        hit_rate = self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+        return (f"Prompt cache: {self.cached_tokens} of {self.prompt_tokens} prompt tokens served from cache "
+                f"({hit_rate:.1%}), {self.prefilled_tokens} tokens prefilled over {self.requests} requests."
+                + left_out)
@@ -1,29 +1,118 @@
 # rag_components.py
+import os
 import sqlite3
 import json
 import random
+import hashlib
+
+# One round trip for everything: tables and indexes from sqlite_master plus their
+# columns and foreign keys via the pragma table-valued functions.
+SCHEMA_INTROSPECTION_QUERY = """
+SELECT 'object', m.type, m.tbl_name, m.name, m.sql, NULL, NULL
+FROM sqlite_master AS m
+WHERE m.type IN ('table', 'index') AND m.name NOT LIKE 'sqlite_%'
+UNION ALL
+SELECT 'column', c.type, m.name, c.name, c.pk, c."notnull", c.cid
+FROM sqlite_master AS m JOIN pragma_table_info(m.name) AS c
+WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite_%'
+UNION ALL
+SELECT 'foreign_key', NULL, m.name, f."from", f."table", f."to", f.id
+FROM sqlite_master AS m JOIN pragma_foreign_key_list(m.name) AS f
+WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite_%'
+"""
+
+def database_fingerprint(db_path: str, content_hash: bool = False) -> str:
+    """
+    Identifies a database file version without opening it as a database.
+    By default this is the file's size and mtime; with content_hash=True the
+    whole file is additionally hashed (slow for the full mimic_iv.sqlite).
+    """
+    stat = os.stat(db_path)
+    fingerprint = f"{stat.st_size}-{stat.st_mtime_ns}"
+    if content_hash:
+        digest = hashlib.sha256()
+        with open(db_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        fingerprint += "-" + digest.hexdigest()
+    return fingerprint
+
+def introspect_schema(db_path: str) -> dict:
+    """
+    Reads tables, columns, foreign keys and indexes with a single query over a
+    read-only connection. Returns {table_name: {"sql", "columns", "foreign_keys", "indexes"}}.
+    """
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        rows = conn.execute(SCHEMA_INTROSPECTION_QUERY).fetchall()
+    finally:
+        conn.close()
+
+    tables = {}
+    indexes = []
+    details = []
+    # Rows are (kind, type, table, name, value_1, value_2, position)
+    for kind, obj_type, table_name, name, value_1, value_2, position in rows:
+        if kind == 'object' and obj_type == 'table':
+            tables[table_name] = {"sql": value_1, "columns": [], "foreign_keys": [], "indexes": []}
+        elif kind == 'object':
+            indexes.append((table_name, name, value_1))
+        else:
+            details.append((kind, table_name, position, obj_type, name, value_1, value_2))
+
+    for kind, table_name, _, col_type, name, value_1, value_2 in sorted(details, key=lambda d: d[:3]):
+        if table_name not in tables:
+            continue
+        if kind == 'column':
+            tables[table_name]["columns"].append(
+                {"name": name, "type": col_type, "pk": value_1, "not_null": bool(value_2)})
+        else:
+            tables[table_name]["foreign_keys"].append(
+                {"column": name, "ref_table": value_1, "ref_column": value_2})
+    for table_name, index_name, index_sql in indexes:
+        if table_name in tables:
+            # Automatic indexes (UNIQUE/PRIMARY KEY) have no SQL of their own
+            tables[table_name]["indexes"].append({"name": index_name, "sql": index_sql})
+    return tables
+
+def load_schema_info(db_path: str, cache_path: str = None, content_hash: bool = False) -> dict:
+    """
+    Returns introspect_schema(db_path), served from an on-disk JSON cache while
+    the database file's fingerprint is unchanged.
+    """
+    cache_path = cache_path or db_path + ".schema_cache.json"
+    fingerprint = database_fingerprint(db_path, content_hash=content_hash)
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+        if cached.get("fingerprint") == fingerprint:
+            return cached["tables"]
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        pass
+
+    tables = introspect_schema(db_path)
+    try:
+        with open(cache_path, 'w', encoding='utf-8') as f:
+            json.dump({"fingerprint": fingerprint, "tables": tables}, f)
+    except OSError as e:
+        print(f"Warning: Could not write schema cache '{cache_path}': {e}")
+    return tables
 
 def get_dynamic_schema(db_path: str) -> str:
     """
-    Connects to the SQLite database and retrieves all CREATE TABLE statements.
+    Retrieves all CREATE TABLE statements (followed by their CREATE INDEX
+    statements) from the SQLite database.
     This is more informative than a simple column list.
     """
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        tables = cursor.fetchall()
-        
+        tables = load_schema_info(db_path)
         schema_statements = []
-        for table in tables:
-            table_name = table[0]
-            cursor.execute(f"SELECT sql FROM sqlite_master WHERE type='table' AND name='{table_name}';")
-            create_statement = cursor.fetchone()[0]
-            schema_statements.append(create_statement)
-            
-        conn.close()
+        for table in tables.values():
+            schema_statements.append(table["sql"])
+            schema_statements.extend(index["sql"] for index in table["indexes"] if index["sql"])
+
         print(f"Dynamically retrieved schema for {len(tables)} tables.")
-        return "\\n\\n".join(schema_statements)
+        return "\n\n".join(schema_statements)
     except Exception as e:
         print(f"Failed to retrieve dynamic schema: {e}")
         return ""
@@ -1,26 +1,166 @@
-import sqlite3
+import os
 import re
+import json
+from functools import lru_cache
+
+TABLES_JSON_PATH = "./evaluation_data/tables.json"
+
+# A CREATE TABLE statement ends at its ';' or, in sqlite_master text (see rag_components.get_dynamic_schema),
+# which has no semicolons, right before the next CREATE statement or the end of the schema
+CREATE_TABLE_PATTERN = re.compile(r"CREATE TABLE[\s\S]+?(?:;|(?=\s*\bCREATE\s)|\Z)", re.IGNORECASE)
+TABLE_NAME_PATTERN = re.compile(r"CREATE TABLE\s+(?:IF NOT EXISTS\s+)?([^\s(]+)", re.IGNORECASE)
+COLUMN_LINE_PATTERN = re.compile(r"^\s*([A-Za-z_][A-Za-z0-9_]*)\s+[A-Za-z]", re.MULTILINE)
+CONSTRAINT_KEYWORDS = {"foreign", "primary", "unique", "constraint", "check"}
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Compound table names that questions usually spell as two words ("lab events", "icu stays")
+COMPOUND_SUFFIXES = ("events", "stays", "items")
+
+# Domain words that point at a table without naming it
+SYNONYMS = {
+    "diagnosis": "diagnoses_icd", "diagnosed": "diagnoses_icd", "diagnoses": "diagnoses_icd",
+    "procedure": "procedures_icd", "operation": "procedures_icd",
+    "lab": "labevents", "lab test": "labevents",
+    "prescribed": "prescriptions", "prescription": "prescriptions", "medication": "prescriptions",
+    "administered": "prescriptions",
+    "icu": "icustays", "icu stay": "icustays",
+    "microbiology": "microbiologyevents", "organism": "microbiologyevents", "culture": "microbiologyevents",
+    "hospital visit": "admissions", "hospital encounter": "admissions", "admission": "admissions",
+    "admitted": "admissions",
+    "input": "inputevents", "intake": "inputevents", "output": "outputevents",
+    "vital": "chartevents", "heart rate": "chartevents", "weight": "chartevents",
+    "price": "cost", "pay": "cost",
+    "ward": "transfers", "transfer": "transfers", "stayed": "transfers",
+    "mortality": "patients",
+}
+
+TABLE_MATCH_WEIGHT = 2.0
+MIN_TABLE_SCORE = 0.5
+
+
+def _normalize_tokens(text: str) -> tuple:
+    """Lowercases, splits into words and strips a plural 's' so 'prescriptions' matches 'prescription'."""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tuple(tokens)
+
+
+class SchemaIndex:
+    """
+    Parses the schema once and keeps a phrase -> table/column inverted index, so
+    pruning a question is a handful of dictionary lookups instead of re-parsing
+    every CREATE TABLE statement.
+
+    Table names, column names and their natural-language spellings from
+    tables.json (e.g. "subject id", "d icd diagnoses") are indexed. A table
+    name match scores TABLE_MATCH_WEIGHT; a column match scores 1 / (number of
+    tables having that column), so generic columns like subject_id barely count.
+    """
+
+    def __init__(self, schema_sql: str, tables_json_path: str = None):
+        self.statements = {}
+        self.table_order = []
+        self.columns = {}
+        for stmt in CREATE_TABLE_PATTERN.findall(schema_sql):
+            match = TABLE_NAME_PATTERN.search(stmt)
+            if not match:
+                continue
+            table = match.group(1)
+            self.statements[table] = stmt
+            self.table_order.append(table)
+            body = stmt[stmt.find("(") + 1:]
+            self.columns[table] = [col for col in COLUMN_LINE_PATTERN.findall(body)
+                                   if col.lower() not in CONSTRAINT_KEYWORDS]
+
+        self.index = {}
+        self.max_phrase_len = 1
+        column_tables = {}
+        for table in self.table_order:
+            for phrase in self._table_phrases(table):
+                self._add(phrase, table, TABLE_MATCH_WEIGHT)
+            for column in self.columns[table]:
+                column_tables.setdefault(column.lower(), set()).add(table)
+
+        natural_columns = self._load_natural_columns(tables_json_path)
+        for column, tables in column_tables.items():
+            weight = 1.0 / len(tables)
+            phrases = {column, column.replace("_", " ")} | natural_columns.get(column, set())
+            for phrase in phrases:
+                for table in tables:
+                    self._add(phrase, table, weight)
+
+        for phrase, table in SYNONYMS.items():
+            if table in self.statements:
+                self._add(phrase, table, TABLE_MATCH_WEIGHT)
+
+    def _table_phrases(self, table: str) -> set:
+        name = table.lower()
+        phrases = {name, name.replace("_", " ")}
+        if name.startswith("d_"):
+            phrases.add(name[2:].replace("_", " "))
+        for suffix in COMPOUND_SUFFIXES:
+            stem = name.split("_")[-1]
+            if stem.endswith(suffix) and len(stem) > len(suffix):
+                phrases.add(f"{stem[:-len(suffix)]} {suffix}")
+        return phrases
+
+    def _load_natural_columns(self, tables_json_path: str) -> dict:
+        """Maps original column names to their spellings in tables.json, e.g. 'hadm_id' -> {'hadm id'}."""
+        if not tables_json_path or not os.path.exists(tables_json_path):
+            return {}
+        with open(tables_json_path, 'r', encoding='utf-8') as f:
+            db = json.load(f)[0]
+        natural = {}
+        for (_, original), (_, name) in zip(db["column_names_original"], db["column_names"]):
+            natural.setdefault(original.lower(), set()).add(name)
+        for original, name in zip(db["table_names_original"], db["table_names"]):
+            if original in self.statements:
+                self._add(name, original, TABLE_MATCH_WEIGHT)
+        return natural
+
+    def _add(self, phrase: str, table: str, weight: float):
+        key = _normalize_tokens(phrase)
+        if not key:
+            return
+        entry = self.index.setdefault(key, {})
+        entry[table] = max(entry.get(table, 0.0), weight)
+        self.max_phrase_len = max(self.max_phrase_len, len(key))
+
+    def score_tables(self, question: str) -> dict:
+        """Returns {table: relevance score} for every table the question refers to."""
+        tokens = _normalize_tokens(question)
+        scores = {}
+        for n in range(1, self.max_phrase_len + 1):
+            for start in range(len(tokens) - n + 1):
+                for table, weight in self.index.get(tokens[start:start + n], {}).items():
+                    scores[table] = scores.get(table, 0.0) + weight
+        return scores
+
+    def relevant_tables(self, question: str, min_score: float = MIN_TABLE_SCORE) -> list:
+        """Tables scoring at least min_score, in schema order."""
+        scores = self.score_tables(question)
+        return [table for table in self.table_order if scores.get(table, 0.0) >= min_score]
+
+    def prune(self, question: str) -> str:
+        return "\n\n".join(self.statements[table] for table in self.relevant_tables(question))
+
+
+@lru_cache(maxsize=8)
+def get_schema_index(schema_sql: str, tables_json_path: str = TABLES_JSON_PATH) -> SchemaIndex:
+    """Builds the SchemaIndex for a schema text once and reuses it for every question."""
+    return SchemaIndex(schema_sql, tables_json_path)
+
 
 def extract_relevant_table_names(question: str, schema_statements: list) -> set:
     """
     Given a question and list of CREATE TABLE statements,
     returns a set of table names that appear relevant.
-    Uses simple keyword matching for now.
     """
-    # Extract table names from CREATE TABLE statements
-    table_names = []
-    for stmt in schema_statements:
-        match = re.search(r"CREATE TABLE\s+([^\s(]+)", stmt, re.IGNORECASE)
-        if match:
-            table_names.append(match.group(1))
-
-    # Lowercase question for easier matching
-    question_lower = question.lower()
-    relevant_tables = set()
-    for table in table_names:
-        if table.lower() in question_lower:
-            relevant_tables.add(table)
-    return relevant_tables
+    index = get_schema_index("\n\n".join(schema_statements))
+    return set(index.relevant_tables(question))
 
 def get_pruned_schema(schema_sql: str, question: str) -> str:
     """
@@ -28,17 +168,10 @@ def get_pruned_schema(schema_sql: str, question: str) -> str:
     that are relevant to the user's question.
     """
     try:
-        # Split schema_sql into CREATE TABLE statements
-        schema_statements = re.findall(r"CREATE TABLE[\s\S]+?;", schema_sql, re.IGNORECASE)
-        # Prune schema based on relevance
-        relevant_tables = extract_relevant_table_names(question, schema_statements)
-        pruned_statements = []
-        for stmt in schema_statements:
-            for table in relevant_tables:
-                if f"CREATE TABLE {table}" in stmt or f"CREATE TABLE IF NOT EXISTS {table}" in stmt:
-                    pruned_statements.append(stmt)
-        print(f"Pruned schema contains {len(pruned_statements)} tables for question: {question}")
-        return "\n\n".join(pruned_statements)
+        index = get_schema_index(schema_sql)
+        relevant_tables = index.relevant_tables(question)
+        print(f"Pruned schema contains {len(relevant_tables)} tables for question: {question}")
+        return "\n\n".join(index.statements[table] for table in relevant_tables)
     except Exception as e:
         print(f"Failed to retrieve pruned schema: {e}")
-        return ""
\ No newline at end of file
+        return ""
@@ -0,0 +1,88 @@
+# result_cache.py
+import re
+import sqlite3
+import hashlib
+
+from rag_components import database_fingerprint
+
+STRING_LITERAL_PATTERN = re.compile(r"('(?:[^']|'')*')")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+# Timeouts depend on the configured limit and machine load, so they are never cached
+CACHEABLE_STATUSES = ("ok", "error", "too_many_rows")
+# Part of every key; bump when execute_query's digest changes so old summaries are not reused
+DIGEST_VERSION = 2
+
+
+def normalize_sql(sql: str) -> str:
+    """Collapses whitespace outside string literals and drops trailing semicolons."""
+    parts = STRING_LITERAL_PATTERN.split(sql.strip().rstrip(";").strip())
+    for i in range(0, len(parts), 2):
+        parts[i] = WHITESPACE_PATTERN.sub(" ", parts[i])
+    return "".join(parts).strip()
+
+
+class ResultCache:
+    """
+    Content-addressed store of query result summaries (status, row count and the
+    digest of the sorted row hashes from evaluate_execution.execute_query).
+
+    Entries are keyed by sha256(database content hash + normalized SQL), so gold
+    results are computed once per database and reused for every model's
+    predictions, and predicted SQL that repeats across runs is never re-executed.
+    The database content hash itself is remembered per file size/mtime.
+    The connection may be shared between threads if the caller serializes access.
+    """
+
+    def __init__(self, cache_path: str, db_path: str):
+        self.conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                row_count INTEGER,
+                digest TEXT,
+                error TEXT
+            );
+            CREATE TABLE IF NOT EXISTS databases (
+                fingerprint TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL
+            );
+        """)
+        self.db_hash = self._database_hash(db_path)
+
+    def _database_hash(self, db_path: str) -> str:
+        fingerprint = database_fingerprint(db_path)
+        row = self.conn.execute("SELECT content_hash FROM databases WHERE fingerprint = ?", (fingerprint,)).fetchone()
+        if row:
+            return row[0]
+        content_hash = database_fingerprint(db_path, content_hash=True).rsplit("-", 1)[-1]
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO databases VALUES (?, ?)", (fingerprint, content_hash))
+        return content_hash
+
+    def key(self, normalized_sql: str) -> str:
+        return hashlib.sha256(f"{DIGEST_VERSION}\0{self.db_hash}\0{normalized_sql}".encode('utf-8')).hexdigest()
+
+    def get_many(self, normalized_sqls: list) -> dict:
+        """Returns {normalized_sql: summary} for every query that is already cached."""
+        keys = {self.key(sql): sql for sql in normalized_sqls}
+        found = {}
+        key_list = list(keys)
+        for start in range(0, len(key_list), 500):
+            chunk = key_list[start:start + 500]
+            rows = self.conn.execute(
+                f"SELECT key, status, row_count, digest, error FROM results WHERE key IN ({','.join('?' * len(chunk))})",
+                chunk)
+            for key, status, row_count, digest, error in rows:
+                found[keys[key]] = {"status": status, "row_count": row_count, "digest": digest, "error": error}
+        return found
+
+    def put_many(self, summaries: dict):
+        """Stores {normalized_sql: summary}; timeouts are skipped."""
+        rows = [(self.key(sql), s["status"], s["row_count"], s["digest"], s["error"])
+                for sql, s in summaries.items() if s["status"] in CACHEABLE_STATUSES]
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)", rows)
+
+    def close(self):
+        self.conn.close()
@@ -1,16 +1,18 @@
-import os
-import json
-import requests 
-
 import sys
+from benchmark_pipeline import BenchmarkPipeline, load_benchmark
 sys.stdout.reconfigure(encoding='utf-8')
 
 # --- Configuration ---
-SERVER_URL = "http://localhost:8081/completion"
+# Server, slot, caching, token budget, backend and grammar settings are shared by all runners
+# and live in benchmark_pipeline.py
 SCHEMA_PATH = "./evaluation_data/mimic_iv.sql"
 BENCHMARK_FILE_PATH = "./evaluation_data/annotated.json"
 PREDICTION_FILE_PATH = "./input/res/prediction.json"
-MAX_TOKENS = 2048
+# Used with DEDUP_MODE (see benchmark_pipeline.py)
+COMPLETION_CACHE_PATH = "./input/res/completion_cache_base.sqlite"
+# Per-stage timings and the server's per-request 'timings' are appended here as JSON lines
+# (summarize several runs side by side with: python text-to-sql/instrumentation.py TRACE.jsonl ...)
+TRACE_FILE_PATH = "./input/res/trace.jsonl"
 
 PROMPT_TEMPLATE = """### Instruction:
 You are a SQL expert. Given a database schema and a question, your job is to write a syntactically correct SQL query.
@@ -24,87 +26,41 @@ You are a SQL expert. Given a database schema and a question, your job is to wri
 ### SQL:
 """
 
-def run_inference_server(question: str, schema: str) -> str:
-    """Sends a request to the running llama.cpp server."""
-    full_prompt = PROMPT_TEMPLATE.format(schema=schema, question=question)
-    
-    headers = {"Content-Type": "application/json"}
-    data = {
-        "prompt": full_prompt,
-        "n_predict": MAX_TOKENS,
-        "stop": ["###"]
-    }
-    
-    try:
-        response = requests.post(SERVER_URL, headers=headers, json=data)
-        response.raise_for_status() # Raise an exception for bad status codes
-        # The generated text is in the 'content' key of the JSON response
-        generated_sql = response.json()['content']
-        return generated_sql.strip()
-    except requests.exceptions.RequestException as e:
-        print(f"Error communicating with server: {e}")
-        return f"ERROR: Failed to get response from server for question: {question}"
+def make_pipeline(**settings) -> BenchmarkPipeline:
+    """The shared pipeline with this runner's prompt and files; keyword arguments override its settings."""
+    return BenchmarkPipeline(**{"prompt_template": PROMPT_TEMPLATE, "prediction_path": PREDICTION_FILE_PATH,
+                                "trace_path": TRACE_FILE_PATH, "completion_cache_path": COMPLETION_CACHE_PATH,
+                                "grammar_schema_path": SCHEMA_PATH, **settings})
 
-def main():
-    """Main function to run the benchmark using the server."""
+pipeline = make_pipeline()
+
+def load_context(benchmark_data):
+    """Reads the schema once for all questions. Returns None if it is missing."""
     try:
-        with open(SCHEMA_PATH, "r", encoding='utf-8') as f:
-            schema_sql = f.read()
+        with pipeline.tracer.span("schema"), open(SCHEMA_PATH, "r", encoding='utf-8') as f:
+            return f.read()
     except FileNotFoundError:
         print(f"Error: Schema file not found at '{SCHEMA_PATH}'")
-        return
+        return None
 
-    try:
-        with open(BENCHMARK_FILE_PATH, "r", encoding='utf-8') as f:
-            benchmark_data = json.load(f)
-    except FileNotFoundError:
-        print(f"Error: Benchmark file not found at '{BENCHMARK_FILE_PATH}'")
-        return
+def build_prompt(item, schema: str):
+    """Returns (prompt, n_predict); raises ValueError if the question does not fit into the context."""
+    if pipeline.token_budget_mode:
+        built = pipeline.prompt_builder.build(static={"schema": schema}, dynamic={"question": item["question"]})
+        return built["prompt"], built["n_predict"]
+    return PROMPT_TEMPLATE.format(schema=schema, question=item["question"]), pipeline.max_tokens
 
-    predictions_dict = {}
-    # Check if a prediction file already exists to resume
-    if os.path.exists(PREDICTION_FILE_PATH):
-        print(f"Resuming from existing prediction file: {PREDICTION_FILE_PATH}")
-        try:
-            with open(PREDICTION_FILE_PATH, "r", encoding='utf-8') as f:
-                predictions_dict = json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError):
-            print("Warning: Could not read existing prediction file. Starting from scratch.")
-            predictions_dict = {}
+def main():
+    """Main function to run the benchmark using the server."""
+    benchmark_data = load_benchmark(BENCHMARK_FILE_PATH)
+    if benchmark_data is None:
+        return
+    schema_sql = load_context(benchmark_data)
+    if schema_sql is None:
+        return
 
-    print("Starting benchmark...")
-    
-    processed_count = 0
     # Optional: Slice for testing, e.g., benchmark_data[:5]
-    for i, item in enumerate(benchmark_data):
-        question = item.get("question")
-        item_id = item.get("id")
-
-        if not question or not item_id:
-            print(f"Skipping item {i+1} due to missing data.")
-            continue
-
-        # Skip if already processed
-        if item_id in predictions_dict:
-            continue
-
-        # Use the new server-based inference function
-        generated_sql = run_inference_server(question, schema_sql)
-        predictions_dict[item_id] = generated_sql
-        
-        processed_count += 1
-        print(f"--- Processed {processed_count} (Total: {i+1}/{len(benchmark_data)}) (ID: {item_id}) ---")
-        print(f"Question: {question}")
-        # Encode to UTF-8 and decode back, replacing characters that can't be handled by the console
-        printable_sql = generated_sql.encode('utf-8', 'replace').decode('utf-8')
-        print(f"Generated SQL: {printable_sql}\n")
-
-        # Save progress incrementally after each prediction
-        os.makedirs(os.path.dirname(PREDICTION_FILE_PATH), exist_ok=True)
-        with open(PREDICTION_FILE_PATH, "w", encoding='utf-8') as f:
-            json.dump(predictions_dict, f, indent=2)
-
-    print(f"Benchmark finished. Predictions saved to {PREDICTION_FILE_PATH}")
+    pipeline.run(benchmark_data, build_prompt, schema_sql, "Starting benchmark...")
 
 if __name__ == "__main__":
     main()
@@ -1,25 +1,36 @@
 # run_benchmark_rag.py
-import os
-import json
-import requests 
 import sys
-from rag_components import get_dynamic_schema, get_few_shot_examples
+from rag_components import get_dynamic_schema, get_few_shot_examples, load_schema_info
+from rag_components_with_schema_pruning import get_schema_index
+from few_shot_index import FewShotIndex, format_examples
+from benchmark_pipeline import BenchmarkPipeline, load_benchmark
 
 sys.stdout.reconfigure(encoding='utf-8')
 
 # --- Configuration ---
-SERVER_URL = "http://localhost:8081/completion"
+# Server, slot, caching, token budget, backend and grammar settings are shared by all runners
+# and live in benchmark_pipeline.py
 # --- RAG Configuration ---
 # Point to the actual database file for dynamic schema retrieval
 DB_PATH = "./evaluation_data/mimic_iv.sqlite"
 # Point to the new few-shot examples file
 FEW_SHOT_EXAMPLES_PATH = "./evaluation_data/few_shot_examples.json"
+# "random": the same FEW_SHOT_K random examples from FEW_SHOT_EXAMPLES_PATH for every question
+# "similar": the FEW_SHOT_K most similar examples per question from a BM25 index over FEW_SHOT_POOL_PATH.
+#            Needs a question/query pool in EHRSQL's annotated.json format, e.g. the EHRSQL MIMIC-IV
+#            train split copied to ./train_data/annotated.json (not part of this repository)
+FEW_SHOT_MODE = "random"
+FEW_SHOT_K = 3
+FEW_SHOT_POOL_PATH = "./train_data/annotated.json"
+FEW_SHOT_INDEX_PATH = "./train_data/few_shot_index.npz"
 
 BENCHMARK_FILE_PATH = "./evaluation_data/annotated.json"
 PREDICTION_FILE_PATH = "./input/res/prediction_rag.json" # Use a new prediction file
-MAX_TOKENS = 2048
+# Used with DEDUP_MODE (see benchmark_pipeline.py)
+COMPLETION_CACHE_PATH = "./input/res/completion_cache_rag.sqlite"
+# Per-stage timings and the server's per-request 'timings' are appended here as JSON lines
+TRACE_FILE_PATH = "./input/res/trace_rag.jsonl"
 
-# --- Enhanced RAG Prompt Template ---
 PROMPT_TEMPLATE = """### Instruction:
 You are a SQL expert. Given a database schema and a question, your job is to write a syntactically correct SQL query.
 
@@ -36,82 +47,91 @@ You are a SQL expert. Given a database schema and a question, your job is to wri
 ### SQL:
 """
 
-def run_inference_with_rag(question: str, schema: str, examples: str) -> str:
-    """Sends a request to the llama.cpp server with a full RAG prompt."""
-    full_prompt = PROMPT_TEMPLATE.format(schema=schema, examples=examples, question=question)
-    
-    headers = {"Content-Type": "application/json"}
-    data = {
-        "prompt": full_prompt,
-        "n_predict": MAX_TOKENS,
-        "stop": ["###"] 
-    }
-    
-    try:
-        response = requests.post(SERVER_URL, headers=headers, json=data)
-        response.raise_for_status()
-        generated_sql = response.json()['content']
-        return generated_sql.strip()
-    except requests.exceptions.RequestException as e:
-        print(f"Error communicating with server: {e}")
-        return f"ERROR: Failed to get response from server for question: {question}"
-
-def main():
-    """Main function to run the benchmark using the RAG system."""
-    
-    # --- RAG Pre-computation ---
-    # Retrieve the dynamic schema and few-shot examples once at the start
+def make_pipeline(**settings) -> BenchmarkPipeline:
+    """The shared pipeline with this runner's prompt and files; keyword arguments override its settings."""
+    return BenchmarkPipeline(**{"prompt_template": PROMPT_TEMPLATE, "prediction_path": PREDICTION_FILE_PATH,
+                                "trace_path": TRACE_FILE_PATH, "completion_cache_path": COMPLETION_CACHE_PATH,
+                                "grammar_schema_path": DB_PATH, "db_path": DB_PATH, **settings})
+
+pipeline = make_pipeline()
+
+def build_budgeted_prompt(question: str, schema: str, schema_tables: dict, examples):
+    """
+    Builds the RAG prompt within CONTEXT_SIZE. Tables (with their indexes) are kept in
+    order of their relevance to the question, examples in retrieval order; whatever
+    does not fit is dropped, tables last. Returns (prompt, n_predict).
+    """
+    scores = get_schema_index(schema).score_tables(question)
+    tables = [(text, scores.get(name, 0.0)) for name, text in schema_tables.items()]
+    if isinstance(examples, str):
+        example_items = [(examples, 0.0)]
+    else:
+        example_items = [(format_examples([example]), -rank) for rank, example in enumerate(examples)]
+    built = pipeline.prompt_builder.build(dynamic={"question": question},
+                                          optional={"schema": tables, "examples": example_items},
+                                          joiners={"examples": ""})
+    return built["prompt"], built["n_predict"]
+
+def build_prompt(item, context: dict):
+    """
+    Returns (prompt, n_predict) with the question's few-shot examples ('examples'
+    is the formatted examples text or a ranked list of examples); raises
+    ValueError if the question does not fit into the context.
+    """
+    question = item["question"]
+    examples = context["examples_by_id"].get(item["id"], context["few_shot_examples"])
+    if pipeline.token_budget_mode:
+        return build_budgeted_prompt(question, context["schema"], context["schema_tables"], examples)
+    if not isinstance(examples, str):
+        examples = format_examples(examples)
+    full_prompt = PROMPT_TEMPLATE.format(schema=context["schema"], examples=examples, question=question)
+    return full_prompt, pipeline.max_tokens
+
+def load_context(benchmark_data):
+    """
+    RAG pre-computation: retrieves the dynamic schema and the few-shot examples
+    once at the start. Returns None if the schema cannot be built.
+    """
     print("Initializing RAG components...")
-    schema_context = get_dynamic_schema(DB_PATH)
-    few_shot_examples = get_few_shot_examples(FEW_SHOT_EXAMPLES_PATH)
+    with pipeline.tracer.span("schema"):
+        schema_context = get_dynamic_schema(DB_PATH)
+    few_shot_examples = get_few_shot_examples(FEW_SHOT_EXAMPLES_PATH, k=FEW_SHOT_K)
     if not schema_context:
         print("Could not build schema context. Aborting benchmark.")
-        return
+        return None
+    # Per-table schema text (CREATE TABLE + its CREATE INDEX statements) for the token budget;
+    # joined in this order it is identical to schema_context
+    with pipeline.tracer.span("schema"):
+        schema_tables = {name: "\n\n".join([table["sql"]] + [index["sql"] for index in table["indexes"] if index["sql"]])
+                         for name, table in load_schema_info(DB_PATH).items()}
+
+    # Retrieve per-question examples for the whole benchmark in one batch
+    examples_by_id = {}
+    if FEW_SHOT_MODE == "similar":
+        try:
+            with pipeline.tracer.span("few_shot"):
+                index = FewShotIndex.load_or_build(FEW_SHOT_POOL_PATH, FEW_SHOT_INDEX_PATH)
+                items = [item for item in benchmark_data if item.get("question") and item.get("id")]
+                selected = index.batch_top_k([item["question"] for item in items], FEW_SHOT_K,
+                                             exclude_items=items)
+            examples_by_id = {item["id"]: examples for item, examples in zip(items, selected)}
+            print(f"✅ Retrieved similar few-shot examples for {len(examples_by_id)} questions.")
+        except (OSError, ValueError, KeyError) as e:
+            print(f"❌ ERROR: Could not build few-shot index from '{FEW_SHOT_POOL_PATH}': {e}")
+            print("Falling back to random few-shot examples.")
+    return {"schema": schema_context, "schema_tables": schema_tables,
+            "few_shot_examples": few_shot_examples, "examples_by_id": examples_by_id}
 
-    try:
-        with open(BENCHMARK_FILE_PATH, "r", encoding='utf-8') as f:
-            benchmark_data = json.load(f)
-    except FileNotFoundError:
-        print(f"Error: Benchmark file not found at '{BENCHMARK_FILE_PATH}'")
+def main():
+    """Main function to run the benchmark using the RAG system."""
+    benchmark_data = load_benchmark(BENCHMARK_FILE_PATH)
+    if benchmark_data is None:
+        return
+    context = load_context(benchmark_data)
+    if context is None:
         return
 
-    predictions_dict = {}
-    if os.path.exists(PREDICTION_FILE_PATH):
-        print(f"Resuming from existing prediction file: {PREDICTION_FILE_PATH}")
-        try:
-            with open(PREDICTION_FILE_PATH, "r", encoding='utf-8') as f:
-                predictions_dict = json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError):
-            predictions_dict = {}
-
-    print("\nStarting RAG benchmark...")
-    
-    processed_count = 0
-    for i, item in enumerate(benchmark_data):
-        question = item.get("question")
-        item_id = item.get("id")
-
-        if not question or not item_id:
-            continue
-        if item_id in predictions_dict:
-            continue
-
-        # Use the RAG-enhanced inference function
-        generated_sql = run_inference_with_rag(question, schema_context, few_shot_examples)
-        predictions_dict[item_id] = generated_sql
-        
-        processed_count += 1
-        print(f"--- Processed {processed_count} (Total: {i+1}/{len(benchmark_data)}) (ID: {item_id}) ---")
-        print(f"Question: {question}")
-        printable_sql = generated_sql.encode('utf-8', 'replace').decode('utf-8')
-        print(f"Generated SQL: {printable_sql}\n")
-
-        os.makedirs(os.path.dirname(PREDICTION_FILE_PATH), exist_ok=True)
-        with open(PREDICTION_FILE_PATH, "w", encoding='utf-8') as f:
-            json.dump(predictions_dict, f, indent=2)
-
-    print(f"Benchmark finished. Predictions saved to {PREDICTION_FILE_PATH}")
+    pipeline.run(benchmark_data, build_prompt, context, "\nStarting RAG benchmark...")
 
 if __name__ == "__main__":
     main()
-
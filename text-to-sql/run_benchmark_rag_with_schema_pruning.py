@@ -1,16 +1,20 @@
 # run_benchmark_rag_with_schema_pruning.py
-import os
-import json
-import requests
 import sys
 sys.stdout.reconfigure(encoding='utf-8')
-from rag_components_with_schema_pruning import get_pruned_schema
+from rag_components_with_schema_pruning import get_pruned_schema, get_schema_index
+from benchmark_pipeline import BenchmarkPipeline, load_benchmark
 
+# Server, slot, caching, token budget, backend and grammar settings are shared by all runners
+# and live in benchmark_pipeline.py. With TOKEN_BUDGET_MODE this runner uses the
+# CACHED_PROMPT_TEMPLATE layout; tables already listed as important are the first to go
+# from the full schema, so the schema is not sent twice when space is short.
 SCHEMA_PATH = "./evaluation_data/mimic_iv.sql"
 BENCHMARK_FILE_PATH = "./evaluation_data/annotated.json"
 PREDICTION_FILE_PATH = "./input/res/prediction_rag.json"
-SERVER_URL = "http://localhost:8081/completion"
-MAX_TOKENS = 2048
+# Used with DEDUP_MODE (see benchmark_pipeline.py)
+COMPLETION_CACHE_PATH = "./input/res/completion_cache_rag_pruning.sqlite"
+# Per-stage timings and the server's per-request 'timings' are appended here as JSON lines
+TRACE_FILE_PATH = "./input/res/trace_rag_pruning.jsonl"
 
 PROMPT_TEMPLATE = """### Instruction:
 You are a SQL expert. Given a database schema and a question, your job is to write a syntactically correct SQL query.
@@ -25,86 +29,99 @@ You are a SQL expert. Given a database schema and a question, your job is to wri
 ### SQL:
 """
 
-def run_inference_with_rag(full_prompt: str) -> str:
-    """Sends a request to the llama.cpp server with a full RAG prompt."""
-    headers = {"Content-Type": "application/json"}
-    data = {
-        "prompt": full_prompt,
-        "n_predict": MAX_TOKENS,
-        "stop": ["###"]
-    }
-    try:
-        response = requests.post(SERVER_URL, headers=headers, json=data)
-        response.raise_for_status()
-        generated_sql = response.json()['content']
-        return generated_sql.strip()
-    except requests.exceptions.RequestException as e:
-        print(f"Error communicating with server: {e}")
-        return f"ERROR: Failed to get response from server for question."
+# Used in PREFIX_CACHE_MODE: the full schema comes first so instruction + schema form a
+# byte-identical prefix for every question, and the pruned tables move behind it.
+CACHED_PROMPT_TEMPLATE = """### Instruction:
+You are a SQL expert. Given a database schema and a question, your job is to write a syntactically correct SQL query.
 
-def main():
-    """Main function to run the benchmark using the RAG system with schema highlighting (zero-shot)."""
-    try:
-        with open(SCHEMA_PATH, "r", encoding='utf-8') as f:
-            full_schema = f.read()
-    except FileNotFoundError:
-        print(f"Error: Schema file not found at '{SCHEMA_PATH}'")
-        exit(1)
-    try:
-        with open(BENCHMARK_FILE_PATH, "r", encoding='utf-8') as f:
-            benchmark_data = json.load(f)
-    except FileNotFoundError:
-        print(f"Error: Benchmark file not found at '{BENCHMARK_FILE_PATH}'")
-        exit(1)
+### Database Schema:
+{full_schema}
+
+### Important Tables:
+{important_tables}
 
-    predictions_dict = {}
-    if os.path.exists(PREDICTION_FILE_PATH):
-        print(f"Resuming from existing prediction file: {PREDICTION_FILE_PATH}")
-        try:
-            with open(PREDICTION_FILE_PATH, "r", encoding='utf-8') as f:
-                predictions_dict = json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError):
-            predictions_dict = {}
-
-    print("\nStarting RAG benchmark with schema highlighting (zero-shot)...")
-
-    processed_count = 0
-    for i, item in enumerate(benchmark_data):
-        question = item.get("question")
-        item_id = item.get("id")
-        pruned_schema = get_pruned_schema(full_schema, question)
-
-        # Mark pruned schema as important if found
-        if pruned_schema:
-            important_tables = "-- IMPORTANT TABLES:\n" + pruned_schema + "\n\n-- FULL SCHEMA:"
-        else:
-            important_tables = "-- FULL SCHEMA:"
-
-        if not question or not item_id:
-            continue
-        if item_id in predictions_dict:
-            continue
-
-        full_prompt = PROMPT_TEMPLATE.format(
-            important_tables=important_tables,
+### Question:
+{question}
+
+### SQL:
+"""
+
+def make_pipeline(**settings) -> BenchmarkPipeline:
+    """The shared pipeline with this runner's prompt and files; keyword arguments override its settings."""
+    return BenchmarkPipeline(**{"prompt_template": CACHED_PROMPT_TEMPLATE, "prediction_path": PREDICTION_FILE_PATH,
+                                "trace_path": TRACE_FILE_PATH, "completion_cache_path": COMPLETION_CACHE_PATH,
+                                "grammar_schema_path": SCHEMA_PATH, **settings})
+
+pipeline = make_pipeline()
+
+def build_budgeted_prompt(full_schema: str, question: str):
+    """
+    Builds the prompt within CONTEXT_SIZE. The important tables are admitted first,
+    then the full schema by relevance, with tables that are already listed as
+    important ranked last. Returns (prompt, n_predict).
+    """
+    index = get_schema_index(full_schema)
+    scores = index.score_tables(question)
+    important = index.relevant_tables(question)
+    dynamic = {"question": question}
+    optional = {"important_tables": [(index.statements[table], scores[table]) for table in important],
+                "full_schema": [(index.statements[table], -1.0 if table in important else scores.get(table, 0.0))
+                                for table in index.table_order]}
+    if not important:
+        dynamic["important_tables"] = "-- No specific tables matched, use the full schema."
+        del optional["important_tables"]
+    built = pipeline.prompt_builder.build(dynamic=dynamic, optional=optional)
+    return built["prompt"], built["n_predict"]
+
+def build_prompt(item, full_schema: str):
+    """Returns (prompt, n_predict); raises ValueError if the question does not fit into the context."""
+    question = item["question"]
+    if pipeline.token_budget_mode:
+        return build_budgeted_prompt(full_schema, question)
+
+    pruned_schema = get_pruned_schema(full_schema, question)
+
+    if pipeline.prefix_cache_mode:
+        full_prompt = CACHED_PROMPT_TEMPLATE.format(
             full_schema=full_schema,
+            important_tables=pruned_schema or "-- No specific tables matched, use the full schema.",
             question=question
         )
+        return full_prompt, pipeline.max_tokens
+
+    # Mark pruned schema as important if found
+    if pruned_schema:
+        important_tables = "-- IMPORTANT TABLES:\n" + pruned_schema + "\n\n-- FULL SCHEMA:"
+    else:
+        important_tables = "-- FULL SCHEMA:"
+
+    full_prompt = PROMPT_TEMPLATE.format(
+        important_tables=important_tables,
+        full_schema=full_schema,
+        question=question
+    )
+    return full_prompt, pipeline.max_tokens
+
+def load_context(benchmark_data):
+    """Reads the full schema once for all questions. Returns None if it is missing."""
+    try:
+        with pipeline.tracer.span("schema"), open(SCHEMA_PATH, "r", encoding='utf-8') as f:
+            return f.read()
+    except FileNotFoundError:
+        print(f"Error: Schema file not found at '{SCHEMA_PATH}'")
+        return None
 
-        generated_sql = run_inference_with_rag(full_prompt)
-        predictions_dict[item_id] = generated_sql
-
-        processed_count += 1
-        print(f"--- Processed {processed_count} (Total: {i+1}/{len(benchmark_data)}) (ID: {item_id}) ---")
-        printable_sql = generated_sql.encode('utf-8', 'replace').decode('utf-8')
-        print(f"Generated SQL: {printable_sql}\n")
-
-        os.makedirs(os.path.dirname(PREDICTION_FILE_PATH), exist_ok=True)
-        with open(PREDICTION_FILE_PATH, "w", encoding='utf-8') as f:
-            json.dump(predictions_dict, f, indent=2)
+def main():
+    """Main function to run the benchmark using the RAG system with schema highlighting (zero-shot)."""
+    benchmark_data = load_benchmark(BENCHMARK_FILE_PATH)
+    if benchmark_data is None:
+        exit(1)
+    full_schema = load_context(benchmark_data)
+    if full_schema is None:
+        exit(1)
 
-    print(f"Benchmark finished. Predictions saved to {PREDICTION_FILE_PATH}")
+    pipeline.run(benchmark_data, build_prompt, full_schema,
+                 "\nStarting RAG benchmark with schema highlighting (zero-shot)...")
 
 if __name__ == "__main__":
     main()
-
@@ -2,10 +2,14 @@
 import torch
 from datasets import load_dataset
 from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig, TrainingArguments
+from transformers.utils import is_flash_attn_2_available
 from peft import LoraConfig, get_peft_model, prepare_model_for_kbit_training
 from trl import SFTTrainer
 import os
 
+from build_finetune_dataset import load_packed_dataset
+from finetune_pipeline import FlatteningCollator, ThroughputCallback
+
 # --- Configuration ---
 # The base model from Hugging Face (NOT the GGUF version)
 BASE_MODEL_NAME = "seeklhy/codes-7b" 
@@ -13,6 +17,13 @@ BASE_MODEL_NAME = "seeklhy/codes-7b"
 TRAIN_DATA_PATH = "./train_data/finetune_data.jsonl"
 # Directory where the fine-tuned LoRA adapter will be saved
 OUTPUT_DIR = "./models/lora-adapter-seeklhy-codes-7b"
+# "text":   the JSONL above, tokenized and collated by SFTTrainer as before
+# "packed": opt-in; the pre-tokenized dataset from build_finetune_dataset.py, several examples
+#           packed per MAX_SEQ_LENGTH row without padding (needs flash-attn to keep examples
+#           apart); logs tokens/s
+DATA_PIPELINE = "text"
+TOKENIZED_DATASET_DIR = "./train_data/finetune_tokenized"
+MAX_SEQ_LENGTH = 4096
 
 def main():
     """
@@ -21,9 +32,19 @@ def main():
     print(" Starting Python-based fine-tuning process...")
 
     # --- 1. Load the Dataset ---
-    print(f" Loading training data from: {TRAIN_DATA_PATH}")
-    dataset = load_dataset("json", data_files=TRAIN_DATA_PATH, split="train")
-    print(f" Dataset loaded with {len(dataset)} examples.")
+    pipeline = DATA_PIPELINE
+    if pipeline == "packed" and not is_flash_attn_2_available():
+        # Without flash attention, packed examples would attend to each other
+        print(" flash-attn is not available, falling back to the 'text' pipeline.")
+        pipeline = "text"
+
+    if pipeline == "packed":
+        print(f" Loading pre-tokenized training data from: {TOKENIZED_DATASET_DIR}")
+        dataset = load_packed_dataset(TOKENIZED_DATASET_DIR, MAX_SEQ_LENGTH)
+    else:
+        print(f" Loading training data from: {TRAIN_DATA_PATH}")
+        dataset = load_dataset("json", data_files=TRAIN_DATA_PATH, split="train")
+    print(f" Dataset loaded with {len(dataset)} rows.")
 
     # --- 2. Configure Quantization (QLoRA) ---
     # This reduces VRAM usage significantly
@@ -41,7 +62,8 @@ def main():
         BASE_MODEL_NAME,
         quantization_config=bnb_config,
         device_map="auto", # Automatically use the GPU
-        trust_remote_code=True
+        trust_remote_code=True,
+        attn_implementation="flash_attention_2" if pipeline == "packed" else None,
     )
     
     tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL_NAME, trust_remote_code=True)
@@ -73,15 +95,25 @@ def main():
         logging_steps=10,
         save_strategy="epoch",
         fp16=True, # Use mixed precision
-        push_to_hub=False
+        push_to_hub=False,
+        # Packed rows carry position_ids, which the Trainer must not drop
+        remove_unused_columns=pipeline == "text",
     )
 
+    # The "text" pipeline keeps SFTTrainer's own dataset preparation and collator
+    trainer_kwargs = {}
+    if pipeline == "packed":
+        collator = FlatteningCollator()
+        trainer_kwargs = {"data_collator": collator, "dataset_kwargs": {"skip_prepare_dataset": True},
+                          "callbacks": [ThroughputCallback(collator)]}
+
     # --- 6. Initialize the Trainer ---
     trainer = SFTTrainer(
         model=model,
         train_dataset=dataset,
         peft_config=lora_config,
         args=training_args,
+        **trainer_kwargs,
     )
     print(" Trainer initialized. Starting fine-tuning...")
     
@@ -0,0 +1,110 @@
+# self_consistency.py
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from clean_predictions import clean_prediction
+from evaluate_execution import connect_read_only, execute_query, is_null_query, QUERY_TIMEOUT_SECONDS
+from result_cache import normalize_sql
+
+
+def sample_candidates(client, data: dict, n_samples: int, temperature: float, base_seed: int = 0) -> list:
+    """
+    Requests n_samples completions for one prompt, each with its own fixed seed, and
+    returns the client results (see InferenceClient.complete). The requests run one
+    after another from the calling thread, so with a pinned slot every sample after
+    the first reuses the whole prompt from the KV cache and only pays for generation.
+    """
+    return [client.complete(dict(data, temperature=temperature, seed=base_seed + i)) for i in range(n_samples)]
+
+
+class ExecutionVoter:
+    """
+    Picks one of several candidate completions by executing their SQL against the
+    read-only database and taking the result set most candidates agree on.
+
+    Queries are normalized (result_cache.normalize_sql) and every distinct query
+    is executed only once per run; with a ResultCache also once across runs. The
+    executions run in a thread pool sharing a fixed set of read-only connections,
+    each query limited by 'timeout' seconds.
+    """
+
+    def __init__(self, db_path: str, workers: int = 4, timeout: float = QUERY_TIMEOUT_SECONDS, cache=None):
+        self.timeout = timeout
+        self.cache = cache
+        self._connections = queue.Queue()
+        for _ in range(workers):
+            self._connections.put(connect_read_only(db_path))
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._lock = threading.Lock()
+        self._summaries = {}
+        self.executed = 0
+        self.reused = 0
+        self.votes = 0
+        self.agreements = 0
+
+    def _execute(self, normalized: str, sql: str) -> dict:
+        conn = self._connections.get()
+        try:
+            summary = execute_query(conn, sql, self.timeout)
+        finally:
+            self._connections.put(conn)
+        if self.cache is not None:
+            with self._lock:
+                self.cache.put_many({normalized: summary})
+        return summary
+
+    def summary(self, sql: str) -> Future:
+        """Future of the result summary of 'sql', shared by all candidates with the same normalized SQL."""
+        normalized = normalize_sql(sql)
+        with self._lock:
+            future = self._summaries.get(normalized)
+            if future is not None:
+                self.reused += 1
+                return future
+            cached = self.cache.get_many([normalized]).get(normalized) if self.cache is not None else None
+            if cached is not None:
+                self.reused += 1
+                future = Future()
+                future.set_result(cached)
+            else:
+                self.executed += 1
+                future = self._executor.submit(self._execute, normalized, sql)
+            self._summaries[normalized] = future
+            return future
+
+    def vote(self, candidates: list) -> dict:
+        """
+        candidates: raw model outputs for one question, in sampling order.
+        Returns {"content", "sql", "votes", "samples", "distinct_results"} where
+        'content' is the raw output of the winner. Only candidates whose query ran
+        successfully vote; ties go to the earliest candidate. If no query ran,
+        the first candidate is returned.
+        """
+        sqls = [clean_prediction(candidate) for candidate in candidates]
+        futures = [None if is_null_query(sql) else self.summary(sql) for sql in sqls]
+
+        groups = {}
+        for index, future in enumerate(futures):
+            if future is None:
+                continue
+            summary = future.result()
+            if summary["status"] == "ok":
+                groups.setdefault(summary["digest"], []).append(index)
+
+        winner = max(groups.values(), key=lambda indices: (len(indices), -indices[0]), default=[0])
+        with self._lock:
+            self.votes += 1
+            if len(groups) == 1 and len(winner) == len(candidates):
+                self.agreements += 1
+        return {"content": candidates[winner[0]], "sql": sqls[winner[0]], "votes": len(winner) if groups else 0,
+                "samples": len(candidates), "distinct_results": len(groups)}
+
+    def report(self) -> str:
+        return (f"Self-consistency: {self.votes} questions voted, {self.agreements} with all samples agreeing; "
+                f"{self.executed} distinct queries executed, {self.reused} executions saved by deduplication.")
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        while not self._connections.empty():
+            self._connections.get().close()
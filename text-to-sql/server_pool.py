@@ -0,0 +1,140 @@
+# server_pool.py
+import time
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import requests
+
+
+class Backend:
+    """One llama-server instance and its load/health bookkeeping."""
+
+    def __init__(self, url: str, n_slots: int = None):
+        self.url = url
+        # Free llama-server slot ids (None when slots are not tracked and the server picks one)
+        self.free_slots = list(range(n_slots)) if n_slots else None
+        parts = urlsplit(url)
+        self.health_url = f"{parts.scheme}://{parts.netloc}/health"
+        self.props_url = f"{parts.scheme}://{parts.netloc}/props"
+        self.outstanding = 0
+        self.healthy = True
+        self.down_since = None
+        self.completed = 0
+        self.failed = 0
+
+
+class ServerPool:
+    """
+    Dispatches requests over several llama-server endpoints.
+
+    acquire() hands out the healthy backend with the fewest outstanding requests
+    (least-outstanding-requests balancing). A backend that fails at the transport
+    level is marked down and skipped; once 'health_interval' seconds have passed
+    it is probed via /health and brought back when the server answers 200.
+
+    With slots_per_server, acquire() hands out a free (backend, slot) pair and
+    waits while every slot is busy, so two requests never share a slot. A thread
+    gets its previous pair back whenever it is free, which keeps the slot's
+    cached prompt prefix warm for that thread.
+    """
+
+    def __init__(self, urls: list, session=None, health_interval: float = 10.0, health_timeout: float = 2.0,
+                 slots_per_server: int = None):
+        if not urls:
+            raise ValueError("ServerPool needs at least one server URL")
+        self.backends = [Backend(url, slots_per_server) for url in urls]
+        self.session = session or requests.Session()
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self._lock = threading.Lock()
+        self._slot_freed = threading.Condition(self._lock)
+        self._local = threading.local()
+
+    def check_health(self, backend: Backend) -> bool:
+        try:
+            healthy = self.session.get(backend.health_url, timeout=self.health_timeout).status_code == 200
+        except requests.exceptions.RequestException:
+            healthy = False
+        with self._lock:
+            backend.healthy = healthy
+            backend.down_since = None if healthy else time.monotonic()
+        return healthy
+
+    def check_all(self) -> int:
+        """Probes every backend and returns the number of healthy ones."""
+        return sum(self.check_health(backend) for backend in self.backends)
+
+    def _recheck_down_backends(self):
+        now = time.monotonic()
+        with self._lock:
+            due = [b for b in self.backends
+                   if not b.healthy and b.down_since is not None and now - b.down_since >= self.health_interval]
+            for backend in due:
+                # Push the next probe out so concurrent threads don't probe the same backend
+                backend.down_since = now
+        for backend in due:
+            self.check_health(backend)
+
+    def mark_down(self, backend: Backend):
+        with self._slot_freed:
+            backend.healthy = False
+            backend.down_since = time.monotonic()
+            # Threads waiting for one of its slots pick another backend (or fail if none is left)
+            self._slot_freed.notify_all()
+
+    def _pick(self, healthy: list):
+        """(backend, slot) for the calling thread, or None while every slot is busy. Called under the lock."""
+        previous = getattr(self._local, "previous", None)
+        if previous is not None:
+            backend, slot = previous
+            if backend in healthy and (slot is None or slot in backend.free_slots):
+                return previous
+        if healthy[0].free_slots is not None:
+            healthy = [b for b in healthy if b.free_slots]
+            if not healthy:
+                return None
+        backend = min(healthy, key=lambda b: (b.outstanding, b.completed + b.failed))
+        return backend, (min(backend.free_slots) if backend.free_slots is not None else None)
+
+    @contextmanager
+    def acquire(self):
+        """
+        Yields (backend, slot) for the least-loaded healthy backend and keeps its
+        outstanding count while in use. 'slot' is a free slot id of that backend,
+        or None when slots are not tracked.
+        """
+        self._recheck_down_backends()
+        with self._slot_freed:
+            while True:
+                healthy = [b for b in self.backends if b.healthy]
+                if not healthy:
+                    raise requests.exceptions.ConnectionError("No healthy llama-server backend available")
+                picked = self._pick(healthy)
+                if picked is not None:
+                    break
+                self._slot_freed.wait(self.health_interval)
+            backend, slot = picked
+            backend.outstanding += 1
+            if slot is not None:
+                backend.free_slots.remove(slot)
+            self._local.previous = picked
+        succeeded = False
+        try:
+            yield backend, slot
+            succeeded = True
+        finally:
+            with self._slot_freed:
+                backend.outstanding -= 1
+                if slot is not None:
+                    backend.free_slots.append(slot)
+                    self._slot_freed.notify()
+                if succeeded:
+                    backend.completed += 1
+                else:
+                    backend.failed += 1
+
+    def report(self) -> str:
+        return "\n".join(
+            f"  {b.url}: {'up' if b.healthy else 'down'}, {b.completed} completed, {b.failed} failed"
+            for b in self.backends)
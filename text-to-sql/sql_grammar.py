@@ -0,0 +1,162 @@
+# sql_grammar.py
+import os
+import re
+import sys
+import json
+import hashlib
+import sqlite3
+import argparse
+
+sys.stdout.reconfigure(encoding='utf-8')
+
+# --- Configuration ---
+SCHEMA_PATH = "./evaluation_data/tables.json"
+GRAMMAR_CACHE_DIR = "./input/res/grammars"
+# Bump when GRAMMAR_TEMPLATE changes, so cached grammars are rebuilt
+GRAMMAR_VERSION = 1
+
+FUNCTIONS = ("count", "sum", "avg", "min", "max", "total", "group_concat", "abs", "round", "length", "lower",
+             "upper", "substr", "trim", "instr", "replace", "coalesce", "ifnull", "nullif", "datetime", "date",
+             "time", "strftime", "julianday", "dense_rank", "rank", "percent_rank", "row_number")
+TYPE_NAMES = ("integer", "int", "real", "float", "numeric", "text")
+
+# GBNF for SQLite SELECT statements (llama.cpp grammar syntax). Quoted all-caps words are
+# keywords and accept both upper and lower case; {tables}, {columns}, {functions} and
+# {types} are filled from the schema. The answer is one statement ending in ';' (no
+# CTEs) or "null" for unanswerable questions. Table names must exist and aliases can be
+# any identifier, but a column reference must be a real column name (optionally
+# qualified) or a derived column named like C1 (T1.C1), so invented tables and columns
+# cannot be written.
+GRAMMAR_TEMPLATE = r'''root ::= ws ( query ws ";" | "null" )
+query ::= select-core ( ws compound-op ws select-core )* ( ws order-by )? ( ws limit )?
+compound-op ::= "UNION" sp "ALL" | "UNION" | "INTERSECT" | "EXCEPT"
+select-core ::= "SELECT" sp ( "DISTINCT" sp )? result-list ( ws "FROM" sp from-clause )? ( ws "WHERE" sp expr )? ( ws "GROUP" sp "BY" sp expr-list ( ws "HAVING" sp expr )? )?
+result-list ::= result-column ( ws "," ws result-column )*
+result-column ::= "*" | identifier ws "." ws "*" | expr ( sp ( "AS" sp )? identifier )?
+from-clause ::= table-or-subquery ( join-clause )*
+table-or-subquery ::= ( table-name | "(" ws query ws ")" ) ( sp ( "AS" sp )? identifier )?
+join-clause ::= ws "," ws table-or-subquery | sp join-operator sp table-or-subquery ( sp "ON" sp expr )?
+join-operator ::= ( "LEFT" sp ( "OUTER" sp )? | "INNER" sp | "CROSS" sp )? "JOIN"
+order-by ::= "ORDER" sp "BY" sp ordering-term ( ws "," ws ordering-term )*
+ordering-term ::= expr ( sp ( "ASC" | "DESC" ) )?
+limit ::= "LIMIT" sp number ( sp "OFFSET" sp number )?
+expr-list ::= expr ( ws "," ws expr )*
+expr ::= term ( expr-tail )*
+expr-tail ::= ws binary-operator ws term | sp word-operator sp term | sp ( "NOT" sp )? "IN" ws "(" ws ( query | expr-list ) ws ")" | sp ( "NOT" sp )? "BETWEEN" sp term sp "AND" sp term | sp "IS" sp ( "NOT" sp )? "NULL"
+binary-operator ::= "||" | "*" | "/" | "%" | "+" | "-" | "<=" | ">=" | "<>" | "!=" | "==" | "=" | "<" | ">"
+word-operator ::= "AND" | "OR" | ( "NOT" sp )? "LIKE" | ( "NOT" sp )? "GLOB" | "IS" ( sp "NOT" )?
+term ::= ( "-" | "+" ) ws term | "NOT" sp term | "EXISTS" ws "(" ws query ws ")" | "(" ws ( query | expr-list ) ws ")" | case-expr | cast-expr | function-call | literal | column-ref
+case-expr ::= "CASE" ( sp expr )? ( sp "WHEN" sp expr sp "THEN" sp expr )+ ( sp "ELSE" sp expr )? sp "END"
+cast-expr ::= "CAST" ws "(" ws expr sp "AS" sp type-name ws ")"
+function-call ::= function-name ws "(" ws ( "*" | ( "DISTINCT" sp )? expr-list )? ws ")" ( sp "OVER" ws "(" ws window ws ")" )?
+window ::= ( "PARTITION" sp "BY" sp expr-list )? ( ws order-by )?
+column-ref ::= ( identifier ws "." ws )? ( column-name | derived-column )
+identifier ::= [a-zA-Z_] [a-zA-Z0-9_]*
+derived-column ::= [a-zA-Z] [0-9]+
+literal ::= number | string | "NULL" | "CURRENT_TIMESTAMP" | "CURRENT_DATE" | "CURRENT_TIME"
+number ::= [0-9]+ ( "." [0-9]+ )?
+string ::= "'" ( [^'] | "''" )* "'"
+table-name ::= {tables}
+column-name ::= {columns}
+function-name ::= {functions}
+type-name ::= {types}
+sp ::= [ \t\n]+
+ws ::= [ \t\n]*
+'''
+
+KEYWORD_PATTERN = re.compile(r'"([A-Z][A-Z_]+)"')
+
+
+def _literal(text: str) -> str:
+    return '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def _alternation(words) -> str:
+    """GBNF alternation of the words; longer words first, so a word is never cut at a shared prefix."""
+    return " | ".join(_literal(word) for word in sorted(set(words), key=lambda w: (-len(w), w)))
+
+
+def _keyword(match: re.Match) -> str:
+    word = match.group(1)
+    return f'( "{word}" | "{word.lower()}" )'
+
+
+def _read_schema(conn: sqlite3.Connection) -> dict:
+    tables = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY rowid")]
+    return {table: [row[0] for row in conn.execute("SELECT name FROM pragma_table_info(?)", (table,))]
+            for table in tables}
+
+
+def schema_from_tables_json(tables_path: str) -> dict:
+    """{table: [columns]} from a Spider-style tables.json (first database)."""
+    with open(tables_path, 'r', encoding='utf-8') as f:
+        schema_data = json.load(f)[0]
+    schema = {table: [] for table in schema_data['table_names_original']}
+    for table_index, column in schema_data['column_names_original']:
+        if table_index >= 0:
+            schema[schema_data['table_names_original'][table_index]].append(column)
+    return schema
+
+
+def load_schema(schema_path: str) -> dict:
+    """{table: [columns]} from tables.json, a DDL script like mimic_iv.sql or a SQLite database."""
+    if schema_path.endswith(".json"):
+        return schema_from_tables_json(schema_path)
+    if schema_path.endswith(".sql"):
+        with open(schema_path, 'r', encoding='utf-8') as f:
+            ddl = f.read()
+        conn = sqlite3.connect(":memory:")
+        conn.executescript(ddl)
+    else:
+        conn = sqlite3.connect(f"file:{schema_path}?mode=ro", uri=True)
+    try:
+        return _read_schema(conn)
+    finally:
+        conn.close()
+
+
+def build_grammar(schema: dict) -> str:
+    """GBNF grammar for SELECT statements over the given {table: [columns]}."""
+    columns = {column for table_columns in schema.values() for column in table_columns}
+    grammar = KEYWORD_PATTERN.sub(_keyword, GRAMMAR_TEMPLATE)
+    return grammar.format(tables=_alternation(schema), columns=_alternation(columns),
+                          functions=" | ".join(f'( {_literal(name.upper())} | {_literal(name)} )' for name in FUNCTIONS),
+                          types=" | ".join(f'( {_literal(name.upper())} | {_literal(name)} )' for name in TYPE_NAMES))
+
+
+def schema_hash(schema: dict) -> str:
+    payload = json.dumps({"version": GRAMMAR_VERSION, "schema": schema}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def grammar_for_schema(schema: dict, cache_dir: str = GRAMMAR_CACHE_DIR) -> str:
+    """The grammar for 'schema', read from cache_dir if it was built before for the same schema."""
+    grammar_path = os.path.join(cache_dir, f"sql_{schema_hash(schema)}.gbnf")
+    if os.path.exists(grammar_path):
+        with open(grammar_path, 'r', encoding='utf-8') as f:
+            return f.read()
+    grammar = build_grammar(schema)
+    os.makedirs(cache_dir, exist_ok=True)
+    temp_path = grammar_path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(grammar)
+    os.replace(temp_path, grammar_path)
+    return grammar
+
+
+def main():
+    """Writes the grammar for a schema file (use it with llama-server's --grammar-file or the 'grammar' field)."""
+    parser = argparse.ArgumentParser(description="Generate a GBNF grammar for SQL over a database schema.")
+    parser.add_argument("--schema", default=SCHEMA_PATH, help="tables.json, a .sql DDL script or a SQLite database.")
+    parser.add_argument("--cache_dir", default=GRAMMAR_CACHE_DIR)
+    args = parser.parse_args()
+
+    schema = load_schema(args.schema)
+    grammar = grammar_for_schema(schema, args.cache_dir)
+    print(f"✅ Grammar for {len(schema)} tables and {sum(len(c) for c in schema.values())} columns "
+          f"({len(grammar)} characters): {os.path.join(args.cache_dir, f'sql_{schema_hash(schema)}.gbnf')}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# streaming_client.py
+import json
+import time
+import requests
+
+from clean_predictions import extract_sql_cleverly
+
+
+def _has_terminating_semicolon(sql: str) -> bool:
+    """True if the SQL contains a ';' that is not inside a string literal."""
+    in_string = False
+    for char in sql:
+        if char == "'":
+            in_string = not in_string
+        elif char == ";" and not in_string:
+            return True
+    return False
+
+
+def sql_is_complete(text: str) -> bool:
+    """
+    Decides whether the text generated so far already contains a finished query,
+    using the same cascade as clean_predictions.extract_sql_cleverly:
+    a closed ```sql (or ```) fence, otherwise the last SELECT terminated by ';'.
+    Nothing counts as finished while a <think> block or a code fence is still open.
+    """
+    lowered = text.lower()
+    if lowered.count("<think>") > lowered.count("</think>"):
+        return False
+    fences = text.count("```")
+    if fences:
+        return fences % 2 == 0 and bool(extract_sql_cleverly(text))
+    sql = extract_sql_cleverly(text)
+    return bool(sql) and _has_terminating_semicolon(sql)
+
+
+def stream_completion(server_url: str, data: dict, session=None, timeout=None) -> dict:
+    """
+    Sends a streaming (SSE) request to llama-server's /completion endpoint and reads
+    the tokens as they arrive. As soon as a complete SQL statement has been produced
+    the connection is closed, which makes the server cancel the rest of the generation.
+
+    Returns a dict shaped like the non-streaming response ('content', 'timings',
+    'tokens_evaluated') with extra keys: 'stopped_early', 'tokens_streamed' and the
+    client-side 'first_token_ms' and 'stream_ms' (time to the first and to the last
+    token read). 'timings_per_token' makes the server attach timings to every chunk,
+    so a stopped stream keeps the timings of its last chunk; 'tokens_evaluated' is
+    then cache_n + prompt_n (servers without per-token timings leave both out).
+    """
+    http = session or requests
+    payload = dict(data, stream=True, timings_per_token=True)
+    content = []
+    result = {"stopped_early": False, "tokens_streamed": 0}
+
+    start = time.perf_counter()
+    response = http.post(server_url, json=payload, stream=True, timeout=timeout)
+    try:
+        response.raise_for_status()
+        for line in response.iter_lines(chunk_size=None):
+            if not line or not line.startswith(b"data:"):
+                continue
+            chunk = json.loads(line[len(b"data:"):].decode('utf-8'))
+            piece = chunk.get("content", "")
+            content.append(piece)
+            result["tokens_streamed"] += 1
+            result["stream_ms"] = (time.perf_counter() - start) * 1000
+            if result["tokens_streamed"] == 1:
+                result["first_token_ms"] = result["stream_ms"]
+            if chunk.get("timings"):
+                result["timings"] = chunk["timings"]
+
+            if chunk.get("stop"):
+                # The final chunk carries the timing and token statistics
+                result.update({k: v for k, v in chunk.items() if k != "content"})
+                break
+            # Only re-check when the new piece could have finished a statement
+            if ("`" in piece or ";" in piece) and sql_is_complete("".join(content)):
+                result["stopped_early"] = True
+                break
+    finally:
+        response.close()
+
+    result["content"] = "".join(content)
+    timings = result.get("timings") or {}
+    if result.get("tokens_evaluated") is None and "cache_n" in timings and "prompt_n" in timings:
+        result["tokens_evaluated"] = timings["cache_n"] + timings["prompt_n"]
+    return result
@@ -0,0 +1,6 @@
+# conftest.py
+import os
+import sys
+
+# The scripts in text-to-sql/ are flat modules run from the repository root; make them importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
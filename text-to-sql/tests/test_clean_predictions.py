@@ -0,0 +1,31 @@
+# test_clean_predictions.py
+from clean_predictions import clean_prediction, extract_sql_cleverly
+
+
+def test_alias_line_is_not_cut_as_prose():
+    raw = ("SELECT inputevents.amount FROM inputevents JOIN d_items i ON inputevents.itemid = i.itemid WHERE\n"
+           "i.label = 'sodium chloride 0.9%' AND inputevents.subject_id = 10020740;")
+    assert clean_prediction(raw) == ("SELECT inputevents.amount FROM inputevents JOIN d_items i ON "
+                                     "inputevents.itemid = i.itemid WHERE i.label = 'sodium chloride 0.9%' "
+                                     "AND inputevents.subject_id = 10020740;")
+
+
+def test_alias_followed_by_operator_is_not_cut_as_prose():
+    raw = "SELECT t.value FROM chartevents this\nWHERE this.itemid = 220045\nAND\nthe = 1"
+    assert clean_prediction(raw) == "SELECT t.value FROM chartevents this WHERE this.itemid = 220045 AND the = 1"
+
+
+def test_prose_after_statement_is_dropped():
+    raw = "SELECT count(*) FROM patients;\nThis query selects the number of patients."
+    assert extract_sql_cleverly(raw).startswith("SELECT count(*) FROM patients;")
+    assert clean_prediction(raw) == "SELECT count(*) FROM patients;"
+
+
+def test_prose_after_statement_without_semicolon_is_dropped():
+    raw = "SELECT gender FROM patients WHERE subject_id = 10014729\nThe query returns the gender."
+    assert clean_prediction(raw) == "SELECT gender FROM patients WHERE subject_id = 10014729"
+
+
+def test_subquery_is_kept():
+    raw = "SELECT cost FROM cost WHERE event_id IN (SELECT row_id FROM prescriptions WHERE drug = 'lactulose')"
+    assert clean_prediction(raw) == raw
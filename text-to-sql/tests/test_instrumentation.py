@@ -0,0 +1,32 @@
+# test_instrumentation.py
+from instrumentation import Tracer, load_events, percentile
+
+
+def test_percentile_is_nearest_rank():
+    values = list(range(1, 11))
+    assert percentile(values, 50) == 5
+    assert percentile(values, 90) == 9
+    assert percentile(values, 95) == 10
+    assert percentile(values, 99) == 10
+    assert percentile(values, 100) == 10
+    assert percentile(values, 0) == 1
+
+
+def test_percentile_of_four_values():
+    assert percentile([0.4, 0.1, 0.3, 0.2], 50) == 0.2
+    # ceil(0.75 * 4) = 3rd value; rounding 0.75 * 4 + 0.5 up returned the 4th
+    assert percentile([0.4, 0.1, 0.3, 0.2], 75) == 0.3
+
+
+def test_percentile_of_empty_list():
+    assert percentile([], 95) == 0.0
+
+
+def test_trace_events_are_written_before_close(tmp_path):
+    trace_path = str(tmp_path / "trace.jsonl")
+    tracer = Tracer(trace_path, label="test")
+    with tracer.span("prompt"):
+        pass
+    events = load_events(trace_path)
+    assert [event["type"] for event in events] == ["run", "span"]
+    tracer.close()
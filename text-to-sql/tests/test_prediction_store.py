@@ -0,0 +1,35 @@
+# test_prediction_store.py
+import json
+
+from benchmark_runner import iter_pending_items
+from prediction_store import PredictionJournal
+
+
+def test_skipped_items_are_not_retried_on_resume(tmp_path):
+    prediction_path = str(tmp_path / "prediction.json")
+    journal = PredictionJournal(prediction_path)
+    journal.append("a", "SELECT 1;")
+    journal.append("b", "", skipped="over budget")
+    journal.close()
+
+    resumed = PredictionJournal(prediction_path)
+    predictions = resumed.load()
+    assert predictions == {"a": "SELECT 1;", "b": ""}
+    assert resumed.skipped == {"b": "over budget"}
+    benchmark = [{"id": "a", "question": "q1"}, {"id": "b", "question": "q2"}, {"id": "c", "question": "q3"}]
+    assert [item["id"] for _, item in iter_pending_items(benchmark, predictions)] == ["c"]
+
+    resumed.compact(predictions)
+    with open(prediction_path, encoding='utf-8') as f:
+        assert json.load(f) == {"a": "SELECT 1;", "b": ""}
+
+
+def test_later_prediction_clears_skip(tmp_path):
+    journal = PredictionJournal(str(tmp_path / "prediction.json"))
+    journal.append("b", "", skipped="over budget")
+    journal.append("b", "SELECT 2;")
+    journal.close()
+
+    resumed = PredictionJournal(str(tmp_path / "prediction.json"))
+    assert resumed.load() == {"b": "SELECT 2;"}
+    assert resumed.skipped == {}
@@ -0,0 +1,43 @@
+# test_schema_index.py
+import os
+import sqlite3
+
+import pytest
+
+from rag_components import get_dynamic_schema
+from rag_components_with_schema_pruning import get_schema_index
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+SCHEMA_PATH = os.path.join(REPO_ROOT, "evaluation_data", "mimic_iv.sql")
+TABLES_JSON_PATH = os.path.join(REPO_ROOT, "evaluation_data", "tables.json")
+
+
+@pytest.fixture
+def schema_ddl():
+    with open(SCHEMA_PATH, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+@pytest.fixture
+def database_schema(tmp_path, schema_ddl):
+    """get_dynamic_schema's sqlite_master text (no ';'), as indexed by run_benchmark_rag."""
+    db_path = str(tmp_path / "mimic_iv.sqlite")
+    conn = sqlite3.connect(db_path)
+    conn.executescript(schema_ddl)
+    conn.close()
+    return get_dynamic_schema(db_path)
+
+
+def test_scores_tables_of_schema_read_from_database(database_schema):
+    assert ";" not in database_schema
+    index = get_schema_index(database_schema, TABLES_JSON_PATH)
+    assert len(index.table_order) == 17
+    scores = index.score_tables("what was the last heart rate of patient 10014729 in the icu?")
+    assert scores
+    assert {"chartevents", "icustays"} <= set(scores)
+
+
+def test_schema_file_and_database_give_the_same_columns(schema_ddl, database_schema):
+    from_file = get_schema_index(schema_ddl, TABLES_JSON_PATH)
+    from_database = get_schema_index(database_schema, TABLES_JSON_PATH)
+    assert from_file.columns == from_database.columns
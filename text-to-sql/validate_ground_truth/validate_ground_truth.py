@@ -1,91 +1,144 @@
+# validate_ground_truth.py
+import os
+import sys
 import json
+import time
 import sqlite3
-import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from evaluate_execution import connect_read_only, execute_query
+
+# --- Default File Paths (override on the command line) ---
+DB_PATH = "./evaluation_data/mimic_iv.sqlite"
+GROUND_TRUTH_FILE = "./evaluation_data/annotated.json"
+REPORT_FILE = "./text-to-sql/validate_ground_truth/validate_ground_truth_report.json"
+QUERY_TIMEOUT_SECONDS = 60
+
+_worker_conn = None
+_worker_mode = None
+_worker_timeout = None
+
+
+def _init_worker(db_path: str, mode: str, timeout: float):
+    global _worker_conn, _worker_mode, _worker_timeout
+    _worker_conn = connect_read_only(db_path)
+    _worker_mode = mode
+    _worker_timeout = timeout
+
+
+def validate_shard(shard: list) -> list:
+    """
+    Validates one shard of (id, query) pairs on the worker's own read-only connection.
+    In 'explain' mode the query is only planned (EXPLAIN QUERY PLAN), which checks
+    syntax, tables and columns without running it; 'execute' mode runs it fully.
+    Gold queries are run without the evaluator's MAX_RESULT_ROWS cap, since a
+    large result is not an error; rows are only counted, not hashed.
+    """
+    results = []
+    for query_id, query_sql in shard:
+        start = time.perf_counter()
+        if _worker_mode == "explain":
+            try:
+                _worker_conn.execute("EXPLAIN QUERY PLAN " + query_sql).fetchall()
+                status, error, row_count = "ok", None, None
+            except (sqlite3.Error, sqlite3.Warning) as e:
+                status, error, row_count = "error", str(e), None
+        else:
+            summary = execute_query(_worker_conn, query_sql, _worker_timeout, max_rows=None, digest_rows=False)
+            status, error, row_count = summary["status"], summary["error"], summary["row_count"]
+        results.append({
+            "id": query_id,
+            "status": status,
+            "error": error,
+            "row_count": row_count,
+            "seconds": round(time.perf_counter() - start, 6),
+        })
+    return results
+
 
 def validate_ground_truth_queries():
     """
-    Connects to the MIMIC-IV database and attempts to execute every
-    ground-truth query from the provided JSON file to check for syntax errors.
+    Attempts to plan or execute every ground-truth query from the provided JSON
+    file against the MIMIC-IV database, sharded across worker processes.
     """
-    # --- File Paths (Adjust if necessary) ---
-    db_path = r"C:\Uni\Bachelorarbeit\bachelor_thesis_project\evaluation_data\mimic_iv.sqlite"
-    ground_truth_file = r"C:\Uni\Bachelorarbeit\bachelor_thesis_project\evaluation_data\annotated.json"
+    parser = argparse.ArgumentParser(description="Validate ground-truth SQL against the MIMIC-IV database.")
+    parser.add_argument("--db_path", default=DB_PATH)
+    parser.add_argument("--data_file", default=GROUND_TRUTH_FILE)
+    parser.add_argument("--report_file", default=REPORT_FILE)
+    parser.add_argument("--mode", choices=("explain", "execute"), default="execute",
+                        help="'explain' only checks syntax/schema with EXPLAIN QUERY PLAN; 'execute' runs every query.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--timeout", type=float, default=QUERY_TIMEOUT_SECONDS)
+    args = parser.parse_args()
 
     # --- Verification ---
-    if not os.path.exists(db_path):
-        print(f"ERROR: Database file not found at '{db_path}'")
+    if not os.path.exists(args.db_path):
+        print(f"ERROR: Database file not found at '{args.db_path}'")
         return
-    if not os.path.exists(ground_truth_file):
-        print(f"ERROR: Ground truth file not found at '{ground_truth_file}'")
+    if not os.path.exists(args.data_file):
+        print(f"ERROR: Ground truth file not found at '{args.data_file}'")
         return
 
-    print(f"Connecting to database: {db_path}")
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-
-    print(f"Loading ground truth queries from: {ground_truth_file}\n")
-    with open(ground_truth_file, 'r', encoding='utf-8') as f:
+    print(f"Loading ground truth queries from: {args.data_file}")
+    with open(args.data_file, 'r', encoding='utf-8') as f:
         data = json.load(f)
 
-    # --- Initialization ---
-    total_queries = 0
-    successful_queries = 0
-    failed_queries = []
-
-    # --- Execution Loop ---
-    for i, item in enumerate(data):
-        query_id = item.get("id")
-        query_sql = item.get("query")
-
-        if not query_id or not query_sql:
-            continue
-
-        # Skip unanswerable questions, which are marked with the string 'null'
-        if query_sql == 'null':
-            continue
-
-        total_queries += 1
-
-        try:
-            # We execute the query but don't need to fetch the results.
-            # We just want to see if it's valid SQL that the DB can parse.
-            cursor.execute(query_sql)
-            successful_queries += 1
-            # Print a dot for progress
+    # Skip unanswerable questions, which are marked with the string 'null'
+    queries = [(item["id"], item["query"]) for item in data
+               if item.get("id") and item.get("query") and item["query"] != 'null']
+
+    # Round-robin shards, several per worker so slow queries don't leave workers idle
+    workers = max(1, args.workers or 1)
+    n_shards = min(len(queries), workers * 4) or 1
+    shards = [queries[i::n_shards] for i in range(n_shards)]
+
+    print(f"Validating {len(queries)} queries in '{args.mode}' mode with {workers} workers...")
+    start = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(args.db_path, args.mode, args.timeout)) as pool:
+        for shard_results in pool.map(validate_shard, shards):
+            results.extend(shard_results)
             print('.', end='', flush=True)
+    elapsed = time.perf_counter() - start
 
-        except sqlite3.Error as e:
-            # If an error occurs, store the details
-            failed_queries.append({
-                "id": query_id,
-                "query": query_sql,
-                "error": str(e)
-            })
-            # Print an 'F' for failure
-            print('F', end='', flush=True)
-        
-        # Print a newline every 100 queries to keep the output clean
-        if (i + 1) % 100 == 0:
-            print(f"  ({i+1}/{len(data)})")
-
+    order = {query_id: i for i, (query_id, _) in enumerate(queries)}
+    results.sort(key=lambda r: order[r["id"]])
+    failed_queries = [r for r in results if r["status"] != "ok"]
+    sql_by_id = dict(queries)
 
     # --- Reporting ---
     print("\n\n--- Ground Truth Validation Complete ---")
-    print(f"Total Queries Tested: {total_queries}")
-    print(f"Successful Executions: {successful_queries}")
-    print(f"Failed Executions: {len(failed_queries)}")
+    print(f"Mode: {args.mode}")
+    print(f"Total Queries Tested: {len(results)}")
+    print(f"Successful: {len(results) - len(failed_queries)}")
+    print(f"Failed: {len(failed_queries)}")
+    print(f"Time: {elapsed:.2f}s")
     print("----------------------------------------\n")
 
     if failed_queries:
         print("--- Details of Failed Queries ---")
         for failure in failed_queries:
             print(f"ID: {failure['id']}")
-            print(f"  Query: {failure['query']}")
+            print(f"  Query: {sql_by_id[failure['id']]}")
             print(f"  Error: {failure['error']}\n")
     else:
-        print("🎉 All ground-truth queries executed successfully!")
-
-    conn.close()
+        print("🎉 All ground-truth queries validated successfully!")
+
+    os.makedirs(os.path.dirname(args.report_file) or ".", exist_ok=True)
+    with open(args.report_file, 'w', encoding='utf-8') as f:
+        json.dump({
+            "mode": args.mode,
+            "db_path": args.db_path,
+            "data_file": args.data_file,
+            "total": len(results),
+            "failed": len(failed_queries),
+            "elapsed_seconds": elapsed,
+            "results": results,
+        }, f, indent=2)
+    print(f"Report saved to: {args.report_file}")
 
 if __name__ == "__main__":
     validate_ground_truth_queries()